@@ -16,10 +16,14 @@ eventlet.monkey_patch() # تطبيق monkey-patching بواسطة eventlet
 """
 
 from flask import Flask
+from werkzeug.middleware.proxy_fix import ProxyFix
 from flask_sqlalchemy import SQLAlchemy
 from sqlalchemy.orm import DeclarativeBase
 from flask_login import LoginManager
 from flask_socketio import SocketIO
+from services.user_cache import make_user_cache
+from services.socketio_queue import socketio_queue_options, SOCKETIO_MESSAGE_QUEUE
+from services.metrics import TimedQueuePool, instrument_flask, register_pool_gauges
 
 # تهيئة السجلات
 logging.basicConfig(level=logging.INFO)
@@ -35,6 +39,10 @@ db = SQLAlchemy(model_class=Base)
 app = Flask(__name__)
 # إعدادات التخزين المؤقت لملفات Static (سنة واحدة)
 app.config['SEND_FILE_MAX_AGE_DEFAULT'] = 31536000
+# خلف الوكيل العكسي (Render) يكون remote_addr عنوان الوكيل؛ ProxyFix يأخذ عنوان العميل الحقيقي
+# من X-Forwarded-For، وهو مفتاح تحديد معدل الطلبات للزوار غير المسجلين.
+# TRUSTED_PROXIES عدد الوكلاء الموثوقين أمام التطبيق (0 عند التشغيل بدون وكيل)
+app.wsgi_app = ProxyFix(app.wsgi_app, x_for=int(os.environ.get('TRUSTED_PROXIES', 1)), x_proto=1)
 # تعطيل إعادة تحميل القوالب تلقائياً في بيئة الإنتاج
 app.config['TEMPLATES_AUTO_RELOAD'] = False
 # مفتاح سري لإدارة الجلسات، يُفضل أخذه من متغير بيئة
@@ -50,9 +58,32 @@ app.config["SQLALCHEMY_DATABASE_URI"] = os.environ.get("DATABASE_URL")
 # تعطيل تتبع تعديلات الكائنات في SQLAlchemy لتجنب استهلاك الذاكرة غير الضروري
 app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
 
+# إعدادات تجمع اتصالات قاعدة البيانات (قابلة للتعديل من متغيرات البيئة)
+# DB_POOL_SIZE: عدد الاتصالات الدائمة، DB_MAX_OVERFLOW: اتصالات إضافية مؤقتة عند الضغط،
+# DB_POOL_TIMEOUT: مدة انتظار اتصال حر (ثوانٍ)، DB_POOL_RECYCLE: إعادة فتح الاتصالات الأقدم من هذه المدة،
+# DB_POOL_PRE_PING: التحقق من صلاحية الاتصال قبل استخدامه (مفيد بعد انقطاع قاعدة البيانات)
+engine_options = {
+    "pool_pre_ping": os.environ.get("DB_POOL_PRE_PING", "true").lower() in ("1", "true", "yes"),
+    "pool_recycle": int(os.environ.get("DB_POOL_RECYCLE", 1800)),
+}
+if not (app.config["SQLALCHEMY_DATABASE_URI"] or "").startswith("sqlite"):
+    # خيارات حجم التجمع غير مدعومة مع مجمعات SQLite الخاصة
+    engine_options.update({
+        # QueuePool يسجل زمن انتظار كل اتصال في مقياس yasmin_db_pool_checkout_wait_seconds
+        "poolclass": TimedQueuePool,
+        "pool_size": int(os.environ.get("DB_POOL_SIZE", 10)),
+        "max_overflow": int(os.environ.get("DB_MAX_OVERFLOW", 20)),
+        "pool_timeout": int(os.environ.get("DB_POOL_TIMEOUT", 30)),
+    })
+app.config["SQLALCHEMY_ENGINE_OPTIONS"] = engine_options
+
 # تهيئة قاعدة البيانات مع إعدادات التطبيق
 db.init_app(app)
 
+# مقاييس Prometheus على /metrics: زمن كل طلب HTTP وحالة تجمع الاتصالات (انظر services/metrics.py)
+instrument_flask(app)
+register_pool_gauges(lambda: db.engine.pool)
+
 # === تمت إزالة كتلة db.create_all() من هنا ===
 # يجب تشغيل db.create_all() أو migrations كخطوة منفصلة قبل بدء الخادم الرئيسي
 # انظر التعليمات أدناه حول إنشاء سكربت create_tables.py وتعديل أمر التشغيل في Render
@@ -68,22 +99,39 @@ login_manager.login_view = 'login'
 login_manager.login_message = 'يرجى تسجيل الدخول للوصول إلى هذه الصفحة.'
 
 # تهيئة SocketIO للاتصالات في الوقت الحقيقي (Real-time communication)
+# هذا هو خادم Socket.IO الوحيد في التطبيق؛ routes.py وكل الخدمات تستورده من هنا.
+# في الإنتاج يعمل مع عامل eventlet في gunicorn (انظر render.yaml.txt)، ومع أكثر من عملية
+# أو خادم يُضبط SOCKETIO_MESSAGE_QUEUE (مثلاً redis://...) لتصل رسائل الغرف إلى كل العمليات
+SOCKETIO_DEBUG_LOG = os.environ.get('SOCKETIO_DEBUG_LOG', 'false').lower() in ('1', 'true', 'yes')
 socketio = SocketIO(
     app,
     cors_allowed_origins="*", # السماح بالطلبات من أي أصل (للتطوير/الاختبار، قد تحتاج لتحديد أصول معينة في الإنتاج)
     async_mode='eventlet', # استخدام eventlet كوضع غير متزامن
-    logger=True, # تمكين سجلات SocketIO
-    engineio_logger=True, # تمكين سجلات EngineIO
+    # سجل كل حزمة Socket.IO مكلف؛ عدادات /metrics تغني عنه، ويمكن تفعيله للتشخيص بـ SOCKETIO_DEBUG_LOG=1
+    logger=SOCKETIO_DEBUG_LOG, # سجلات SocketIO
+    engineio_logger=SOCKETIO_DEBUG_LOG, # سجلات EngineIO
     ping_timeout=60, # المهلة قبل اعتبار العميل غير متصل (بالثواني)
-    ping_interval=25 # الفاصل الزمني لإرسال حزم ping للتحقق من اتصال العميل (بالثواني)
+    ping_interval=25, # الفاصل الزمني لإرسال حزم ping للتحقق من اتصال العميل (بالثواني)
+    **socketio_queue_options() # طابور الرسائل المشترك بين العمليات (اختياري)
 )
 
-# دالة لتحميل المستخدم من قاعدة البيانات بناءً على معرف المستخدم (ID)
-@login_manager.user_loader
-def load_user(user_id):
+def _load_user_row(user_id):
     # استيراد نموذج User هنا لتجنب مشاكل الاستيراد الدائري إذا كان models.py يستورد app
     from models import User
-    return User.query.get(int(user_id))
+    return db.session.get(User, user_id)
+
+# ذاكرة مؤقتة للمستخدمين: نسخة غير قابلة للتعديل من صف المستخدم لمدة USER_CACHE_TTL،
+# تُحذف عند تعديل المستخدم أو حذفه (انظر models.py)؛ مع عدة نسخ من الخادم يُنشر الإبطال
+# عبر Redis إلى بقيتها (انظر services/user_cache.py)
+user_cache = make_user_cache(_load_user_row, SOCKETIO_MESSAGE_QUEUE, socketio.start_background_task)
+
+# دالة لتحميل المستخدم بناءً على معرف المستخدم (ID)، من الذاكرة المؤقتة إن أمكن
+@login_manager.user_loader
+def load_user(user_id):
+    try:
+        return user_cache.get(int(user_id))
+    except (TypeError, ValueError):
+        return None
 
 # استيراد المسارات (Routes) بعد تهيئة التطبيق وقاعدة البيانات
 # تأكد من وجود ملف routes.py يحتوي على تعريف مسارات التطبيق
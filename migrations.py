@@ -0,0 +1,326 @@
+# migrations.py
+
+# ترحيلات مخطط قاعدة البيانات بإصدارات مرقمة.
+# db.create_all() ينشئ الجداول الناقصة فقط ولا يضيف أعمدة أو فهارس إلى جداول موجودة،
+# لذلك تُطبق هذه الترحيلات التغييرات على قواعد البيانات القائمة (PostgreSQL و SQLite).
+#
+# الاستخدام:
+#   python migrations.py          تطبيق الترحيلات المعلقة
+#   python migrations.py status   عرض الإصدار الحالي والترحيلات المعلقة
+#   python migrations.py check    التحقق من أن الاستعلامات الساخنة تستخدم الفهارس
+
+import sys
+import logging
+from datetime import datetime, timezone
+
+from sqlalchemy import MetaData, Table, Column, Integer, String, DateTime, inspect, text, bindparam
+
+from app import app, db
+from models import Conversation, Message, RoomMessage
+from services.arabic_text import normalize_arabic
+
+logger = logging.getLogger(__name__)
+
+# جدول تتبع الترحيلات المطبقة
+schema_metadata = MetaData()
+schema_version = Table(
+    'schema_version', schema_metadata,
+    Column('version', Integer, primary_key=True),
+    Column('description', String(255), nullable=False),
+    Column('applied_at', DateTime(timezone=True), nullable=False),
+)
+
+# مفتاح قفل استشاري في PostgreSQL حتى لا تطبق عمليتان الترحيلات في الوقت نفسه
+MIGRATION_LOCK_KEY = 7311
+
+
+def _is_postgres(engine):
+    return engine.dialect.name == 'postgresql'
+
+
+def _add_missing_columns(engine, table, column_names):
+    """إضافة أعمدة النموذج غير الموجودة في الجدول (ALTER TABLE ... ADD COLUMN)"""
+    existing = {column['name'] for column in inspect(engine).get_columns(table.name)}
+    with engine.begin() as conn:
+        for name in column_names:
+            if name in existing:
+                continue
+            column = table.c[name]
+            ddl = f'ALTER TABLE {table.name} ADD COLUMN {name} {column.type.compile(dialect=engine.dialect)}'
+            if column.server_default is not None:
+                ddl += f' DEFAULT {column.server_default.arg}'
+                if not column.nullable:
+                    ddl += ' NOT NULL'
+            conn.execute(text(ddl))
+            logger.info(f"Added column {table.name}.{name}")
+
+
+def _create_index(engine, name, table_name, columns, using=None):
+    """إنشاء فهرس دون قفل الجدول للكتابة: CONCURRENTLY في PostgreSQL"""
+    if _is_postgres(engine):
+        method = f' USING {using}' if using else ''
+        # CREATE INDEX CONCURRENTLY لا يعمل داخل معاملة
+        with engine.connect().execution_options(isolation_level='AUTOCOMMIT') as conn:
+            conn.execute(text(f'CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} ON {table_name}{method} ({columns})'))
+    else:
+        with engine.begin() as conn:
+            conn.execute(text(f'CREATE INDEX IF NOT EXISTS {name} ON {table_name} ({columns})'))
+    logger.info(f"Index {name} is present")
+
+
+def _drop_index(engine, name):
+    if _is_postgres(engine):
+        with engine.connect().execution_options(isolation_level='AUTOCOMMIT') as conn:
+            conn.execute(text(f'DROP INDEX CONCURRENTLY IF EXISTS {name}'))
+    else:
+        with engine.begin() as conn:
+            conn.execute(text(f'DROP INDEX IF EXISTS {name}'))
+    logger.info(f"Index {name} is gone")
+
+
+# --- الترحيلات ---
+
+def migration_1_conversation_summary(engine):
+    _add_missing_columns(engine, Conversation.__table__, ['summary', 'summary_message_id'])
+
+
+def migration_2_conversation_counters(engine):
+    _add_missing_columns(engine, Conversation.__table__,
+                         ['message_count', 'last_message_at', 'last_message_preview'])
+    # ملء العدادات للمحادثات الموجودة
+    with engine.begin() as conn:
+        Conversation.refresh_stats(connection=conn)
+
+
+def migration_3_hot_path_indexes(engine):
+    _create_index(engine, 'ix_message_conversation_created_id', 'message',
+                  'conversation_id, created_at, id')
+    _create_index(engine, 'ix_conversation_updated_at_id', 'conversation',
+                  'updated_at DESC, id DESC')
+
+
+def migration_4_room_messages(engine):
+    RoomMessage.__table__.create(engine, checkfirst=True)
+    _create_index(engine, 'ix_room_message_room_created_id', 'room_message', 'room, created_at, id')
+
+
+# عدد الرسائل التي يُحسب نص بحثها في كل دفعة أثناء الملء
+BACKFILL_BATCH_SIZE = 1000
+
+# SQLite: جدول FTS5 بمحتوى خارجي (يقرأ النص من جدول message) ومشغلات تبقيه متزامناً
+SQLITE_FTS_DDL = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS message_fts USING fts5("
+    "search_text, content='message', content_rowid='id', tokenize='unicode61')",
+    "CREATE TRIGGER IF NOT EXISTS message_fts_insert AFTER INSERT ON message BEGIN "
+    "INSERT INTO message_fts(rowid, search_text) VALUES (new.id, new.search_text); END",
+    "CREATE TRIGGER IF NOT EXISTS message_fts_delete AFTER DELETE ON message BEGIN "
+    "INSERT INTO message_fts(message_fts, rowid, search_text) VALUES ('delete', old.id, old.search_text); END",
+    "CREATE TRIGGER IF NOT EXISTS message_fts_update AFTER UPDATE OF search_text ON message BEGIN "
+    "INSERT INTO message_fts(message_fts, rowid, search_text) VALUES ('delete', old.id, old.search_text); "
+    "INSERT INTO message_fts(rowid, search_text) VALUES (new.id, new.search_text); END",
+]
+
+
+def migration_5_message_search(engine):
+    _add_missing_columns(engine, Message.__table__, ['search_text'])
+
+    # ملء نص البحث للرسائل الموجودة على دفعات
+    message = Message.__table__
+    last_id = 0
+    while True:
+        with engine.begin() as conn:
+            rows = conn.execute(
+                message.select().with_only_columns(message.c.id, message.c.content)
+                .where(message.c.id > last_id).where(message.c.search_text.is_(None))
+                .order_by(message.c.id).limit(BACKFILL_BATCH_SIZE)
+            ).all()
+            if not rows:
+                break
+            conn.execute(
+                message.update().where(message.c.id == bindparam('row_id')).values(search_text=bindparam('normalized')),
+                [{'row_id': row.id, 'normalized': normalize_arabic(row.content)} for row in rows]
+            )
+            last_id = rows[-1].id
+
+    if _is_postgres(engine):
+        _create_index(engine, 'ix_message_search', 'message', "to_tsvector('simple', search_text)", using='gin')
+    elif engine.dialect.name == 'sqlite':
+        with engine.begin() as conn:
+            for ddl in SQLITE_FTS_DDL:
+                conn.execute(text(ddl))
+            conn.execute(text("INSERT INTO message_fts(message_fts) VALUES ('rebuild')"))
+
+
+def migration_6_conversation_purge(engine):
+    _add_missing_columns(engine, Conversation.__table__, ['deleted_at'])
+    if not _is_postgres(engine):
+        # SQLite لا يعدل القيود على جدول موجود؛ الحذف يمر دائماً بحذف الرسائل على دفعات أولاً
+        return
+
+    # استبدال قيد المفتاح الأجنبي بآخر فيه ON DELETE CASCADE.
+    # NOT VALID ثم VALIDATE: الإضافة لا تفحص الصفوف الموجودة، والتحقق لا يقفل الجدول للكتابة
+    for foreign_key in inspect(engine).get_foreign_keys('message'):
+        if foreign_key['referred_table'] != 'conversation':
+            continue
+        if (foreign_key.get('options') or {}).get('ondelete', '').upper() == 'CASCADE':
+            return
+        with engine.begin() as conn:
+            conn.execute(text(f'ALTER TABLE message DROP CONSTRAINT {foreign_key["name"]}'))
+            conn.execute(text(
+                'ALTER TABLE message ADD CONSTRAINT message_conversation_id_fkey '
+                'FOREIGN KEY (conversation_id) REFERENCES conversation (id) ON DELETE CASCADE NOT VALID'
+            ))
+        with engine.begin() as conn:
+            conn.execute(text('ALTER TABLE message VALIDATE CONSTRAINT message_conversation_id_fkey'))
+        logger.info("message.conversation_id now cascades on delete")
+
+
+def migration_7_active_conversation_index(engine):
+    # قائمة المحادثات تصفي deleted_at IS NULL؛ فهرس يبدأ بـ deleted_at يحول مسح الفهرس إلى بحث فيه
+    _create_index(engine, 'ix_conversation_deleted_updated_id', 'conversation',
+                  'deleted_at, updated_at DESC, id DESC')
+    _drop_index(engine, 'ix_conversation_updated_at_id')
+
+
+# (الإصدار، الوصف، الدالة) — تُضاف الترحيلات الجديدة في النهاية فقط، ولا يُعاد ترقيم القديمة
+MIGRATIONS = [
+    (1, 'conversation summary columns', migration_1_conversation_summary),
+    (2, 'conversation message counters and preview', migration_2_conversation_counters),
+    (3, 'message and conversation hot-path indexes', migration_3_hot_path_indexes),
+    (4, 'chat-room message history', migration_4_room_messages),
+    (5, 'message full-text search', migration_5_message_search),
+    (6, 'conversation soft delete and cascading message delete', migration_6_conversation_purge),
+    (7, 'conversation list index on non-deleted conversations', migration_7_active_conversation_index),
+]
+
+
+def get_applied_versions(engine):
+    schema_metadata.create_all(engine)
+    with engine.connect() as conn:
+        return {row[0] for row in conn.execute(schema_version.select().with_only_columns(schema_version.c.version))}
+
+
+def run_migrations(engine=None):
+    """تطبيق كل الترحيلات غير المطبقة بالترتيب؛ يعيد قائمة الإصدارات التي طُبقت"""
+    engine = engine or db.engine
+    lock_conn = None
+    if _is_postgres(engine):
+        lock_conn = engine.connect().execution_options(isolation_level='AUTOCOMMIT')
+        lock_conn.execute(text('SELECT pg_advisory_lock(:key)'), {'key': MIGRATION_LOCK_KEY})
+
+    try:
+        applied = get_applied_versions(engine)
+        newly_applied = []
+        for version, description, migrate in MIGRATIONS:
+            if version in applied:
+                continue
+            logger.info(f"Applying migration {version}: {description}")
+            migrate(engine)
+            with engine.begin() as conn:
+                conn.execute(schema_version.insert().values(
+                    version=version,
+                    description=description,
+                    applied_at=datetime.now(timezone.utc)
+                ))
+            newly_applied.append(version)
+        return newly_applied
+    finally:
+        if lock_conn is not None:
+            lock_conn.execute(text('SELECT pg_advisory_unlock(:key)'), {'key': MIGRATION_LOCK_KEY})
+            lock_conn.close()
+
+
+# --- التحقق من خطط الاستعلامات الساخنة ---
+
+# مؤشر تصفح نموذجي لصفحات "الأقدم" (قيمته لا تغير الخطة)
+SAMPLE_CURSOR = (datetime(2024, 1, 1, tzinfo=timezone.utc), 1000000)
+
+# (الوصف، دالة تبني الاستعلام كما يشغله التطبيق، الفهرس المتوقع)
+HOT_QUERIES = [
+    (
+        'message history page',
+        lambda: Message.page_query(1),
+        'ix_message_conversation_created_id',
+    ),
+    (
+        'message history, older page',
+        lambda: Message.page_query(1, before=SAMPLE_CURSOR),
+        'ix_message_conversation_created_id',
+    ),
+    (
+        'chat context window',
+        lambda: Message.history_query(1, after_id=1, limit=200),
+        'ix_message_conversation_created_id',
+    ),
+    (
+        'conversation list page',
+        lambda: Conversation.page_query(),
+        'ix_conversation_deleted_updated_id',
+    ),
+    (
+        'conversation list, older page',
+        lambda: Conversation.page_query(before=SAMPLE_CURSOR),
+        'ix_conversation_deleted_updated_id',
+    ),
+]
+
+
+def compile_query(query, engine):
+    """نص SQL للاستعلام بقيمه الحرفية، بلهجة قاعدة البيانات"""
+    statement = getattr(query, 'statement', query)
+    return str(statement.compile(dialect=engine.dialect, compile_kwargs={'literal_binds': True}))
+
+
+def explain(conn, engine, sql):
+    if _is_postgres(engine):
+        return '\n'.join(row[0] for row in conn.execute(text(f'EXPLAIN {sql}')))
+    return '\n'.join(str(row[-1]) for row in conn.execute(text(f'EXPLAIN QUERY PLAN {sql}')))
+
+
+def plan_problems(description, plan, index_name):
+    """مشاكل خطة استعلام واحد: فهرس غير مستخدم، مسح كامل، أو فرز إضافي"""
+    problems = []
+    if index_name not in plan:
+        problems.append(f'{description}: index {index_name} not used')
+    for line in plan.splitlines():
+        line = line.strip()
+        if line.upper().startswith('SCAN') or 'Seq Scan' in line:
+            problems.append(f'{description}: plan scans instead of searching ({line})')
+    if 'TEMP B-TREE' in plan.upper() or 'Sort' in plan:
+        problems.append(f'{description}: plan needs an extra sort')
+    return problems
+
+
+def check_query_plans(engine=None, verbose=True):
+    """يعيد قائمة بالمشاكل؛ فارغة إذا كانت كل الاستعلامات الساخنة تبحث في فهارسها دون فرز إضافي"""
+    engine = engine or db.engine
+    problems = []
+    with engine.connect() as conn:
+        if _is_postgres(engine):
+            # الجداول الصغيرة قد تجعل المخطط يفضل المسح التسلسلي؛ نريد معرفة هل الفهرس قابل للاستخدام
+            conn.execute(text('SET enable_seqscan = off'))
+        for description, build_query, index_name in HOT_QUERIES:
+            plan = explain(conn, engine, compile_query(build_query(), engine))
+            if verbose:
+                print(f'-- {description}\n{plan}\n')
+            problems.extend(plan_problems(description, plan, index_name))
+    return problems
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    command = sys.argv[1] if len(sys.argv) > 1 else 'migrate'
+    with app.app_context():
+        if command == 'status':
+            applied = get_applied_versions(db.engine)
+            for version, description, _ in MIGRATIONS:
+                state = 'applied' if version in applied else 'pending'
+                print(f'{version:>4}  {state:<8} {description}')
+        elif command == 'check':
+            problems = check_query_plans()
+            for problem in problems:
+                print(f'FAIL: {problem}')
+            sys.exit(1 if problems else 0)
+        else:
+            versions = run_migrations()
+            print(f'Applied migrations: {versions}' if versions else 'Database schema is up to date.')
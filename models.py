@@ -2,16 +2,19 @@
 
 # هذا الملف يحتوي على تعريفات نماذج قاعدة البيانات باستخدام SQLAlchemy.
 
+import json
+import base64
 from datetime import datetime, timezone
 # تأكد من أن مسار الاستيراد صحيح بناءً على هيكل مشروعك.
 # إذا كان models.py في نفس المجلد الذي يحتوي على app.py:
-from app import db
+from app import db, user_cache
 # إذا كان models.py في مجلد فرعي (مثل 'models') و app.py في الجذر:
 # from ..app import db
 
 from flask_login import UserMixin # مطلوب لنموذج User إذا كنت تستخدم Flask-Login
-from sqlalchemy import Column, Integer, String, Text, DateTime, Boolean, JSON, ForeignKey
-from sqlalchemy.orm import relationship, Session # استيراد Session لاستخدام db.session
+from sqlalchemy import Column, Integer, String, Text, DateTime, Boolean, JSON, ForeignKey, Index, event, func, select, update, and_, or_, text, literal_column
+from sqlalchemy.orm import relationship, Session, object_session # استيراد Session لاستخدام db.session
+from services.arabic_text import normalize_arabic, query_terms
 
 # ملاحظة: تم افتراض استخدام Integer ID كمعرف أساسي للمحادثات والرسائل بناءً على الأكواد الأخيرة.
 # إذا كنت تفضل UUIDs، ستحتاج لتغيير نوع العمود هنا إلى UUID (من sqlalchemy.dialects.postgresql import UUID)
@@ -40,6 +43,67 @@ class User(UserMixin, db.Model):
 # --------------------------------------------------------------------------
 
 
+# طول المعاينة المخزنة لآخر رسالة في كل محادثة
+PREVIEW_LENGTH = 120
+
+def make_preview(content):
+    """اقتطاع نص الرسالة لعرضه في قائمة المحادثات"""
+    if not content:
+        return None
+    content = " ".join(content.split())
+    return content if len(content) <= PREVIEW_LENGTH else content[:PREVIEW_LENGTH - 3] + "..."
+
+# إعدادات البحث النصي في PostgreSQL: 'simple' لا يطبق تجذيراً إنجليزياً على النص العربي،
+# والتطبيع العربي يتم في بايثون قبل الفهرسة (services/arabic_text.py)
+SEARCH_CONFIG = literal_column("'simple'")
+
+# --- ترقيم الصفحات بالمؤشر (keyset pagination) ---
+def encode_cursor(timestamp, row_id):
+    """ترميز موضع (الطابع الزمني، المعرف) كمؤشر نصي معتم"""
+    raw = json.dumps([timestamp.isoformat() if timestamp else None, row_id])
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii').rstrip('=')
+
+def decode_cursor(cursor):
+    """فك ترميز المؤشر؛ يعيد None إذا كان غير صالح"""
+    if not cursor:
+        return None
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        timestamp, row_id = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+        return datetime.fromisoformat(timestamp), int(row_id)
+    except (ValueError, TypeError):
+        return None
+
+def keyset_query(query, ts_column, id_column, limit, before=None, after=None):
+    """
+    الاستعلام الذي تنفذه keyset_page: الشرط والترتيب وlimit + 1 لمعرفة هل توجد عناصر إضافية.
+    منفصل حتى يفحص migrations.py check خطة الاستعلام نفسه الذي يشغله التطبيق.
+    """
+    if after is not None:
+        ts, row_id = after
+        query = query.filter(or_(ts_column > ts, and_(ts_column == ts, id_column > row_id)))
+        return query.order_by(ts_column.asc(), id_column.asc()).limit(limit + 1)
+
+    if before is not None:
+        ts, row_id = before
+        query = query.filter(or_(ts_column < ts, and_(ts_column == ts, id_column < row_id)))
+    return query.order_by(ts_column.desc(), id_column.desc()).limit(limit + 1)
+
+
+def keyset_page(query, ts_column, id_column, limit, before=None, after=None, newest_first=True):
+    """
+    جلب صفحة من query مرتبة حسب (ts_column, id_column).
+    before: العناصر الأقدم من المؤشر، after: العناصر الأحدث منه.
+    يعيد (العناصر من الأحدث إلى الأقدم، هل توجد عناصر إضافية في نفس الاتجاه).
+    """
+    rows = keyset_query(query, ts_column, id_column, limit, before=before, after=after).all()
+    has_more = len(rows) > limit
+    if after is not None:
+        return list(reversed(rows[:limit])), has_more
+    return rows[:limit], has_more
+# --------------------------------------------------------------------------
+
+
 # --- نموذج المحادثة ---
 class Conversation(db.Model):
     """Model for storing conversation metadata"""
@@ -55,12 +119,29 @@ class Conversation(db.Model):
     # استخدام 'updated_at' للتناسق مع ما كان متوقعاً في app.py
     updated_at = Column(DateTime(timezone=True), default=lambda: datetime.now(timezone.utc), onupdate=lambda: datetime.now(timezone.utc), nullable=False)
 
+    # حقول مُكررة (denormalized) تُحدّث مع كل إضافة/حذف رسالة، حتى تُعرض قائمة المحادثات باستعلام واحد
+    message_count = Column(Integer, nullable=False, default=0, server_default='0')
+    last_message_at = Column(DateTime(timezone=True), nullable=True)
+    last_message_preview = Column(String(PREVIEW_LENGTH), nullable=True)
+
+    # ملخص تراكمي للرسائل القديمة التي خرجت من نافذة السياق (انظر services/context_manager.py)
+    summary = Column(Text, nullable=True)
+    # معرف آخر رسالة تم دمجها في الملخص
+    summary_message_id = Column(Integer, nullable=True)
+
+    # وقت طلب الحذف؛ المحادثة مخفية منذ تلك اللحظة وتُحذف رسائلها على دفعات في الخلفية
+    # (انظر services/conversation_purger.py)
+    deleted_at = Column(DateTime(timezone=True), nullable=True)
+
     # تعريف العلاقة مع جدول الرسائل (Message)
     # backref='conversation': يضيف خاصية 'conversation' إلى نموذج Message
     # cascade='all, delete-orphan': يضمن حذف الرسائل عند حذف المحادثة الأم
+    # passive_deletes=True: تترك قاعدة البيانات تحذف الرسائل (ON DELETE CASCADE) بدلاً من
+    # تحميل كل رسالة وحذفها بجملة DELETE منفصلة
     # lazy='dynamic': يسمح بتنفيذ استعلامات إضافية (مثل .count() أو .all()) بكفاءة
     # تم حذف backref_kw={'lazy': 'joined'} لحل خطأ TypeError
-    messages = relationship('Message', backref='conversation', cascade='all, delete-orphan', lazy='dynamic')
+    messages = relationship('Message', backref='conversation', cascade='all, delete-orphan',
+                            passive_deletes=True, lazy='dynamic')
 
     # إذا كان لديك نموذج مستخدم وتريد ربط المحادثات بالمستخدمين (اختياري)
     # user_id = Column(Integer, ForeignKey('users.id'), nullable=True)
@@ -77,8 +158,10 @@ class Conversation(db.Model):
             'title': self.title,
             'created_at': self.created_at.isoformat() if self.created_at else None,
             'updated_at': self.updated_at.isoformat() if self.updated_at else None,
-            # عد الرسائل باستخدام count() لأن lazy='dynamic'
-            'message_count': self.messages.count()
+            # العداد مخزن في الجدول، فلا حاجة لاستعلام count() لكل محادثة
+            'message_count': self.message_count or 0,
+            'last_message_at': self.last_message_at.isoformat() if self.last_message_at else None,
+            'last_message_preview': self.last_message_preview
             # إذا كان لديك ربط بالمستخدم: 'user_id': self.user_id
         }
 
@@ -88,15 +171,74 @@ class Conversation(db.Model):
         try:
             # حاول التحويل إلى عدد صحيح
             int_id = int(conversation_id)
-            return cls.query.get(int_id)
+            return cls.get_active(int_id)
         except (ValueError, TypeError):
             # إذا لم يكن بالإمكان التحويل، أرجع None
             return None
 
+    @classmethod
+    def get_active(cls, conversation_id):
+        """Get a conversation by ID unless it has been deleted"""
+        conversation = db.session.get(cls, conversation_id)
+        if conversation is None or conversation.deleted_at is not None:
+            return None
+        return conversation
+
     @classmethod
     def get_all_conversations(cls):
         """Get all conversations ordered by updated_at descending"""
-        return cls.query.order_by(cls.updated_at.desc()).all()
+        return cls.active_query().order_by(cls.updated_at.desc()).all()
+
+    @classmethod
+    def get_page(cls, limit=50, before=None, after=None):
+        """Get a page of conversations, newest updated first, with keyset cursors on (updated_at, id)"""
+        return keyset_page(cls.active_query(), cls.updated_at, cls.id, limit, before=before, after=after)
+
+    @classmethod
+    def active_query(cls):
+        """Conversations that are not soft-deleted"""
+        return cls.query.filter(cls.deleted_at.is_(None))
+
+    @classmethod
+    def page_query(cls, limit=50, before=None, after=None):
+        """The SQL query behind get_page, for plan checks"""
+        return keyset_query(cls.active_query(), cls.updated_at, cls.id, limit, before=before, after=after)
+
+    @classmethod
+    def refresh_stats(cls, conversation_id=None, connection=None):
+        """Recompute message_count, last_message_at and last_message_preview from the message table.
+
+        Used after bulk deletes and imports (which bypass the ORM events) and to
+        backfill existing rows; pass a list of IDs to refresh several
+        conversations, or conversation_id=None to refresh every conversation.
+        """
+        conversation = cls.__table__
+        message = Message.__table__
+        latest = (
+            select(message.c.content, message.c.created_at)
+            .where(message.c.conversation_id == conversation.c.id)
+            .order_by(message.c.created_at.desc(), message.c.id.desc())
+            .limit(1)
+        )
+        stmt = update(conversation).values(
+            message_count=select(func.count(message.c.id))
+                .where(message.c.conversation_id == conversation.c.id)
+                .scalar_subquery(),
+            last_message_at=latest.with_only_columns(message.c.created_at).scalar_subquery(),
+            last_message_preview=func.substr(
+                latest.with_only_columns(message.c.content).scalar_subquery(), 1, PREVIEW_LENGTH
+            ),
+        )
+        if isinstance(conversation_id, (list, tuple, set)):
+            stmt = stmt.where(conversation.c.id.in_(conversation_id))
+        elif conversation_id is not None:
+            stmt = stmt.where(conversation.c.id == conversation_id)
+        # لا نغير updated_at عند إعادة الحساب
+        stmt = stmt.values(updated_at=conversation.c.updated_at)
+        if connection is not None:
+            connection.execute(stmt)
+        else:
+            db.session.execute(stmt)
 # --------------------------------------------------------------------------
 
 
@@ -110,7 +252,7 @@ class Message(db.Model):
     id = Column(Integer, primary_key=True)
 
     # تحديد foreign_key على اسم الجدول الصريح لـ conversation
-    conversation_id = Column(Integer, ForeignKey('conversation.id'), nullable=False)
+    conversation_id = Column(Integer, ForeignKey('conversation.id', ondelete='CASCADE'), nullable=False)
 
     role = Column(String(50), nullable=False)  # 'user' or 'assistant'
     content = Column(Text, nullable=False)
@@ -123,6 +265,9 @@ class Message(db.Model):
     # db.JSON مدعوم بشكل طبيعي في PostgreSQL.
     message_metadata = Column(JSON, nullable=True)
 
+    # نص الرسالة بعد تطبيع العربية (بلا تشكيل، وتوحيد الألف والياء والتاء المربوطة) لفهرس البحث
+    search_text = Column(Text, nullable=True)
+
     def __repr__(self):
         return f'<Message {self.id}: {self.role} (Conv: {self.conversation_id})>'
 
@@ -136,15 +281,114 @@ class Message(db.Model):
             'created_at': self.created_at.isoformat() if self.created_at else None
         }
 
+    @classmethod
+    def get_history(cls, conversation_id, after_id=None, limit=None, oldest=False):
+        """Get messages of a conversation oldest first, optionally only those after a given message ID.
+
+        With ``limit`` only the newest ``limit`` of them are loaded, or the
+        oldest ones with ``oldest``.
+        """
+        rows = cls.history_query(conversation_id, after_id, limit, oldest).all()
+        return rows if oldest or limit is None else list(reversed(rows))
+
+    @classmethod
+    def history_query(cls, conversation_id, after_id=None, limit=None, oldest=False):
+        """The SQL query behind get_history, for plan checks"""
+        query = cls.query.filter(cls.conversation_id == conversation_id)
+        if after_id is not None:
+            query = query.filter(cls.id > after_id)
+        if limit is None or oldest:
+            query = query.order_by(cls.created_at, cls.id)
+        else:
+            query = query.order_by(cls.created_at.desc(), cls.id.desc())
+        return query.limit(limit) if limit is not None else query
+
+    @classmethod
+    def get_page(cls, conversation_id, limit=50, before=None, after=None):
+        """Get a page of a conversation's messages with keyset cursors on (created_at, id).
+
+        Without cursors this is the newest ``limit`` messages; ``before`` pages
+        towards older messages. Messages are returned oldest first.
+        """
+        query = cls.query.filter(cls.conversation_id == conversation_id)
+        rows, has_more = keyset_page(query, cls.created_at, cls.id, limit, before=before, after=after)
+        return list(reversed(rows)), has_more
+
+    @classmethod
+    def page_query(cls, conversation_id, limit=50, before=None, after=None):
+        """The SQL query behind get_page, for plan checks"""
+        query = cls.query.filter(cls.conversation_id == conversation_id)
+        return keyset_query(query, cls.created_at, cls.id, limit, before=before, after=after)
+
+    @classmethod
+    def search(cls, query, limit=20, offset=0, conversation_id=None):
+        """Full-text search over message content, best match first.
+
+        Every query term must match the start of a word. Uses the GIN index on
+        PostgreSQL and the message_fts FTS5 table on SQLite. Messages of
+        soft-deleted conversations are excluded in the query, before LIMIT.
+        Returns (rows, has_more) where rows are (message, rank, conversation title).
+        """
+        terms = query_terms(query)
+        if not terms:
+            return [], False
+
+        dialect = db.engine.dialect.name
+        if dialect == 'postgresql':
+            vector = func.to_tsvector(SEARCH_CONFIG, cls.search_text)
+            tsquery = func.to_tsquery(SEARCH_CONFIG, ' & '.join(f'{term}:*' for term in terms))
+            rank = func.ts_rank(vector, tsquery)
+            stmt = select(cls, rank.label('rank')).where(vector.op('@@')(tsquery)).order_by(rank.desc(), cls.id.desc())
+        elif dialect == 'sqlite':
+            # bm25 أصغر للأفضل؛ نعكس الإشارة لتكون الرتبة الأكبر هي الأفضل كما في PostgreSQL
+            fts = (select(literal_column('rowid').label('id'), literal_column('-bm25(message_fts)').label('rank'))
+                   .select_from(text('message_fts'))
+                   .where(text('message_fts MATCH :match'))
+                   .subquery())
+            stmt = (select(cls, fts.c.rank).join(fts, fts.c.id == cls.id)
+                    .order_by(fts.c.rank.desc(), cls.id.desc())
+                    .params(match=' '.join(f'"{term}"*' for term in terms)))
+        else:
+            # قواعد بيانات أخرى بلا فهرس نصي: مطابقة جزئية بطيئة لكنها صحيحة
+            stmt = select(cls, literal_column('0').label('rank')).order_by(cls.id.desc())
+            for term in terms:
+                stmt = stmt.where(cls.search_text.contains(term))
+
+        stmt = (stmt.add_columns(Conversation.title)
+                .join(Conversation, Conversation.id == cls.conversation_id)
+                .where(Conversation.deleted_at.is_(None)))
+        if conversation_id is not None:
+            stmt = stmt.where(cls.conversation_id == conversation_id)
+        rows = db.session.execute(stmt.limit(limit + 1).offset(offset)).all()
+        return [(row[0], row[1], row[2]) for row in rows[:limit]], len(rows) > limit
+
+    @classmethod
+    def delete_chunk(cls, conversation_id, max_id=None, limit=1000):
+        """Delete up to ``limit`` messages of a conversation, oldest IDs first.
+
+        Only messages with ``id <= max_id`` are deleted when max_id is given,
+        so messages added after a clear was requested survive it. Returns the
+        number of rows deleted; the caller commits and refreshes the counters.
+        """
+        message = cls.__table__
+        chunk = select(message.c.id).where(message.c.conversation_id == conversation_id)
+        if max_id is not None:
+            chunk = chunk.where(message.c.id <= max_id)
+        chunk = chunk.order_by(message.c.id).limit(limit)
+        # الحذف بالجملة لا يمر عبر أحداث ORM (ولا يحمّل الرسائل في الجلسة)
+        result = db.session.execute(message.delete().where(message.c.id.in_(chunk.scalar_subquery())))
+        return result.rowcount
+
     # --- إضافة تابع حذف رسائل المحادثة الذي كان متوقعاً في app.py ---
     @classmethod
-    def delete_by_conversation_id(cls, conversation_id):
-        """Delete all messages for a given conversation ID"""
+    def delete_by_conversation_id(cls, conversation_id, chunk_size=1000):
+        """Delete all messages for a given conversation ID in chunks, committing after each"""
         try:
             int_id = int(conversation_id)
-            # استخدام db.session.query().filter_by().delete() مع synchronize_session='evaluate'
-            # هو الطريقة الموصى بها للحذف بالجملة في SQLAlchemy
-            db.session.query(cls).filter_by(conversation_id=int_id).delete(synchronize_session='evaluate')
+            while cls.delete_chunk(int_id, limit=chunk_size):
+                db.session.commit()
+            # الحذف بالجملة لا يمر عبر أحداث ORM، لذا نعيد حساب عدادات المحادثة يدوياً
+            Conversation.refresh_stats(int_id)
             db.session.commit() # تثبيت الحذف
         except (ValueError, TypeError):
              # التعامل مع معرف غير صالح إذا لزم الأمر (هنا نطبع تحذير ونتجاهل)
@@ -157,6 +401,96 @@ class Message(db.Model):
             raise # يمكنك إعادة إلقاء الخطأ إذا أردت معالجته في مكان آخر
 # --------------------------------------------------------------------------
 
+# --- نموذج رسالة غرفة الدردشة ---
+class RoomMessage(db.Model):
+    """Model for persisted Socket.IO chat-room messages (written in batches, see services/room_history.py)"""
+    __tablename__ = 'room_message'
+
+    id = Column(Integer, primary_key=True)
+    room = Column(String(100), nullable=False)
+    username = Column(String(64), nullable=False)
+    message = Column(Text, nullable=False)
+    created_at = Column(DateTime(timezone=True), default=lambda: datetime.now(timezone.utc), nullable=False)
+
+    def __repr__(self):
+        return f'<RoomMessage {self.id}: {self.username} in {self.room}>'
+
+    def to_dict(self):
+        """Same shape as the 'message' Socket.IO event payload"""
+        return {
+            'username': self.username,
+            'message': self.message,
+            'timestamp': self.created_at.isoformat() if self.created_at else None
+        }
+
+    @classmethod
+    def get_recent(cls, room, limit=50):
+        """Get the last ``limit`` messages of a room, oldest first"""
+        rows = (cls.query.filter(cls.room == room)
+                .order_by(cls.created_at.desc(), cls.id.desc())
+                .limit(limit).all())
+        return list(reversed(rows))
+# --------------------------------------------------------------------------
+
+
+# --- الفهارس ---
+# سجل الرسائل: كل تحميل وحذف وترقيم لرسائل محادثة يبحث بـ conversation_id ويرتب بـ (created_at, id)
+Index('ix_message_conversation_created_id', Message.conversation_id, Message.created_at, Message.id)
+# قائمة المحادثات غير المحذوفة مرتبة تنازلياً حسب (updated_at, id)؛
+# deleted_at أولاً حتى يصبح شرط deleted_at IS NULL بحثاً في الفهرس لا مسحاً له
+Index('ix_conversation_deleted_updated_id', Conversation.deleted_at,
+      Conversation.updated_at.desc(), Conversation.id.desc())
+# إعادة تشغيل آخر رسائل الغرفة عند الانضمام
+Index('ix_room_message_room_created_id', RoomMessage.room, RoomMessage.created_at, RoomMessage.id)
+# البحث النصي في PostgreSQL (SQLite يستخدم جدول FTS5 باسم message_fts تنشئه migrations.py)
+Index('ix_message_search', func.to_tsvector(SEARCH_CONFIG, Message.search_text),
+      postgresql_using='gin').ddl_if(dialect='postgresql')
+# ملاحظة: قواعد البيانات الموجودة تحصل على هذه الفهارس عبر migrations.py
+# --------------------------------------------------------------------------
+
+# --- إبطال نسخة المستخدم في ذاكرة user_loader المؤقتة عند تعديله أو حذفه ---
+@event.listens_for(User, 'after_update')
+@event.listens_for(User, 'after_delete')
+def _user_changed(mapper, connection, target):
+    user_cache.invalidate(target.id, publish=False)
+    # طلب متزامن قد يقرأ الصف القديم قبل التثبيت، لذا نبطل مرة أخرى بعده،
+    # وحينها فقط يُنشر الإبطال إلى نسخ الخادم الأخرى
+    session = object_session(target)
+    if session is not None:
+        session.info.setdefault('changed_user_ids', set()).add(target.id)
+
+@event.listens_for(Session, 'after_commit')
+def _invalidate_changed_users(session):
+    for user_id in session.info.pop('changed_user_ids', ()):
+        user_cache.invalidate(user_id)
+# --------------------------------------------------------------------------
+
+# --- تحديث نص البحث عند إضافة رسالة أو تعديلها ---
+@event.listens_for(Message.content, 'set')
+def _message_search_text(target, value, oldvalue, initiator):
+    target.search_text = normalize_arabic(value)
+# --------------------------------------------------------------------------
+
+# --- تحديث عدادات المحادثة ضمن نفس المعاملة عند إضافة أو حذف رسالة ---
+@event.listens_for(Message, 'after_insert')
+def _message_inserted(mapper, connection, target):
+    conversation = Conversation.__table__
+    connection.execute(
+        update(conversation)
+        .where(conversation.c.id == target.conversation_id)
+        .values(
+            message_count=conversation.c.message_count + 1,
+            last_message_at=target.created_at,
+            last_message_preview=make_preview(target.content),
+        )
+    )
+
+@event.listens_for(Message, 'after_delete')
+def _message_deleted(mapper, connection, target):
+    # قد تكون الرسالة المحذوفة هي الأحدث، لذا نعيد حساب المعاينة من الجدول
+    Conversation.refresh_stats(target.conversation_id, connection=connection)
+# --------------------------------------------------------------------------
+
 # ملاحظة:
 # تأكد من أن ملف app.py يقوم بتهيئة db بشكل صحيح قبل استيراد models.
 # مثال في app.py:
@@ -1,5 +1,5 @@
-from flask import Flask, render_template, request, redirect, url_for, session, flash, jsonify
-from app import app, db
+from flask import Flask, render_template, request, redirect, url_for, session, flash, jsonify, Response, stream_with_context, send_file
+from app import app, db, socketio, user_cache
 from datetime import datetime, timezone
 from werkzeug.security import generate_password_hash, check_password_hash
 from flask_login import current_user, login_required
@@ -8,22 +8,53 @@ import logging
 import uuid
 import base64
 import html
+import math
+import time
 from werkzeug.utils import secure_filename
+from werkzeug.exceptions import RequestEntityTooLarge
 import json
-from flask_socketio import SocketIO, join_room, leave_room, emit
-from models import Conversation, Message, User
+from types import SimpleNamespace
+from flask_socketio import join_room, leave_room, emit
+from models import Conversation, Message, User, RoomMessage, encode_cursor, decode_cursor
 from services.chatbot_service import ChatbotService
+from services.response_cache import cached_call, get_cache_stats
+from services.context_manager import build_context, CONTEXT_HISTORY_LIMIT
+from services.catalog_cache import CachedResource
+from services.mention_worker import MentionDispatcher
+from services.room_history import RoomHistory
+from services.socketio_queue import SOCKETIO_MESSAGE_QUEUE
+from services.presence import PresenceRegistry, make_presence_store
+from services.broadcast_batcher import BroadcastBatcher
+from services.compact_wire import COMPACT_FORMAT, JSON_FORMAT, negotiate as negotiate_wire_format, format_room, pack_messages
+from services.rate_limiter import RateLimiter, make_bucket_store, chat_cost, tts_cost
+from services.conversation_purger import ConversationPurger
+from services.metrics import (
+    METRICS_TOKEN, CONTENT_TYPE as METRICS_CONTENT_TYPE, render_latest as render_metrics,
+    observe_provider_call, register_models as register_metric_models, register_stats,
+    SOCKETIO_CONNECTED, SOCKETIO_EVENTS,
+)
+from services.arabic_text import query_terms, highlight
+from transfer import (
+    export_ndjson, import_ndjson, open_import_stream, read_lines, ImportLimitError,
+    IMPORT_MAX_BYTES, IMPORT_MAX_DECODED_BYTES, IMPORT_MAX_CONVERSATIONS, IMPORT_MAX_MESSAGES,
+)
+from services.provider_router import provider_router
+from services.tts_cache import tts_cache, make_key as make_tts_key, is_valid_key as is_valid_tts_key
 
 chatbot = ChatbotService()
 
 # Import services
 try:
     from services.openai_service import generate_chat_response as openai_generate
+    from services.openai_service import stream_chat_response as openai_stream
     from services.openai_service import generate_image_with_openai, generate_code
-    from services.gemini_service import generate_gemini_response
-    from services.openrouter_service import call_openrouter_api, get_available_models
-    from services.elevenlabs_service import text_to_speech, get_available_voices
-    from services.anthropic_service import generate_claude_response
+    from services.gemini_service import generate_gemini_response, stream_gemini_response
+    from services.openrouter_service import call_openrouter_api, stream_openrouter_api, get_available_models
+    from services.elevenlabs_service import text_to_speech, stream_text_to_speech, get_available_voices
+    from services.elevenlabs_service import get_default_voices
+    from services.elevenlabs_service import DEFAULT_MODEL_ID as ELEVENLABS_MODEL_ID
+    from services.elevenlabs_service import DEFAULT_VOICE_SETTINGS as ELEVENLABS_VOICE_SETTINGS
+    from services.anthropic_service import generate_claude_response, stream_claude_response
     api_services_available = True
 except ImportError as e:
     print(f"Error importing services: {e}")
@@ -34,21 +65,44 @@ except ImportError as e:
     def generate_gemini_response(messages, **kwargs): return "API service unavailable"
     def call_openrouter_api(messages, **kwargs): return "API service unavailable"
     def generate_claude_response(messages, **kwargs): return "API service unavailable"
+    def openai_stream(messages, **kwargs): yield "API service unavailable"
+    def stream_gemini_response(messages, **kwargs): yield "API service unavailable"
+    def stream_openrouter_api(messages, **kwargs): yield "API service unavailable"
+    def stream_claude_response(messages, **kwargs): yield "API service unavailable"
     def get_available_models(): return []
     def text_to_speech(text, **kwargs): return None
-    def get_available_voices(): return []
+    def stream_text_to_speech(text, *args, **kwargs): return iter(())
+    def get_available_voices(fallback=True): return [] if fallback else None
+    def get_default_voices(): return []
+    ELEVENLABS_MODEL_ID = None
+    ELEVENLABS_VOICE_SETTINGS = None
     api_services_available = False
 
-# Initialize SocketIO with basic settings for cross-domain support
-socketio = SocketIO(app, 
-                   cors_allowed_origins="*", 
-                   async_mode='threading',
-                   logger=True, 
-                   engineio_logger=True)
-
 # Configure logging
 logger = logging.getLogger(__name__)
 
+# Chat-room messages are kept in memory per room and written to the database in batches
+# (with a message queue, other worker processes write to the same rooms)
+room_history = RoomHistory(socketio, app, db, RoomMessage, shared=bool(SOCKETIO_MESSAGE_QUEUE))
+
+# Who is in which chat room (shared through Redis when the message queue is Redis)
+presence = PresenceRegistry(socketio, make_presence_store(SOCKETIO_MESSAGE_QUEUE))
+
+def emit_presence(deltas):
+    """Broadcast presence deltas (join/leave with the new member count) to their rooms"""
+    for delta in deltas:
+        socketio.emit('presence', delta, to=delta['room'])
+
+# Large conversations are deleted and cleared in chunks by a background task
+conversation_purger = ConversationPurger(socketio, app, db, Conversation, Message)
+conversation_purger.start()
+
+# Busy rooms get their chat messages coalesced into one frame per tick
+broadcaster = BroadcastBatcher(socketio)
+
+# AI mentions in the chat room are answered by background workers
+mention_dispatcher = MentionDispatcher(socketio, chatbot, history=room_history, broadcaster=broadcaster)
+
 # Configure upload folder
 UPLOAD_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), "static/uploads")
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
@@ -60,6 +114,37 @@ ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif'}
 ALLOWED_MIMETYPES = {'image/jpeg', 'image/png', 'image/gif'}
 MAX_FILE_SIZE = 5 * 1024 * 1024  # 5 ميجابايت
 
+# Hard-coded models always offered alongside the OpenRouter catalogue
+DEFAULT_MODELS = [
+    {"id": "gpt-4o", "name": "GPT-4o"},
+    {"id": "gpt-3.5-turbo", "name": "GPT-3.5 Turbo"},
+    {"id": "gemini-1.5-pro", "name": "Gemini 1.5 Pro"},
+    {"id": "gemini-1.5-flash", "name": "Gemini 1.5 Flash"},
+    {"id": "claude-3-5-sonnet-20241022", "name": "Claude 3.5 Sonnet"},
+    {"id": "claude-3-opus-20240229", "name": "Claude 3 Opus"},
+    {"id": "claude-3-sonnet-20240229", "name": "Claude 3 Sonnet"},
+    {"id": "claude-3-haiku-20240307", "name": "Claude 3 Haiku"},
+    {"id": "anthropic/claude-3-opus", "name": "Claude 3 Opus (OpenRouter)"},
+    {"id": "anthropic/claude-3-sonnet", "name": "Claude 3 Sonnet (OpenRouter)"},
+]
+
+# Model and voice catalogues are cached in memory and refreshed in the background
+model_catalog = CachedResource(
+    "models",
+    get_available_models,
+    transform=lambda models: models + DEFAULT_MODELS if models else list(DEFAULT_MODELS),
+    is_valid=bool
+)
+# A failed fetch returns None, so the previous voices are kept (or the defaults served) and it is retried soon
+voice_catalog = CachedResource(
+    "voices",
+    lambda: get_available_voices(fallback=False),
+    transform=lambda voices: voices if voices is not None else get_default_voices(),
+    is_valid=lambda voices: voices is not None
+)
+model_catalog.prefetch()
+voice_catalog.prefetch()
+
 def secure_file_hash(file):
     """إنشاء اسم آمن للملف باستخدام SHA-256"""
     hash_obj = hashlib.sha256()
@@ -87,21 +172,84 @@ def allowed_file(file):
 
     return mime in ALLOWED_MIMETYPES
 
-def generate_ai_response(messages_list, model="gpt-4o", temperature=0.7, max_tokens=2000):
-    """Generate an AI response based on the user's input using OpenAI, Claude, Gemini or OpenRouter APIs"""
+def get_provider(model):
+    """Name of the service that handles ``model``"""
+    if model.startswith("gpt"):
+        return "openai"
+    elif model.startswith("gemini"):
+        return "gemini"
+    elif model.startswith("claude") or "anthropic" in model:
+        return "anthropic"
+    return "openrouter"
+
+def is_cacheable_reply(text):
+    """Service modules report failures as Arabic apology strings; never cache those"""
+    return bool(text) and not text.startswith("عذراً")
+
+# Models tried, healthiest first, when the requested one fails
+FALLBACK_MODELS = [
+    model.strip() for model in
+    os.environ.get("ROUTER_FALLBACK_MODELS", "gpt-3.5-turbo,claude-3-haiku-20240307,gemini-1.5-flash").split(",")
+    if model.strip()
+]
+
+# Model used by /api/chat when the request names none
+DEFAULT_CHAT_MODEL = 'openai/gpt-3.5-turbo'
+
+# Only these models get their own series in the provider metrics; others count as "other"
+register_metric_models([entry["id"] for entry in DEFAULT_MODELS] + FALLBACK_MODELS + [DEFAULT_CHAT_MODEL])
+
+def is_known_model(model):
+    """
+    Whether ``model`` is one we route to: the catalogue (OpenRouter plus
+    DEFAULT_MODELS), the fallbacks or the default. Anything else would add a
+    backend to the provider router's health map for every made-up name.
+    """
+    if not isinstance(model, str):
+        return False
+    if model == DEFAULT_CHAT_MODEL or model in FALLBACK_MODELS:
+        return True
+    return any(entry.get("id") == model for entry in model_catalog.get())
+
+def call_provider(provider, model, messages_list, temperature, max_tokens):
+    """Call a single provider; each call gets its own copy because openai_generate mutates the list"""
+    messages = list(messages_list)
+    if provider == "openai":
+        return openai_generate(messages, model=model, temperature=temperature, max_tokens=max_tokens)
+    elif provider == "gemini":
+        return generate_gemini_response(messages, model=model, temperature=temperature, max_tokens=max_tokens)
+    elif provider == "anthropic":
+        # Extract just the model name from "anthropic/claude-3-opus" format
+        claude_model = model.split('/')[-1] if '/' in model else model
+        return generate_claude_response(messages, model=claude_model, temperature=temperature, max_tokens=max_tokens)
+    # Use OpenRouter for other models
+    return call_openrouter_api(messages, model=model, temperature=temperature, max_tokens=max_tokens)
+
+def generate_ai_response(messages_list, model="gpt-4o", temperature=0.7, max_tokens=2000, use_cache=True, hedge=False):
+    """Generate an AI response based on the user's input using OpenAI, Claude, Gemini or OpenRouter APIs.
+
+    The provider router falls back to the healthiest of FALLBACK_MODELS when the
+    requested backend fails or its circuit is open; with ``hedge`` a second
+    backend is raced against a slow first one.
+    """
     try:
-        # Determine which service to use based on the model
-        if model.startswith("gpt"):
-            response = openai_generate(messages_list, model=model, temperature=temperature, max_tokens=max_tokens)
-        elif model.startswith("gemini"):
-            response = generate_gemini_response(messages_list, model=model, temperature=temperature, max_tokens=max_tokens)
-        elif model.startswith("claude") or "anthropic" in model:
-            # Extract just the model name from "anthropic/claude-3-opus" format
-            claude_model = model.split('/')[-1] if '/' in model else model
-            response = generate_claude_response(messages_list, model=claude_model, temperature=temperature, max_tokens=max_tokens)
-        else:
-            # Use OpenRouter for other models
-            response = call_openrouter_api(messages_list, model=model, temperature=temperature, max_tokens=max_tokens)
+        provider = get_provider(model)
+        backends = provider_router.plan(
+            (provider, model),
+            [(get_provider(fallback), fallback) for fallback in FALLBACK_MODELS]
+        )
+
+        def dispatch():
+            return provider_router.call(
+                backends,
+                lambda backend_provider, backend_model: call_provider(
+                    backend_provider, backend_model, messages_list, temperature, max_tokens),
+                is_success=is_cacheable_reply,
+                hedge=hedge
+            )
+
+        response = cached_call(provider, model, messages_list, temperature, max_tokens, dispatch,
+                               bypass=not use_cache, should_cache=is_cacheable_reply)
 
         if not response:
             return "عذراً، لم أتمكن من توليد استجابة. يرجى المحاولة مرة أخرى."
@@ -109,12 +257,65 @@ def generate_ai_response(messages_list, model="gpt-4o", temperature=0.7, max_tok
         return response
     except Exception as e:
         logger.error(f"Error generating AI response: {e}")
-        # Fallback to simpler model if the selected one fails
-        try:
-            return openai_generate(messages_list, model="gpt-3.5-turbo", temperature=temperature, max_tokens=max_tokens)
-        except Exception as e:
-            logger.error(f"Error generating response: {e}")
-            return "عذراً، حدث خطأ أثناء معالجة طلبك. يرجى المحاولة مرة أخرى لاحقاً."
+        return "عذراً، حدث خطأ أثناء معالجة طلبك. يرجى المحاولة مرة أخرى لاحقاً."
+
+def stream_ai_response(messages_list, model="gpt-4o", temperature=0.7, max_tokens=2000):
+    """Yield the AI response as incremental text deltas from the provider's streaming API"""
+    produced = False
+    provider = get_provider(model)
+    started = time.perf_counter()
+    try:
+        if provider == "openai":
+            stream = openai_stream(messages_list, model=model, temperature=temperature, max_tokens=max_tokens)
+        elif provider == "gemini":
+            stream = stream_gemini_response(messages_list, model=model, temperature=temperature, max_tokens=max_tokens)
+        elif provider == "anthropic":
+            claude_model = model.split('/')[-1] if '/' in model else model
+            stream = stream_claude_response(messages_list, model=claude_model, temperature=temperature, max_tokens=max_tokens)
+        else:
+            stream = stream_openrouter_api(messages_list, model=model, temperature=temperature, max_tokens=max_tokens)
+
+        for delta in stream:
+            produced = True
+            yield delta
+    except Exception as e:
+        logger.error(f"Error streaming AI response: {e}")
+    observe_provider_call(provider, model, "chat_stream", time.perf_counter() - started, produced)
+
+    if not produced:
+        yield "عذراً، لم أتمكن من توليد استجابة. يرجى المحاولة مرة أخرى."
+
+def sse_event(payload):
+    """Format a dict as a single server-sent event"""
+    return f"data: {json.dumps(payload, ensure_ascii=False)}\n\n"
+
+# Per-client token buckets for the AI endpoints and chat-room events
+rate_limiter = RateLimiter(make_bucket_store())
+
+def client_key():
+    """Rate-limit key of the caller: the logged-in user, else the client IP"""
+    if current_user.is_authenticated:
+        return f"user:{current_user.get_id()}"
+    return f"ip:{request.remote_addr}"
+
+def check_rate_limit(policy, cost=1):
+    """Return a 429 response when the caller is over ``policy``, else None"""
+    retry_after = rate_limiter.take(policy, [client_key()], cost)
+    if not retry_after:
+        return None
+    seconds = max(1, math.ceil(retry_after))
+    response = jsonify({'error': 'Too many requests, please slow down', 'retry_after': seconds})
+    response.status_code = 429
+    response.headers['Retry-After'] = str(seconds)
+    return response
+
+def check_socket_rate_limit(event, policy='socket_message', cost=1):
+    """Emit 'rate_limited' to the sender and return False when it is over ``policy``"""
+    retry_after = rate_limiter.take(policy, [f"sid:{request.sid}", client_key()], cost)
+    if not retry_after:
+        return True
+    emit('rate_limited', {'event': event, 'retry_after': round(retry_after, 1)})
+    return False
 
 # Home route - render index template
 @app.route('/')
@@ -220,25 +421,9 @@ def chat():
     # Get username from session storage or use a default
     username = request.args.get('username', 'زائر')
 
-    # Get available models
-    models = get_available_models()
-    default_models = [
-        {"id": "gpt-4o", "name": "GPT-4o"},
-        {"id": "gpt-3.5-turbo", "name": "GPT-3.5 Turbo"},
-        {"id": "gemini-1.5-pro", "name": "Gemini 1.5 Pro"},
-        {"id": "gemini-1.5-flash", "name": "Gemini 1.5 Flash"},
-        {"id": "claude-3-5-sonnet-20241022", "name": "Claude 3.5 Sonnet"},
-        {"id": "claude-3-opus-20240229", "name": "Claude 3 Opus"},
-        {"id": "claude-3-sonnet-20240229", "name": "Claude 3 Sonnet"},
-        {"id": "claude-3-haiku-20240307", "name": "Claude 3 Haiku"},
-        {"id": "anthropic/claude-3-opus", "name": "Claude 3 Opus (OpenRouter)"},
-        {"id": "anthropic/claude-3-sonnet", "name": "Claude 3 Sonnet (OpenRouter)"},
-    ]
-
-    all_models = models + default_models if models else default_models
-
-    # Get available voices
-    voices = get_available_voices()
+    # Served from the in-memory catalogue cache
+    all_models = model_catalog.get()
+    voices = voice_catalog.get()
 
     return render_template(
         'chat.html', 
@@ -274,8 +459,7 @@ def code_generator():
 # Audio generator route
 @app.route('/audio-generator')
 def audio_generator():
-    # Get available voices
-    voices = get_available_voices()
+    voices = voice_catalog.get()
 
     return render_template(
         'audio_generator.html',
@@ -291,76 +475,156 @@ def image_recognition():
         app_title='التعرف على الصور - ياسمين'
     )
 
+def make_title(user_message):
+    return user_message[:30] + "..." if len(user_message) > 30 else user_message
+
+def persist_chat_turn(conversation_id, context_state, user_message, user_created_at, ai_response, is_first_exchange):
+    """Write one chat turn in a single transaction and return the conversation ID.
+
+    Creates the conversation when ``conversation_id`` is None, then adds the
+    user and assistant messages (the counters follow via the Message events),
+    the rolling summary and the title, all in one commit.
+    """
+    try:
+        if conversation_id is None:
+            conversation = Conversation(title=make_title(user_message))
+            db.session.add(conversation)
+            db.session.flush()
+        else:
+            conversation = Conversation.get_active(conversation_id)
+            if conversation is None:
+                raise LookupError(f"Conversation {conversation_id} was deleted during generation")
+
+        # Only move the summary forward; a concurrent turn may already have folded further
+        if context_state.summary_message_id is not None and \
+                (conversation.summary_message_id or 0) < context_state.summary_message_id:
+            conversation.summary = context_state.summary
+            conversation.summary_message_id = context_state.summary_message_id
+
+        if is_first_exchange:
+            conversation.title = make_title(user_message)
+
+        db.session.add_all([
+            Message(conversation_id=conversation.id, role="user", content=user_message, created_at=user_created_at),
+            Message(conversation_id=conversation.id, role="assistant", content=ai_response,
+                    created_at=datetime.now(timezone.utc)),
+        ])
+        db.session.commit()
+        return conversation.id
+    except Exception:
+        db.session.rollback()
+        raise
+    finally:
+        db.session.close()
+
 # API endpoint for generating chat responses
 @app.route('/api/chat', methods=['POST'])
 def api_chat():
-    """Handle chat messages and generate responses"""
+    """Handle chat messages and generate responses.
+
+    With ``stream: true`` in the request body the reply is sent as
+    server-sent events: ``{"delta": ...}`` per chunk, then ``{"done": true}``.
+
+    The database is only touched in a short read phase before generation and
+    a single write transaction after it; no connection is held while the
+    provider is generating.
+    """
     try:
         data = request.json
         user_message = data.get('message')
         conversation_id = data.get('conversation_id')
-        model = data.get('model', 'openai/gpt-3.5-turbo')
+        model = data.get('model', DEFAULT_CHAT_MODEL)
         temperature = float(data.get('temperature', 0.7))
         max_tokens = int(data.get('max_tokens', 2000))
+        stream = bool(data.get('stream', False))
+        use_cache = not data.get('no_cache', False)
+        hedge = bool(data.get('hedge', False))
+        user_created_at = datetime.now(timezone.utc)
 
         if not user_message:
             return jsonify({"error": "No message provided"}), 400
 
-        # Create a new conversation if needed
-        if not conversation_id:
-            conversation = Conversation(title=user_message[:30] + "..." if len(user_message) > 30 else user_message)
-            db.session.add(conversation)
-            db.session.commit()
-            conversation_id = conversation.id
-        else:
-            conversation = Conversation.query.get(conversation_id)
-            if not conversation:
-                return jsonify({"error": "Conversation not found"}), 404
-
-        # Get previous messages for context
-        previous_messages = Message.query.filter_by(conversation_id=conversation_id).order_by(Message.timestamp).all()
-        messages_for_ai = []
-
-        # Format messages for the AI
-        for msg in previous_messages:
-            messages_for_ai.append({
-                "role": msg.role,
-                "content": msg.content
-            })
+        if not is_known_model(model):
+            return jsonify({"error": "Unknown model"}), 400
 
-        # Add the new user message
-        messages_for_ai.append({
-            "role": "user",
-            "content": user_message
-        })
-
-        # Save the user message to the database
-        user_msg = Message(
-            conversation_id=conversation_id,
-            role="user",
-            content=user_message,
-            timestamp=datetime.now(timezone.utc)
-        )
-        db.session.add(user_msg)
-        db.session.commit()
-
-        # Generate AI response
-        ai_response = generate_ai_response(messages_for_ai, model, temperature, max_tokens)
-
-        # Save the AI response to the database
-        assistant_msg = Message(
-            conversation_id=conversation_id,
-            role="assistant",
-            content=ai_response,
-            timestamp=datetime.now(timezone.utc)
-        )
-        db.session.add(assistant_msg)
-        db.session.commit()
+        limited = check_rate_limit('chat', chat_cost(max_tokens))
+        if limited:
+            return limited
 
-        # Update conversation title if this is the first exchange
-        if len(previous_messages) == 0:
-            conversation.title = user_message[:30] + "..." if len(user_message) > 30 else user_message
-            db.session.commit()
+        # --- Read phase: copy what generation needs into plain objects ---
+        context_state = SimpleNamespace(id=None, summary=None, summary_message_id=None)
+        history = []
+        backlog = []
+        if conversation_id:
+            conversation = Conversation.get_active(conversation_id)
+            if not conversation:
+                db.session.close()
+                return jsonify({"error": "Conversation not found"}), 404
+            conversation_id = conversation.id
+            context_state = SimpleNamespace(
+                id=conversation.id,
+                summary=conversation.summary,
+                summary_message_id=conversation.summary_message_id
+            )
+            # Get the newest messages not yet folded into the conversation summary
+            history = [
+                {"id": msg.id, "role": msg.role, "content": msg.content}
+                for msg in Message.get_history(conversation_id, after_id=conversation.summary_message_id,
+                                               limit=CONTEXT_HISTORY_LIMIT + 1)
+            ]
+            if len(history) > CONTEXT_HISTORY_LIMIT:
+                # Never summarised this far back: the oldest unsummarised turns are folded a few chunks per turn
+                history = history[1:]
+                backlog = [
+                    {"id": msg.id, "role": msg.role, "content": msg.content}
+                    for msg in Message.get_history(conversation_id, after_id=conversation.summary_message_id,
+                                                   limit=CONTEXT_HISTORY_LIMIT, oldest=True)
+                ]
+        else:
+            conversation_id = None
+        is_first_exchange = not history and not context_state.summary
+        stored_summary_id = context_state.summary_message_id
+
+        # Return the pooled connection before any provider call
+        db.session.close()
+
+        # Keep the newest turns within the token budget; older ones roll into the summary
+        messages_for_ai = build_context(context_state, history, user_message, model, max_tokens, chatbot,
+                                        backlog=backlog)
+        if context_state.summary_message_id == stored_summary_id:
+            context_state.summary_message_id = None  # nothing new to persist
+
+        if stream:
+            def generate():
+                parts = []
+                saved_id = conversation_id
+                try:
+                    for delta in stream_ai_response(messages_for_ai, model, temperature, max_tokens):
+                        parts.append(delta)
+                        yield sse_event({"delta": delta})
+                finally:
+                    # Persist whatever was produced, even if the client went away mid-stream
+                    ai_response = "".join(parts)
+                    if ai_response:
+                        try:
+                            saved_id = persist_chat_turn(conversation_id, context_state, user_message,
+                                                         user_created_at, ai_response, is_first_exchange)
+                        except Exception as e:
+                            logger.error(f"Error saving streamed response: {e}")
+                yield sse_event({"done": True, "conversation_id": saved_id})
+
+            return Response(
+                stream_with_context(generate()),
+                mimetype='text/event-stream',
+                headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+            )
+
+        # --- Generation: no session held ---
+        ai_response = generate_ai_response(messages_for_ai, model, temperature, max_tokens, use_cache=use_cache, hedge=hedge)
+
+        # --- Write phase: one transaction for the whole turn ---
+        conversation_id = persist_chat_turn(conversation_id, context_state, user_message,
+                                            user_created_at, ai_response, is_first_exchange)
 
         return jsonify({
             "message": ai_response,
@@ -374,33 +638,141 @@ def api_chat():
 # API endpoint for text-to-speech
 @app.route('/api/text-to-speech', methods=['POST'])
 def api_text_to_speech():
-    """Generate speech from text"""
+    """Generate speech from text.
+
+    Audio is cached on disk by content hash; the response carries an
+    ``audio_url`` to fetch it from. Pass ``inline: true`` to also get the
+    audio as base64 in the JSON body.
+    """
     try:
         data = request.json
         text = data.get('text')
         voice_id = data.get('voice_id', 'EXAVITQu4vr4xnSDxMaL')
+        inline = bool(data.get('inline', False))
 
         if not text:
             return jsonify({"error": "No text provided"}), 400
 
-        # Generate speech using ElevenLabs
-        result = text_to_speech(text, voice_id)
+        limited = check_rate_limit('tts', tts_cost(text))
+        if limited:
+            return limited
+
+        key = make_tts_key(text, voice_id, ELEVENLABS_MODEL_ID, ELEVENLABS_VOICE_SETTINGS)
+        if inline:
+            audio = read_cached_tts(key)
+            cached = audio is not None
+        else:
+            audio = None
+            cached = tts_cache.get_path(key) is not None
 
-        if isinstance(result, dict) and "error" in result:
-            return jsonify(result), 500
+        if not cached:
+            # Generate speech using ElevenLabs
+            result = text_to_speech(text, voice_id)
 
-        # Return the audio as base64
-        audio_base64 = base64.b64encode(result).decode('utf-8') if result else None
+            if isinstance(result, dict) and "error" in result:
+                return jsonify(result), 500
 
-        if not audio_base64:
-            return jsonify({"error": "Failed to generate speech"}), 500
+            audio = result.get("audio") if isinstance(result, dict) else result
+            if not audio:
+                return jsonify({"error": "Failed to generate speech"}), 500
 
-        return jsonify({"audio": audio_base64})
+            tts_cache.put(key, audio)
+
+        response = {"audio_url": url_for('api_tts_audio', key=key), "cached": cached}
+        if inline:
+            response["audio"] = base64.b64encode(audio).decode('utf-8')
+
+        return jsonify(response)
 
     except Exception as e:
         logger.error(f"Error in text-to-speech endpoint: {e}")
         return jsonify({"error": str(e)}), 500
 
+def read_cached_tts(key):
+    """Cached audio for ``key``, or None on a miss (including a file evicted while we read it)"""
+    path = tts_cache.get_path(key)
+    if path is None:
+        return None
+    try:
+        with open(path, 'rb') as f:
+            return f.read()
+    except OSError:
+        return None
+
+def synthesize_cached(text, voice_id):
+    """Synthesize one chunk of speech, going through the disk cache"""
+    key = make_tts_key(text, voice_id, ELEVENLABS_MODEL_ID, ELEVENLABS_VOICE_SETTINGS)
+    audio = read_cached_tts(key)
+    if audio is not None:
+        return audio
+
+    result = text_to_speech(text, voice_id)
+    audio = result.get("audio") if isinstance(result, dict) else None
+    if audio:
+        tts_cache.put(key, audio)
+    return audio
+
+# API endpoint for streamed text-to-speech
+@app.route('/api/text-to-speech/stream', methods=['POST'])
+def api_text_to_speech_stream():
+    """Stream speech as a chunked audio/mpeg response.
+
+    The text is split at sentence boundaries and the sentences are
+    synthesized concurrently, so playback can start after the first one.
+    """
+    try:
+        data = request.json
+        text = data.get('text')
+        voice_id = data.get('voice_id', 'EXAVITQu4vr4xnSDxMaL')
+
+        if not text:
+            return jsonify({"error": "No text provided"}), 400
+
+        limited = check_rate_limit('tts', tts_cost(text))
+        if limited:
+            return limited
+
+        audio_chunks = stream_text_to_speech(text, voice_id, synthesize=synthesize_cached)
+
+        # Synthesize the first sentence before committing to a 200 response
+        first_chunk = next(audio_chunks, None)
+        if first_chunk is None:
+            return jsonify({"error": "Failed to generate speech"}), 500
+
+        def generate():
+            yield first_chunk
+            for chunk in audio_chunks:
+                yield chunk
+
+        return Response(
+            generate(),
+            mimetype='audio/mpeg',
+            headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+        )
+
+    except Exception as e:
+        logger.error(f"Error in streamed text-to-speech endpoint: {e}")
+        return jsonify({"error": str(e)}), 500
+
+# Serve cached speech straight from disk; content-addressed, so it never changes
+@app.route('/api/tts-audio/<key>', methods=['GET'])
+def api_tts_audio(key):
+    if not is_valid_tts_key(key):
+        return jsonify({"error": "Invalid audio key"}), 404
+
+    path = tts_cache.get_path(key)
+    if path is None:
+        return jsonify({"error": "Audio not found"}), 404
+
+    try:
+        # send_file stats and opens the file here; once open, eviction cannot cut the response short
+        response = send_file(path, mimetype='audio/mpeg', conditional=True, etag=key, max_age=31536000)
+    except OSError:
+        # Evicted between get_path() and send_file()
+        return jsonify({"error": "Audio not found"}), 404
+    response.headers['Cache-Control'] = 'public, max-age=31536000, immutable'
+    return response
+
 # API endpoint for generating images
 @app.route('/api/generate-image', methods=['POST'])
 def api_generate_image():
@@ -411,6 +783,10 @@ def api_generate_image():
     if not prompt:
         return jsonify({'error': 'No prompt provided'}), 400
 
+    limited = check_rate_limit('image')
+    if limited:
+        return limited
+
     # Size mapping
     size_map = {
         256: "256x256",
@@ -441,7 +817,15 @@ def api_generate_code():
     if not prompt:
         return jsonify({'error': 'No prompt provided'}), 400
 
-    result = generate_code(prompt, language)
+    limited = check_rate_limit('chat', chat_cost(2000))
+    if limited:
+        return limited
+
+    # generate_code always runs gpt-4 with temperature 0.7 and max_tokens 2000
+    cache_messages = [{"role": "system", "content": language or ""}, {"role": "user", "content": prompt}]
+    result = cached_call("openai-code", "gpt-4", cache_messages, 0.7, 2000,
+                         lambda: generate_code(prompt, language),
+                         bypass=bool(data.get('no_cache', False)), should_cache=is_cacheable_reply)
 
     return jsonify({
         'code': result,
@@ -451,39 +835,177 @@ def api_generate_code():
 # API endpoint for getting available models
 @app.route('/api/models', methods=['GET'])
 def api_models():
-    models = get_available_models()
-
-    # Add default models if no models returned from OpenRouter
-    if not models:
-        models = [
-            {"id": "gpt-4o", "name": "GPT-4o"},
-            {"id": "gpt-3.5-turbo", "name": "GPT-3.5 Turbo"},
-            {"id": "gemini-1.5-pro", "name": "Gemini 1.5 Pro"},
-            {"id": "gemini-1.5-flash", "name": "Gemini 1.5 Flash"},
-            {"id": "claude-3-5-sonnet-20241022", "name": "Claude 3.5 Sonnet"},
-            {"id": "claude-3-opus-20240229", "name": "Claude 3 Opus"},
-            {"id": "claude-3-sonnet-20240229", "name": "Claude 3 Sonnet"},
-            {"id": "claude-3-haiku-20240307", "name": "Claude 3 Haiku"},
-            {"id": "anthropic/claude-3-opus", "name": "Claude 3 Opus (OpenRouter)"},
-            {"id": "anthropic/claude-3-sonnet", "name": "Claude 3 Sonnet (OpenRouter)"},
-        ]
-
-    return jsonify({'models': models})
+    return jsonify({'models': model_catalog.get()})
 
 # API endpoint for getting available voices
 @app.route('/api/voices', methods=['GET'])
 def api_voices():
-    voices = get_available_voices()
-    return jsonify({'voices': voices})
+    return jsonify({'voices': voice_catalog.get()})
+
+# Service statistics, read at scrape time and exported on /metrics
+def _http_pool_stats():
+    from services.http_client import get_pool_stats
+    return get_pool_stats()
+
+def _gemini_usage():
+    from services.gemini_service import get_usage_report
+    return get_usage_report()
+
+register_stats("yasmin_http_pool", _http_pool_stats, label="host", per_entry=True)
+register_stats("yasmin_response_cache", get_cache_stats)
+register_stats("yasmin_tts_cache", tts_cache.stats)
+register_stats("yasmin_user_cache", user_cache.stats)
+register_stats("yasmin_rate_limit", rate_limiter.stats, label="policy")
+register_stats("yasmin_room_history", room_history.stats)
+register_stats("yasmin_broadcast", broadcaster.stats)
+register_stats("yasmin_presence", presence.stats)
+register_stats("yasmin_provider_health", provider_router.snapshot, label="backend", per_entry=True)
+register_stats("yasmin_gemini_usage", _gemini_usage)
+
+# Prometheus scrape endpoint: request, provider, Socket.IO, DB pool and service metrics
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    if METRICS_TOKEN and request.headers.get('Authorization') != f"Bearer {METRICS_TOKEN}":
+        return Response('Unauthorized\n', status=401, mimetype='text/plain')
+    return Response(render_metrics(), content_type=METRICS_CONTENT_TYPE)
+
+# Page sizes for the keyset-paginated list endpoints
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+def get_page_args():
+    """Read limit/before/after from the query string; raises ValueError on bad input"""
+    limit = min(max(int(request.args.get('limit', DEFAULT_PAGE_SIZE)), 1), MAX_PAGE_SIZE)
+    before = request.args.get('before')
+    after = request.args.get('after')
+    before_key = decode_cursor(before) if before else None
+    after_key = decode_cursor(after) if after else None
+    if (before and before_key is None) or (after and after_key is None):
+        raise ValueError('Invalid cursor')
+    return limit, before_key, after_key
+
+# Result sizes for full-text search
+DEFAULT_SEARCH_LIMIT = 20
+MAX_SEARCH_LIMIT = 100
+
+@app.route('/api/search', methods=['GET'])
+def api_search():
+    """Full-text search over conversation messages, best match first.
+
+    Query parameters: ``q``, ``limit``, ``offset`` and optionally
+    ``conversation_id`` to search inside one conversation. Diacritics and
+    alef/ya/ta-marbuta variants are ignored on both sides.
+    """
+    query = request.args.get('q', '').strip()
+    if not query_terms(query):
+        return jsonify({'error': 'Search query is required'}), 400
+    try:
+        limit = min(max(int(request.args.get('limit', DEFAULT_SEARCH_LIMIT)), 1), MAX_SEARCH_LIMIT)
+        offset = max(int(request.args.get('offset', 0)), 0)
+        conversation_id = request.args.get('conversation_id', type=int)
+    except ValueError:
+        return jsonify({'error': 'Invalid search parameters'}), 400
+
+    try:
+        rows, has_more = Message.search(query, limit=limit, offset=offset, conversation_id=conversation_id)
+
+        terms = query_terms(query)
+        results = []
+        for message, rank, conversation_title in rows:
+            result = message.to_dict()
+            result['conversation_title'] = conversation_title
+            result['rank'] = float(rank or 0)
+            result['highlight'] = highlight(message.content, terms)
+            results.append(result)
+        return jsonify({
+            'results': results,
+            'has_more': has_more,
+            'next_offset': offset + limit if has_more else None
+        })
+    except Exception as e:
+        logger.error(f"Error searching messages: {e}")
+        return jsonify({'error': 'Error searching messages'}), 500
+
+@app.route('/api/export', methods=['GET'])
+@login_required
+def api_export():
+    """Stream conversations and their messages as NDJSON.
+
+    Query parameters: ``conversation_id`` (repeatable) to export only some
+    conversations, and ``gzip=1`` to compress the stream. Each download holds
+    a database connection until it ends, so exports are rate limited.
+    """
+    limited = check_rate_limit('export')
+    if limited:
+        return limited
+
+    conversation_ids = request.args.getlist('conversation_id', type=int)
+    compress = request.args.get('gzip') in ('1', 'true')
+    filename = f"conversations-{datetime.now(timezone.utc).strftime('%Y%m%d-%H%M%S')}.ndjson"
+    headers = {'Content-Disposition': f'attachment; filename="{filename}{".gz" if compress else ""}"'}
+    return Response(
+        stream_with_context(export_ndjson(conversation_ids, compress=compress)),
+        mimetype='application/gzip' if compress else 'application/x-ndjson',
+        headers=headers
+    )
+
+@app.route('/api/import', methods=['POST'])
+@login_required
+def api_import():
+    """Import an NDJSON export (plain or gzip) sent as the request body or as a ``file`` upload.
+
+    The body, its decompressed size and the number of conversations and
+    messages are bounded (IMPORT_MAX_* in transfer.py); an import is
+    committed entirely or not at all.
+    """
+    limited = check_rate_limit('import')
+    if limited:
+        return limited
+
+    request.max_content_length = IMPORT_MAX_BYTES
+    try:
+        upload = request.files.get('file')
+        source = upload.stream if upload else request.stream
+        lines = read_lines(open_import_stream(source), IMPORT_MAX_DECODED_BYTES)
+        stats = import_ndjson(lines, max_conversations=IMPORT_MAX_CONVERSATIONS,
+                              max_messages=IMPORT_MAX_MESSAGES, atomic=True)
+        return jsonify({'success': True, **stats})
+    except RequestEntityTooLarge:
+        return jsonify({'error': f'Import file is larger than {IMPORT_MAX_BYTES} bytes'}), 413
+    except ImportLimitError as e:
+        logger.warning(f"Rejected import: {e}")
+        return jsonify({'error': str(e)}), 413
+    except (ValueError, KeyError) as e:
+        logger.warning(f"Rejected import: {e}")
+        return jsonify({'error': 'Invalid export file'}), 400
+    except Exception as e:
+        logger.error(f"Error importing conversations: {e}")
+        return jsonify({'error': 'Error importing conversations'}), 500
 
 # API endpoints for conversations
 @app.route('/api/conversations', methods=['GET'])
 def get_conversations():
-    """Get all conversations"""
+    """Get a page of conversations, most recently updated first.
+
+    Query parameters: ``limit``, and either ``before`` (older page) or
+    ``after`` (newer page) holding a cursor from a previous response.
+    """
     try:
-        conversations = Conversation.get_all_conversations()
+        try:
+            limit, before, after = get_page_args()
+        except ValueError:
+            return jsonify({'error': 'Invalid pagination parameters'}), 400
+
+        conversations, has_more = Conversation.get_page(limit, before=before, after=after)
+        oldest = conversations[-1] if conversations else None
+        newest = conversations[0] if conversations else None
         return jsonify({
-            'conversations': [conversation.to_dict() for conversation in conversations]
+            'conversations': [conversation.to_dict() for conversation in conversations],
+            'has_more': has_more,
+            # Pass as ?before= to get the next (older) page
+            'next_cursor': encode_cursor(oldest.updated_at, oldest.id) if oldest and (has_more or after) else None,
+            # Pass as ?after= to check for newer conversations
+            'prev_cursor': encode_cursor(newest.updated_at, newest.id) if newest else None
         })
     except Exception as e:
         logger.error(f"Error getting conversations: {e}")
@@ -491,13 +1013,24 @@ def get_conversations():
 
 @app.route('/api/conversations/<int:conversation_id>', methods=['GET'])
 def get_conversation(conversation_id):
-    """Get a specific conversation with messages"""
+    """Get a specific conversation with a page of its messages.
+
+    Without cursors the newest ``limit`` messages are returned (oldest first);
+    ``before=<next_cursor>`` loads the page of older messages.
+    """
     try:
-        conversation = Conversation.query.get(conversation_id)
+        conversation = Conversation.get_active(conversation_id)
         if not conversation:
             return jsonify({'error': 'Conversation not found'}), 404
 
-        messages = Message.query.filter_by(conversation_id=conversation_id).order_by(Message.timestamp).all()
+        try:
+            limit, before, after = get_page_args()
+        except ValueError:
+            return jsonify({'error': 'Invalid pagination parameters'}), 400
+
+        messages, has_more = Message.get_page(conversation_id, limit, before=before, after=after)
+        oldest = messages[0] if messages else None
+        newest = messages[-1] if messages else None
 
         return jsonify({
             'conversation': conversation.to_dict(),
@@ -505,10 +1038,13 @@ def get_conversation(conversation_id):
                 'id': message.id,
                 'role': message.role,
                 'content': message.content,
-                'timestamp': message.timestamp.isoformat(),
+                'timestamp': message.created_at.isoformat() if message.created_at else None,
                 'feedback': message.feedback,
                 'metadata': message.message_metadata
-            } for message in messages]
+            } for message in messages],
+            'has_more': has_more,
+            'next_cursor': encode_cursor(oldest.created_at, oldest.id) if oldest and (has_more or after) else None,
+            'prev_cursor': encode_cursor(newest.created_at, newest.id) if newest else None
         })
     except Exception as e:
         logger.error(f"Error getting conversation: {e}")
@@ -518,14 +1054,14 @@ def get_conversation(conversation_id):
 def delete_conversation(conversation_id):
     """Delete a conversation and all its messages"""
     try:
-        conversation = Conversation.query.get(conversation_id)
+        conversation = Conversation.get_active(conversation_id)
         if not conversation:
             return jsonify({'error': 'Conversation not found'}), 404
 
-        db.session.delete(conversation)
-        db.session.commit()
-
-        return jsonify({'success': True, 'message': 'Conversation deleted'})
+        if conversation_purger.delete(conversation):
+            return jsonify({'success': True, 'message': 'Conversation deleted'})
+        # Hidden already; the messages are removed in the background
+        return jsonify({'success': True, 'pending': True, 'message': 'Conversation deletion scheduled'}), 202
     except Exception as e:
         logger.error(f"Error deleting conversation: {e}")
         db.session.rollback()
@@ -535,14 +1071,13 @@ def delete_conversation(conversation_id):
 def clear_conversation(conversation_id):
     """Clear all messages in a conversation but keep the conversation"""
     try:
-        conversation = Conversation.query.get(conversation_id)
+        conversation = Conversation.get_active(conversation_id)
         if not conversation:
             return jsonify({'error': 'Conversation not found'}), 404
 
-        Message.query.filter_by(conversation_id=conversation_id).delete()
-        db.session.commit()
-
-        return jsonify({'success': True, 'message': 'Conversation cleared'})
+        if conversation_purger.clear(conversation):
+            return jsonify({'success': True, 'message': 'Conversation cleared'})
+        return jsonify({'success': True, 'pending': True, 'message': 'Conversation clearing scheduled'}), 202
     except Exception as e:
         logger.error(f"Error clearing conversation: {e}")
         db.session.rollback()
@@ -552,6 +1087,8 @@ def clear_conversation(conversation_id):
 @socketio.on('connect')
 def handle_connect():
     client_id = request.sid
+    SOCKETIO_EVENTS.labels('connect').inc()
+    SOCKETIO_CONNECTED.inc()
     logger.info(f'Client connected: {client_id}')
     # Send initial connection acknowledgment to client
     emit('server_status', {
@@ -564,9 +1101,12 @@ def handle_connect():
 @socketio.on('disconnect')
 def handle_disconnect():
     client_id = request.sid if hasattr(request, 'sid') else 'unknown'
+    SOCKETIO_EVENTS.labels('disconnect').inc()
+    SOCKETIO_CONNECTED.dec()
     username = session.get('username', 'unknown')
     room = session.get('room', 'unknown')
     logger.info(f'Client disconnected: {client_id}, Username: {username}, Room: {room}')
+    emit_presence(presence.disconnect(client_id))
 
     # If user was in a room, notify others
     if room != 'unknown':
@@ -580,6 +1120,7 @@ def handle_disconnect():
 
 @socketio.on('join')
 def handle_join(data):
+    SOCKETIO_EVENTS.labels('join').inc()
     try:
         client_id = request.sid
         logger.info(f"Join attempt from client {client_id}: {data}")
@@ -605,22 +1146,55 @@ def handle_join(data):
             })
             return
 
+        # Names longer than the room_message columns could never be stored in the history
+        if len(username) > RoomMessage.username.type.length:
+            emit('join_response', {
+                'success': False,
+                'msg': f'اسم المستخدم طويل جداً (الحد الأقصى {RoomMessage.username.type.length} حرفاً)'
+            })
+            return
+        if not room or not isinstance(room, str) or len(room) > RoomMessage.room.type.length:
+            logger.warning(f"Invalid room from {client_id}: {room!r}")
+            emit('join_response', {
+                'success': False,
+                'msg': f'اسم الغرفة غير صالح (الحد الأقصى {RoomMessage.room.type.length} حرفاً)'
+            })
+            return
+
+        # Clients offering 'msgpack' get room messages in the compact binary format
+        wire_format = negotiate_wire_format(data.get('formats'))
+
         # Store in session
         session['username'] = username
         session['room'] = room
+        session['wire_format'] = wire_format
         logger.info(f"User {username} joining room {room} from client {client_id}")
 
-        # Join the room
+        # Join the room, and its sub-room for the negotiated wire format
         join_room(room)
+        join_room(format_room(room, wire_format))
+        deltas = presence.join(client_id, room, username)
 
-        # Send success response to the client
+        # Send success response to the client, with who is already in the room
         emit('join_response', {
             'success': True,
             'username': username,
             'room': room,
             'sid': client_id,
+            'roster': presence.roster(room),
+            'format': wire_format,
             'msg': f'تم الانضمام إلى الغرفة بنجاح'
         })
+        emit_presence(deltas)
+
+        # Replay the latest room messages to the joining client
+        if wire_format == COMPACT_FORMAT:
+            emit('room_history_packed', pack_messages(room_history.recent(room)))
+        else:
+            emit('room_history', {
+                'room': room,
+                'messages': room_history.recent(room)
+            })
 
         # Notify others in the room
         emit('status', {
@@ -642,14 +1216,17 @@ def handle_join(data):
 
 @socketio.on('leave')
 def handle_leave(data):
+    SOCKETIO_EVENTS.labels('leave').inc()
     username = data.get('username', session.get('username', 'زائر'))
     room = data.get('room', session.get('room', 'default_room'))
 
     if not username or not room:
         return
 
-    # مغادرة الغرفة
+    # مغادرة الغرفة والغرفة الفرعية لصيغة النقل
     leave_room(room)
+    leave_room(format_room(room, session.get('wire_format', JSON_FORMAT)))
+    emit_presence(presence.leave(request.sid, room))
 
     # إخطار الآخرين في الغرفة
     emit('status', {
@@ -659,6 +1236,7 @@ def handle_leave(data):
 
 @socketio.on('message')
 def handle_message(data):
+    SOCKETIO_EVENTS.labels('message').inc()
     try:
         client_id = request.sid
         logger.info(f"Message event from client {client_id}")
@@ -668,6 +1246,11 @@ def handle_message(data):
             logger.warning(f"Invalid message data from {client_id}: {data}")
             return
 
+        presence.touch(client_id)
+
+        if not check_socket_rate_limit('message'):
+            return
+
         # Get username from session or data
         username = session.get('username', data.get('username', 'زائر'))
         message = data.get('message')
@@ -684,22 +1267,28 @@ def handle_message(data):
 
         logger.info(f"Broadcasting message from {username} in room {room}")
 
+        raw_message = message
+
         # Sanitize message to prevent any HTML/script injection
         message = html.escape(message)
 
-        # Process message with AI if mentioned
-        if message.startswith('@ياسمين'):
-            ai_response = chatbot.get_response(message[8:])  # Remove @ياسمين
-            emit('message', {
-                'username': 'ياسمين',
-                'message': ai_response,
-                'timestamp': datetime.now(timezone.utc).isoformat()
-            }, to=room)
-        emit('message', {
+        # Broadcast the human message first; an AI mention must never delay it
+        payload = {
             'username': username,
             'message': message,
             'timestamp': datetime.now(timezone.utc).isoformat()
-        }, to=room)
+        }
+        broadcaster.emit(room, payload)
+        room_history.record(room, payload)
+
+        # Hand AI mentions to the background worker pool
+        if raw_message.startswith('@ياسمين'):
+            prompt = raw_message[len('@ياسمين'):].strip()
+            if check_socket_rate_limit('mention', policy='chat', cost=chat_cost(2000)) \
+                    and not mention_dispatcher.submit(room, prompt):
+                emit('message_error', {
+                    'msg': 'ياسمين مشغولة بالرد على رسائل أخرى، يرجى المحاولة بعد قليل'
+                })
 
         logger.info(f"Message from {username} successfully broadcast to room {room}")
     except Exception as e:
@@ -13,35 +13,39 @@ if not ANTHROPIC_API_KEY:
 
 client = Anthropic(api_key=ANTHROPIC_API_KEY)
 
+def _to_anthropic_messages(messages):
+    """تحويل رسائل بتنسيق OpenAI إلى تنسيق Anthropic"""
+    anthropic_messages = []
+    for msg in messages:
+        role = msg.get("role")
+        content = msg.get("content")
+        
+        if role == "system":
+            # رسائل النظام يتم التعامل معها بشكل مختلف في Anthropic
+            anthropic_messages.append({
+                "role": "user",
+                "content": f"System: {content}"
+            })
+            anthropic_messages.append({
+                "role": "assistant",
+                "content": "I'll follow those instructions."
+            })
+        else:
+            # تحويل أدوار OpenAI (user, assistant) إلى أدوار Anthropic
+            anthropic_role = role if role in ["user", "assistant"] else "user"
+            anthropic_messages.append({
+                "role": anthropic_role,
+                "content": content
+            })
+    return anthropic_messages
+
 def generate_claude_response(messages, model="claude-3-5-sonnet-20241022", temperature=0.7, max_tokens=2000):
     """
     إنشاء رد باستخدام نماذج Claude من Anthropic
     the newest Anthropic model is "claude-3-5-sonnet-20241022" which was released October 22, 2024
     """
     try:
-        # تحويل رسائل بتنسيق OpenAI إلى تنسيق Anthropic
-        anthropic_messages = []
-        for msg in messages:
-            role = msg.get("role")
-            content = msg.get("content")
-            
-            if role == "system":
-                # رسائل النظام يتم التعامل معها بشكل مختلف في Anthropic
-                anthropic_messages.append({
-                    "role": "user",
-                    "content": f"System: {content}"
-                })
-                anthropic_messages.append({
-                    "role": "assistant",
-                    "content": "I'll follow those instructions."
-                })
-            else:
-                # تحويل أدوار OpenAI (user, assistant) إلى أدوار Anthropic
-                anthropic_role = role if role in ["user", "assistant"] else "user"
-                anthropic_messages.append({
-                    "role": anthropic_role,
-                    "content": content
-                })
+        anthropic_messages = _to_anthropic_messages(messages)
         
         # إرسال الطلب إلى Anthropic API
         response = client.messages.create(
@@ -56,6 +60,25 @@ def generate_claude_response(messages, model="claude-3-5-sonnet-20241022", tempe
         logging.error(f"Error generating Claude response: {e}")
         return None
 
+def stream_claude_response(messages, model="claude-3-5-sonnet-20241022", temperature=0.7, max_tokens=2000):
+    """
+    بث رد Claude على شكل أجزاء نصية متتابعة فور وصولها
+    """
+    try:
+        anthropic_messages = _to_anthropic_messages(messages)
+        
+        with client.messages.stream(
+            model=model,
+            max_tokens=max_tokens,
+            temperature=temperature,
+            messages=anthropic_messages
+        ) as stream:
+            for text in stream.text_stream:
+                if text:
+                    yield text
+    except Exception as e:
+        logging.error(f"Error streaming Claude response: {e}")
+
 def format_image_for_claude(image_path):
     """تنسيق صورة للاستخدام مع واجهة برمجة تطبيقات Claude المتعددة الوسائط"""
     import base64
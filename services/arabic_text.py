@@ -0,0 +1,100 @@
+"""
+Arabic text normalization for search.
+
+Indexed text and search queries go through the same normalization, so a
+query matches regardless of diacritics (tashkeel) or of which alef, ya or
+ta-marbuta variant was typed. Normalization never changes the length of a
+character except by dropping it, which lets highlights computed on the
+normalized text be mapped back onto the original message.
+"""
+import re
+import html
+
+# Harakat, tanwin, shadda, sukun (U+064B-U+065F), superscript alef, tatweel
+# and Quranic annotation marks
+_DROPPED = set(chr(c) for c in range(0x064B, 0x0660)) | {"\u0670", "\u0640"} \
+    | set(chr(c) for c in range(0x06D6, 0x06EE))
+
+_REPLACED = {
+    "\u0622": "\u0627",  # آ -> ا
+    "\u0623": "\u0627",  # أ -> ا
+    "\u0625": "\u0627",  # إ -> ا
+    "\u0671": "\u0627",  # ٱ -> ا
+    "\u0649": "\u064A",  # ى -> ي
+    "\u0626": "\u064A",  # ئ -> ي
+    "\u0624": "\u0648",  # ؤ -> و
+    "\u0629": "\u0647",  # ة -> ه
+}
+
+_WORD = re.compile(r"\w+")
+
+# Search terms beyond this are ignored; long pasted queries only slow the index down
+MAX_QUERY_TERMS = 8
+
+
+def _normalize_char(char):
+    if char in _DROPPED:
+        return ""
+    return _REPLACED.get(char, char).lower()
+
+
+def normalize_arabic(text):
+    """Normalized form of ``text`` used for indexing and querying"""
+    if not text:
+        return ""
+    return "".join(_normalize_char(char) for char in text)
+
+
+def query_terms(query):
+    """Distinct normalized word terms of a search query, in order"""
+    terms = []
+    for term in _WORD.findall(normalize_arabic(query)):
+        if term not in terms:
+            terms.append(term)
+    return terms[:MAX_QUERY_TERMS]
+
+
+def highlight(text, terms, context=60, max_length=240):
+    """
+    HTML snippet of ``text`` around the first match, with every word that
+    starts with one of ``terms`` wrapped in <mark>. Matching is done on the
+    normalized text; the original characters are shown.
+    """
+    text = text or ""
+    normalized = []
+    positions = []  # index in ``text`` of each normalized character
+    for index, char in enumerate(text):
+        for out in _normalize_char(char):
+            normalized.append(out)
+            positions.append(index)
+    normalized = "".join(normalized)
+
+    spans = []
+    if terms:
+        pattern = re.compile(r"\b(?:" + "|".join(re.escape(term) for term in terms) + r")\w*")
+        for match in pattern.finditer(normalized):
+            start = positions[match.start()]
+            end = positions[match.end() - 1] + 1
+            # Keep diacritics that follow the last matched letter inside the highlight
+            while end < len(text) and _normalize_char(text[end]) == "":
+                end += 1
+            spans.append((start, end))
+
+    if spans and len(text) > max_length:
+        window_start = max(0, spans[0][0] - context)
+    else:
+        window_start = 0
+    window_end = min(len(text), window_start + max_length)
+
+    parts = ["..." if window_start > 0 else ""]
+    cursor = window_start
+    for start, end in spans:
+        if start < cursor or end > window_end:
+            continue
+        parts.append(html.escape(text[cursor:start]))
+        parts.append("<mark>" + html.escape(text[start:end]) + "</mark>")
+        cursor = end
+    parts.append(html.escape(text[cursor:window_end]))
+    if window_end < len(text):
+        parts.append("...")
+    return "".join(parts)
@@ -0,0 +1,146 @@
+"""
+Per-room coalescing of chat broadcasts.
+
+A busy room (at least BROADCAST_BUSY_RATE messages in the current or the
+previous second) has its messages buffered and sent once per tick as a
+single 'message_batch' event, instead of one 'message' event per message.
+Each room broadcast is encoded once by the Socket.IO server and the same
+frame is written to every member, so batching cuts both the encodes and
+the per-client socket writes from one per message to one per tick.
+Quiet rooms, and any room while batching is disabled, are sent each
+message immediately.
+
+Every broadcast goes to the room's JSON sub-room as 'message' or
+'message_batch' and, when the compact format is available, to its
+MessagePack sub-room as one packed 'message_packed' frame (see
+services/compact_wire.py).
+
+Configuration (environment):
+    BROADCAST_BATCH_WINDOW_MS  tick length in milliseconds, typically 10-50 (default 25; 0 disables)
+    BROADCAST_BUSY_RATE        messages per second at which a room starts batching (default 10)
+"""
+import os
+import time
+import logging
+import threading
+
+from services.compact_wire import JSON_FORMAT, COMPACT_FORMAT, format_room, pack_messages, is_available
+
+logger = logging.getLogger(__name__)
+
+BROADCAST_BATCH_WINDOW_MS = float(os.environ.get("BROADCAST_BATCH_WINDOW_MS", 25))
+BROADCAST_BUSY_RATE = int(os.environ.get("BROADCAST_BUSY_RATE", 10))
+
+
+class _RoomState:
+    __slots__ = ("second", "count", "previous_count", "pending")
+
+    def __init__(self, second):
+        self.second = second
+        self.count = 0
+        self.previous_count = 0
+        self.pending = []
+
+
+class BroadcastBatcher:
+    def __init__(self, socketio, window_ms=BROADCAST_BATCH_WINDOW_MS, busy_rate=BROADCAST_BUSY_RATE,
+                 compact=None):
+        self.socketio = socketio
+        self.compact = is_available() if compact is None else compact
+        self.window = window_ms / 1000.0
+        self.busy_rate = busy_rate
+        self._rooms = {}
+        self._lock = threading.Lock()
+        self._started = False
+        self.direct = 0
+        self.batched = 0
+        self.frames = 0
+
+    def _ensure_ticker(self):
+        if self._started:
+            return
+        with self._lock:
+            if self._started:
+                return
+            self.socketio.start_background_task(self._tick_loop)
+            self._started = True
+
+    def emit(self, room, payload):
+        """Send a chat ``payload`` to ``room`` now or with the next tick"""
+        if self.window <= 0:
+            self.direct += 1
+            self._send(room, [payload])
+            return
+
+        second = int(time.monotonic())
+        with self._lock:
+            state = self._rooms.get(room)
+            if state is None:
+                state = self._rooms[room] = _RoomState(second)
+            if state.second != second:
+                state.previous_count = state.count if state.second == second - 1 else 0
+                state.second = second
+                state.count = 0
+            state.count += 1
+            busy = max(state.count, state.previous_count) >= self.busy_rate
+            # Anything already buffered must go out first to keep the room's order
+            if busy or state.pending:
+                state.pending.append(payload)
+                self.batched += 1
+                buffered = True
+            else:
+                self.direct += 1
+                buffered = False
+
+        if buffered:
+            self._ensure_ticker()
+        else:
+            self._send(room, [payload])
+
+    def _send(self, room, messages):
+        """One frame per wire format for ``messages`` of ``room``"""
+        json_room = format_room(room, JSON_FORMAT)
+        if len(messages) == 1:
+            self.socketio.emit('message', messages[0], to=json_room)
+        else:
+            self.socketio.emit('message_batch', {'messages': messages}, to=json_room)
+        if self.compact:
+            self.socketio.emit('message_packed', pack_messages(messages), to=format_room(room, COMPACT_FORMAT))
+
+    def flush(self):
+        """Send every buffered room its pending messages as one frame"""
+        now_second = int(time.monotonic())
+        frames = []
+        with self._lock:
+            for room, state in list(self._rooms.items()):
+                if state.pending:
+                    frames.append((room, state.pending))
+                    state.pending = []
+                elif state.second < now_second - 1:
+                    # Idle for more than a second: forget the room
+                    del self._rooms[room]
+
+        for room, messages in frames:
+            self._send(room, messages)
+        self.frames += len(frames)
+        return len(frames)
+
+    def _tick_loop(self):
+        while True:
+            self.socketio.sleep(self.window)
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"Error flushing room broadcasts: {e}")
+
+    def stats(self):
+        with self._lock:
+            return {
+                "rooms": len(self._rooms),
+                "window_ms": self.window * 1000,
+                "busy_rate": self.busy_rate,
+                "compact": self.compact,
+                "direct": self.direct,
+                "batched": self.batched,
+                "frames": self.frames,
+            }
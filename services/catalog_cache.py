@@ -0,0 +1,100 @@
+"""
+Process-wide TTL cache for slow-changing third-party catalogues
+(OpenRouter models, ElevenLabs voices).
+
+Reads never wait on the upstream API once a value has been loaded: a stale
+value is returned immediately while a single background refresh fetches a
+new one (stale-while-revalidate). Only one load runs at a time, so a cold
+read that arrives during the startup prefetch waits for it instead of
+fetching the catalogue a second time.
+
+Configuration (environment):
+    CATALOG_CACHE_TTL  seconds before a catalogue is refreshed (default 3600)
+"""
+import os
+import time
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+CATALOG_CACHE_TTL = int(os.environ.get("CATALOG_CACHE_TTL", 3600))
+
+
+class CachedResource:
+    """
+    A value produced by ``loader`` and kept for ``ttl`` seconds.
+
+    ``transform`` turns the raw loader result into the value that is served,
+    so derived data (e.g. the merged model list) is computed once per load.
+    When ``is_valid`` rejects a fresh result, the older value is kept if
+    there is one (else the rejected result is served) and the load is
+    retried after ``retry_after``.
+    """
+
+    def __init__(self, name, loader, ttl=CATALOG_CACHE_TTL, transform=None, is_valid=None, retry_after=60):
+        self.name = name
+        self.loader = loader
+        self.ttl = ttl
+        self.transform = transform or (lambda value: value)
+        self.is_valid = is_valid or (lambda value: True)
+        self.retry_after = retry_after
+        self._value = None
+        self._expires_at = 0.0
+        self._loaded = False
+        self._lock = threading.Lock()
+        self._load_lock = threading.Lock()  # held while loading: one upstream fetch at a time
+        self._refreshing = False
+
+    def _load(self):
+        with self._load_lock:
+            if self._loaded and time.time() < self._expires_at:
+                # Loaded by whoever held the lock before us
+                return
+            raw = self.loader()
+            ttl = self.ttl
+            if not self.is_valid(raw):
+                if self._loaded:
+                    logger.warning(f"Catalogue '{self.name}' refresh returned no data; keeping previous value")
+                    self._expires_at = time.time() + self.retry_after
+                    return
+                logger.warning(f"Catalogue '{self.name}' returned no data; retrying in {self.retry_after}s")
+                ttl = self.retry_after
+            self._value = self.transform(raw)
+            self._expires_at = time.time() + ttl
+            self._loaded = True
+
+    def _refresh_in_background(self):
+        with self._lock:
+            if self._refreshing:
+                return
+            self._refreshing = True
+
+        def run():
+            try:
+                self._load()
+            except Exception as e:
+                logger.error(f"Error refreshing catalogue '{self.name}': {e}")
+                self._expires_at = time.time() + self.retry_after
+            finally:
+                self._refreshing = False
+
+        threading.Thread(target=run, name=f"catalog-refresh-{self.name}", daemon=True).start()
+
+    def get(self):
+        if not self._loaded:
+            # First use: nothing to serve yet, so load inline, or wait for the prefetch in flight
+            self._load()
+            return self._value
+
+        if time.time() >= self._expires_at:
+            self._refresh_in_background()
+        return self._value
+
+    def prefetch(self):
+        """Start loading in the background so the first request finds a warm cache"""
+        if not self._loaded:
+            self._refresh_in_background()
+
+    def invalidate(self):
+        self._expires_at = 0.0
@@ -82,6 +82,39 @@ class ChatbotService:
             logger.error(f"Error generating summary: {e}")
             return "فشل توليد الملخص"
     
+    def stream_response(self, message: str):
+        """Yield the response to a chat-room mention as text deltas"""
+        produced = False
+        try:
+            if 'openai' in self.clients:
+                stream = self.clients['openai'].chat.completions.create(
+                    model="gpt-3.5-turbo",
+                    messages=[{"role": "user", "content": message}],
+                    stream=True
+                )
+                for chunk in stream:
+                    if chunk.choices and chunk.choices[0].delta.content:
+                        produced = True
+                        yield chunk.choices[0].delta.content
+                return
+
+            if 'anthropic' in self.clients:
+                with self.clients['anthropic'].messages.stream(
+                    model="claude-3-haiku-20240307",
+                    max_tokens=1000,
+                    messages=[{"role": "user", "content": message}]
+                ) as stream:
+                    for text in stream.text_stream:
+                        produced = True
+                        yield text
+                return
+
+            yield "عذراً، لا يمكنني الوصول إلى أي نموذج ذكاء اصطناعي حالياً."
+        except Exception as e:
+            logger.error(f"Error in chatbot streaming response: {e}")
+            if not produced:
+                yield "عذراً، حدث خطأ أثناء معالجة رسالتك."
+
     def get_response(self, message: str) -> str:
         """Get response from available AI models"""
         try:
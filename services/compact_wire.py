@@ -0,0 +1,86 @@
+"""
+Compact wire format for chat-room messages.
+
+Room messages are JSON dicts with long keys and ISO timestamps. Clients
+that ask for it on join receive them as MessagePack instead: one-letter
+keys, integer epoch-millisecond timestamps, and a list of messages per
+frame, so a single message and a busy-room batch use the same event.
+Socket.IO sends the packed bytes as a binary attachment, which travels as
+a binary WebSocket frame without any JSON or base64 re-encoding.
+
+Every room member also joins one sub-room per wire format, so a broadcast
+is encoded once per format rather than once per recipient. Clients that do
+not negotiate (older pages) stay on JSON, as does everyone when the
+msgpack package is not installed.
+
+Configuration (environment):
+    COMPACT_WIRE_ENABLED  set to 0 to send JSON to every client (default 1)
+"""
+import os
+import logging
+from datetime import datetime, timezone
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+logger = logging.getLogger(__name__)
+
+COMPACT_WIRE_ENABLED = os.environ.get("COMPACT_WIRE_ENABLED", "1").lower() in ("1", "true", "yes")
+
+JSON_FORMAT = "json"
+COMPACT_FORMAT = "msgpack"
+
+# Keys of the 'message' payload and their short forms; the client maps them back
+SHORT_KEYS = {
+    "username": "u",
+    "message": "m",
+    "timestamp": "t",
+    "stream_id": "s",
+}
+
+
+def is_available():
+    return COMPACT_WIRE_ENABLED and msgpack is not None
+
+
+def negotiate(requested):
+    """Wire format for a client that offered ``requested`` (a list of format names)"""
+    if is_available() and isinstance(requested, (list, tuple)) and COMPACT_FORMAT in requested:
+        return COMPACT_FORMAT
+    return JSON_FORMAT
+
+
+def format_room(room, wire_format):
+    """Sub-room of ``room`` holding the members that use ``wire_format``"""
+    return f"{room}\x1f{wire_format}"
+
+
+def _epoch_millis(timestamp):
+    if isinstance(timestamp, str):
+        try:
+            timestamp = datetime.fromisoformat(timestamp)
+        except ValueError:
+            return None
+    if not isinstance(timestamp, datetime):
+        return None
+    if timestamp.tzinfo is None:
+        # Naive values come from the database and are stored in UTC
+        timestamp = timestamp.replace(tzinfo=timezone.utc)
+    return int(timestamp.timestamp() * 1000)
+
+
+def compact_message(payload):
+    compact = {}
+    for key, value in payload.items():
+        if key == "timestamp":
+            value = _epoch_millis(value)
+        if value is not None:
+            compact[SHORT_KEYS.get(key, key)] = value
+    return compact
+
+
+def pack_messages(payloads):
+    """MessagePack bytes of ``payloads`` (message dicts) in the compact form"""
+    return msgpack.packb([compact_message(payload) for payload in payloads], use_bin_type=True)
@@ -0,0 +1,239 @@
+"""
+Token-budgeted context window for long conversations.
+
+Only the newest turns that fit the budget are sent to the provider. Turns
+that fall out of the window are folded into a rolling summary stored on the
+conversation (``Conversation.summary``); ``summary_message_id`` marks the
+last message already folded in, so each turn only summarises the delta and
+only loads the messages after that marker.
+
+Summarising costs a blocking LLM call before the reply, so once the history
+outgrows the budget it is folded down to a low-water mark rather than just
+enough to fit: the following turns fit again without a summary until the
+history has regrown past the budget.
+
+Turns are folded in chunks of at most CONTEXT_FOLD_CHUNK_TOKENS, one
+summary call each, and the marker moves forward after every chunk that
+succeeds, so a single call never has to take the whole history and a
+failure only costs the chunk it happened in. At most CONTEXT_FOLD_MAX_CHUNKS
+calls are made per turn.
+
+Only the newest CONTEXT_HISTORY_LIMIT unsummarised messages are loaded for
+the window. A conversation with more than that (one that was never
+summarised) also gets its oldest unsummarised messages as a ``backlog``,
+which is folded a few chunks per turn; until it has caught up, the turns
+between the backlog and the window are left out of the context.
+
+Configuration (environment):
+    CONTEXT_TOKEN_BUDGET       max tokens of history sent per turn (default 6000)
+    CONTEXT_LOW_WATER          share of the budget kept as recent turns after a fold (default 0.5)
+    CONTEXT_HISTORY_LIMIT      unsummarised messages loaded per turn (default 200)
+    CONTEXT_FOLD_CHUNK_TOKENS  max tokens of turns per summary call (default 3000)
+    CONTEXT_FOLD_MAX_CHUNKS    summary calls per turn (default 2)
+"""
+import os
+import logging
+
+logger = logging.getLogger(__name__)
+
+try:
+    import tiktoken
+except ImportError:  # optional dependency, fall back to a character heuristic
+    tiktoken = None
+
+CONTEXT_TOKEN_BUDGET = int(os.environ.get("CONTEXT_TOKEN_BUDGET", 6000))
+CONTEXT_LOW_WATER = float(os.environ.get("CONTEXT_LOW_WATER", 0.5))
+CONTEXT_HISTORY_LIMIT = int(os.environ.get("CONTEXT_HISTORY_LIMIT", 200))
+CONTEXT_FOLD_CHUNK_TOKENS = int(os.environ.get("CONTEXT_FOLD_CHUNK_TOKENS", 3000))
+CONTEXT_FOLD_MAX_CHUNKS = int(os.environ.get("CONTEXT_FOLD_MAX_CHUNKS", 2))
+
+# Context window sizes by model prefix (longest prefix wins)
+MODEL_CONTEXT_LIMITS = {
+    "gpt-3.5-turbo": 16385,
+    "gpt-4": 8192,
+    "gpt-4o": 128000,
+    "gpt-4-turbo": 128000,
+    "claude": 200000,
+    "anthropic/": 200000,
+    "gemini-1.5": 1000000,
+    "gemini": 32000,
+}
+DEFAULT_CONTEXT_LIMIT = 8192
+
+# Per-message framing overhead (role markers etc.), as in OpenAI's cookbook
+MESSAGE_OVERHEAD = 4
+
+SUMMARY_PREFIX = "ملخص ما سبق من المحادثة:\n"
+
+_encodings = {}
+
+
+def _get_encoding(model):
+    if tiktoken is None:
+        return None
+    name = model.split("/")[-1]
+    if name not in _encodings:
+        try:
+            _encodings[name] = tiktoken.encoding_for_model(name)
+        except KeyError:
+            _encodings[name] = tiktoken.get_encoding("cl100k_base")
+    return _encodings[name]
+
+
+def count_tokens(text, model="gpt-4o"):
+    """Number of tokens ``text`` costs for ``model``"""
+    if not text:
+        return 0
+    encoding = _get_encoding(model)
+    if encoding is not None:
+        return len(encoding.encode(text))
+    # Arabic script tokenizes denser than Latin text; be conservative
+    return len(text) // 2 + 1
+
+
+def count_message_tokens(message, model="gpt-4o"):
+    return count_tokens(message["content"], model) + MESSAGE_OVERHEAD
+
+
+def get_context_limit(model):
+    name = model.lower()
+    best = ""
+    for prefix in MODEL_CONTEXT_LIMITS:
+        if (name.startswith(prefix) or name.split("/")[-1].startswith(prefix)) and len(prefix) > len(best):
+            best = prefix
+    return MODEL_CONTEXT_LIMITS.get(best, DEFAULT_CONTEXT_LIMIT)
+
+
+def get_history_budget(model, max_tokens, budget=None):
+    """Tokens available for history once the reply has been reserved"""
+    budget = CONTEXT_TOKEN_BUDGET if budget is None else budget
+    return max(0, min(budget, get_context_limit(model) - max_tokens))
+
+
+def select_window(messages, model, budget):
+    """
+    Split ``messages`` (oldest first) into (dropped, kept) where ``kept`` is
+    the longest suffix whose token count fits ``budget``.
+    """
+    used = 0
+    start = len(messages)
+    for index in range(len(messages) - 1, -1, -1):
+        cost = count_message_tokens(messages[index], model)
+        if used + cost > budget:
+            break
+        used += cost
+        start = index
+    return messages[:start], messages[start:]
+
+
+def fold_into_summary(previous_summary, messages, summarizer):
+    """
+    Return the new rolling summary after folding ``messages`` in, or None if
+    the summarizer failed.
+    """
+    turns = []
+    if previous_summary:
+        turns.append({"role": "summary", "content": previous_summary})
+    turns.extend({"role": m["role"], "content": m["content"]} for m in messages)
+    summary = summarizer.generate_summary(turns)
+    if not summary or summary == "فشل توليد الملخص":
+        return None
+    return summary
+
+
+def split_chunks(messages, model, chunk_tokens=CONTEXT_FOLD_CHUNK_TOKENS):
+    """Split ``messages`` (oldest first) into runs of at most ``chunk_tokens`` tokens"""
+    chunks, current, used = [], [], 0
+    for message in messages:
+        cost = count_message_tokens(message, model)
+        if current and used + cost > chunk_tokens:
+            chunks.append(current)
+            current, used = [], 0
+        current.append(message)
+        used += cost
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+def _clip(message, model, limit):
+    """``message`` cut down to about ``limit`` tokens, so one huge turn still fits a summary call"""
+    tokens = count_tokens(message["content"], model)
+    if tokens <= limit:
+        return message
+    return dict(message, content=message["content"][:max(1, len(message["content"]) * limit // tokens)])
+
+
+def fold_in_chunks(conversation, messages, model, summarizer, chunk_tokens=CONTEXT_FOLD_CHUNK_TOKENS,
+                   max_chunks=CONTEXT_FOLD_MAX_CHUNKS):
+    """
+    Fold ``messages`` (oldest first) into the conversation's summary one
+    chunk at a time, moving ``summary_message_id`` after each chunk. Stops at
+    the first failed chunk or after ``max_chunks``; returns how many of
+    ``messages`` were folded.
+    """
+    folded = 0
+    for chunk in split_chunks(messages, model, chunk_tokens)[:max_chunks]:
+        summary = fold_into_summary(conversation.summary, [_clip(m, model, chunk_tokens) for m in chunk],
+                                    summarizer)
+        if summary is None:
+            logger.warning(f"Summary failed for conversation {conversation.id} after {folded} messages")
+            break
+        conversation.summary = summary
+        conversation.summary_message_id = chunk[-1]["id"]
+        folded += len(chunk)
+    return folded
+
+
+def build_context(conversation, history, new_message, model, max_tokens, summarizer, budget=None,
+                  low_water=CONTEXT_LOW_WATER, backlog=None):
+    """
+    Assemble the messages to send for this turn.
+
+    ``history`` holds the conversation's messages newer than
+    ``conversation.summary_message_id`` (oldest first) as dicts with id,
+    role and content, or only the newest of them when ``backlog`` holds the
+    oldest. The conversation's summary fields are updated in place when
+    older turns are folded; the caller commits them.
+    """
+    if backlog:
+        folded = fold_in_chunks(conversation, backlog, model, summarizer)
+        folded_ids = {message["id"] for message in backlog[:folded]}
+        history = [message for message in history if message["id"] not in folded_ids]
+
+    history_budget = get_history_budget(model, max_tokens, budget)
+    user_turn = {"role": "user", "content": new_message}
+    remaining = history_budget - count_message_tokens(user_turn, model)
+
+    summary = conversation.summary
+    if summary:
+        remaining -= count_tokens(SUMMARY_PREFIX + summary, model) + MESSAGE_OVERHEAD
+
+    dropped, kept = select_window(history, model, max(0, remaining))
+
+    if dropped and not backlog:
+        # Fold down to the low-water mark so the next few turns need no summary call
+        to_fold, _ = select_window(history, model, max(0, int(remaining * low_water)))
+        folded = fold_in_chunks(conversation, to_fold, model, summarizer)
+        if folded:
+            summary = conversation.summary
+            # The summary may have grown; re-fit the window around it
+            remaining = history_budget - count_message_tokens(user_turn, model)
+            remaining -= count_tokens(SUMMARY_PREFIX + summary, model) + MESSAGE_OVERHEAD
+            _, kept = select_window(history[folded:], model, max(0, remaining))
+        else:
+            logger.warning(f"Summary failed for conversation {conversation.id}; truncating older turns")
+    elif backlog:
+        # Turns between the backlog and the window stay out until the backlog is folded
+        summary = conversation.summary
+        remaining = history_budget - count_message_tokens(user_turn, model)
+        if summary:
+            remaining -= count_tokens(SUMMARY_PREFIX + summary, model) + MESSAGE_OVERHEAD
+        _, kept = select_window(history, model, max(0, remaining))
+
+    context = []
+    if summary:
+        context.append({"role": "system", "content": SUMMARY_PREFIX + summary})
+    context.extend({"role": m["role"], "content": m["content"]} for m in kept)
+    context.append(user_turn)
+    return context
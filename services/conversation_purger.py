@@ -0,0 +1,172 @@
+"""
+Deletes and clears conversations without loading their messages.
+
+Small conversations are handled inside the request with bulk DELETE
+statements. Conversations with more than PURGE_INLINE_LIMIT messages are
+hidden at once (``deleted_at`` is set) and their messages are removed by a
+background task in chunks of PURGE_CHUNK_SIZE rows, one short transaction
+per chunk, so the API returns immediately and no single statement holds
+locks on millions of rows. The task is started with the app (``start()``)
+and first picks up soft-deleted conversations left behind by a restart.
+
+Configuration (environment):
+    PURGE_INLINE_LIMIT  messages deleted inside the request (default 1000)
+    PURGE_CHUNK_SIZE    messages deleted per transaction in the background (default 1000)
+    PURGE_PAUSE         seconds to yield between chunks (default 0.05)
+"""
+import os
+import time
+import queue
+import logging
+import threading
+from datetime import datetime, timezone
+
+from sqlalchemy import func, select
+
+logger = logging.getLogger(__name__)
+
+PURGE_INLINE_LIMIT = int(os.environ.get("PURGE_INLINE_LIMIT", 1000))
+PURGE_CHUNK_SIZE = int(os.environ.get("PURGE_CHUNK_SIZE", 1000))
+PURGE_PAUSE = float(os.environ.get("PURGE_PAUSE", 0.05))
+
+
+class ConversationPurger:
+    def __init__(self, socketio, app, db, conversation_model, message_model,
+                 inline_limit=PURGE_INLINE_LIMIT, chunk_size=PURGE_CHUNK_SIZE, pause=PURGE_PAUSE):
+        self.socketio = socketio
+        self.app = app
+        self.db = db
+        self.conversation_model = conversation_model
+        self.message_model = message_model
+        self.inline_limit = inline_limit
+        self.chunk_size = chunk_size
+        self.pause = pause
+        self._queue = queue.Queue()
+        self._queued = set()  # jobs waiting or running, so each is queued once
+        self._lock = threading.Lock()
+        self._started = False
+
+    def start(self):
+        """Start the background task; it resumes interrupted purges first"""
+        if self._started:
+            return
+        with self._lock:
+            if self._started:
+                return
+            self.socketio.start_background_task(self._worker_loop)
+            self._started = True
+
+    def _enqueue(self, conversation_id, max_id, drop_conversation):
+        job = (conversation_id, max_id, drop_conversation)
+        with self._lock:
+            if job in self._queued:
+                return
+            self._queued.add(job)
+        self._queue.put(job)
+
+    def delete(self, conversation):
+        """
+        Delete ``conversation`` and its messages. Returns True when it is
+        already gone, False when the purge continues in the background.
+        """
+        session = self.db.session
+        if (conversation.message_count or 0) <= self.inline_limit:
+            conversation_id = conversation.id
+            # message_count may lag behind concurrent inserts, so loop until nothing is left
+            while self.message_model.delete_chunk(conversation_id, limit=self.inline_limit + 1):
+                pass
+            table = self.conversation_model.__table__
+            session.execute(table.delete().where(table.c.id == conversation_id))
+            session.commit()
+            return True
+
+        conversation.deleted_at = datetime.now(timezone.utc)
+        session.commit()
+        self.start()
+        self._enqueue(conversation.id, None, True)
+        return False
+
+    def clear(self, conversation):
+        """
+        Delete the messages of ``conversation`` but keep it. Messages added
+        after this call are kept. Returns True when done, False when the
+        purge continues in the background.
+        """
+        session = self.db.session
+        message = self.message_model.__table__
+        max_id = session.execute(
+            select(func.max(message.c.id)).where(message.c.conversation_id == conversation.id)
+        ).scalar()
+        # الملخص يصف رسائل ستُحذف
+        conversation.summary = None
+        conversation.summary_message_id = None
+        if max_id is None:
+            session.commit()
+            return True
+
+        if (conversation.message_count or 0) <= self.inline_limit:
+            while self.message_model.delete_chunk(conversation.id, max_id=max_id, limit=self.inline_limit + 1):
+                pass
+            self.conversation_model.refresh_stats(conversation.id)
+            session.commit()
+            return True
+
+        session.commit()
+        self.start()
+        self._enqueue(conversation.id, max_id, False)
+        return False
+
+    def _worker_loop(self):
+        self._resume_pending()
+        while True:
+            job = self._queue.get()
+            try:
+                self._purge(*job)
+            except Exception as e:
+                logger.error(f"Error purging conversation {job[0]}: {e}")
+                with self.app.app_context():
+                    self.db.session.rollback()
+            finally:
+                with self._lock:
+                    self._queued.discard(job)
+                self._queue.task_done()
+
+    def _resume_pending(self):
+        """Queue soft-deleted conversations whose purge was interrupted by a restart"""
+        try:
+            with self.app.app_context():
+                conversation = self.conversation_model.__table__
+                ids = self.db.session.execute(
+                    select(conversation.c.id).where(conversation.c.deleted_at.is_not(None))
+                ).scalars().all()
+                self.db.session.remove()
+        except Exception as e:
+            logger.error(f"Error looking for interrupted conversation purges: {e}")
+            return
+        for conversation_id in ids:
+            self._enqueue(conversation_id, None, True)
+
+    def _purge(self, conversation_id, max_id, drop_conversation):
+        started = time.monotonic()
+        deleted = 0
+        with self.app.app_context():
+            session = self.db.session
+            try:
+                while True:
+                    count = self.message_model.delete_chunk(conversation_id, max_id=max_id, limit=self.chunk_size)
+                    session.commit()
+                    if not count:
+                        break
+                    deleted += count
+                    self.socketio.sleep(self.pause)
+
+                if drop_conversation:
+                    table = self.conversation_model.__table__
+                    session.execute(table.delete().where(table.c.id == conversation_id))
+                else:
+                    self.conversation_model.refresh_stats(conversation_id)
+                session.commit()
+            finally:
+                session.remove()
+        logger.info(f"Purged {deleted} messages of conversation {conversation_id} "
+                    f"in {time.monotonic() - started:.1f}s")
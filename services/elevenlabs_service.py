@@ -1,8 +1,12 @@
 import os
 import logging
+import re
 import requests
+from services import http_client
+from services.metrics import track_provider
 import json
 from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
 
 logger = logging.getLogger(__name__)
 
@@ -23,6 +27,15 @@ def handle_api_error(response):
     except:
         return f"Error: {response.status_code}"
 
+DEFAULT_MODEL_ID = "eleven_multilingual_v2"
+DEFAULT_VOICE_SETTINGS = {
+    "stability": 0.8,
+    "similarity_boost": 0.8,
+    "style": 0.0,
+    "use_speaker_boost": True
+}
+
+@track_provider("elevenlabs", DEFAULT_MODEL_ID, "tts", is_success=lambda result: "audio" in result)
 def text_to_speech(text, voice_id="21m00Tcm4TlvDq8ikWAM"):  # تعيين الصوت العربي كافتراضي
     """تحويل النص إلى صوت باستخدام ElevenLabs API مع دعم محسن للغة العربية"""
     try:
@@ -42,16 +55,11 @@ def text_to_speech(text, voice_id="21m00Tcm4TlvDq8ikWAM"):  # تعيين الص
 
         payload = {
             "text": text,
-            "model_id": "eleven_multilingual_v2",
-            "voice_settings": {
-                "stability": 0.8,
-                "similarity_boost": 0.8,
-                "style": 0.0,
-                "use_speaker_boost": True
-            }
+            "model_id": DEFAULT_MODEL_ID,
+            "voice_settings": DEFAULT_VOICE_SETTINGS
         }
 
-        response = requests.post(url, headers=headers, json=payload)
+        response = http_client.post(url, headers=headers, json=payload)
 
         if response.status_code == 200:
             return {"audio": response.content}
@@ -73,28 +81,106 @@ def text_to_speech(text, voice_id="21m00Tcm4TlvDq8ikWAM"):  # تعيين الص
         logger.error(f"Unexpected error in text_to_speech: {e}")
         return {"error": "An unexpected error occurred"}
 
-def get_available_voices():
-    """الحصول على قائمة الأصوات المتاحة"""
+# نهايات الجمل العربية واللاتينية: . ! ? ؟ ؛ ۔ وفواصل الأسطر
+SENTENCE_BOUNDARY = re.compile(r'(?<=[.!?؟؛۔])\s+|\n+')
+TTS_CHUNK_MAX_CHARS = int(os.environ.get("TTS_CHUNK_MAX_CHARS", 400))
+TTS_MAX_PARALLEL = int(os.environ.get("TTS_MAX_PARALLEL", 3))
+
+def split_sentences(text, max_chars=TTS_CHUNK_MAX_CHARS):
+    """تقسيم النص إلى أجزاء عند حدود الجمل، مع دمج الجمل القصيرة حتى max_chars"""
+    chunks = []
+    current = ""
+    for sentence in SENTENCE_BOUNDARY.split(text):
+        sentence = sentence.strip()
+        if not sentence:
+            continue
+        # الجمل الطويلة جداً تُقسم عند المسافات
+        while len(sentence) > max_chars:
+            cut = sentence.rfind(" ", 0, max_chars)
+            if cut <= 0:
+                cut = max_chars
+            if current:
+                chunks.append(current)
+                current = ""
+            chunks.append(sentence[:cut].strip())
+            sentence = sentence[cut:].strip()
+        if current and len(current) + 1 + len(sentence) > max_chars:
+            chunks.append(current)
+            current = sentence
+        else:
+            current = f"{current} {sentence}" if current else sentence
+    if current:
+        chunks.append(current)
+    return chunks
+
+def stream_text_to_speech(text, voice_id="21m00Tcm4TlvDq8ikWAM", synthesize=None, max_parallel=TTS_MAX_PARALLEL):
+    """
+    تحويل نص طويل إلى صوت على دفعات: يُقسم النص إلى جمل تُولَّد بالتوازي
+    (بحد أقصى max_parallel طلبات في الوقت نفسه) وتُعاد بايتات الصوت بالترتيب.
+    synthesize(text, voice_id) يعيد bytes أو None، والافتراضي هو text_to_speech.
+    """
+    if synthesize is None:
+        def synthesize(chunk, voice):
+            result = text_to_speech(chunk, voice)
+            return result.get("audio") if isinstance(result, dict) else None
+
+    chunks = split_sentences(text)
+    if not chunks:
+        return
+
+    with ThreadPoolExecutor(max_workers=max(1, max_parallel)) as executor:
+        pending = []
+        next_index = 0
+        # إبقاء max_parallel طلبات قيد التنفيذ أمام الجزء الذي يُرسل حالياً
+        while next_index < len(chunks) and len(pending) < max_parallel:
+            pending.append(executor.submit(synthesize, chunks[next_index], voice_id))
+            next_index += 1
+
+        produced = False
+        while pending:
+            future = pending.pop(0)
+            if next_index < len(chunks):
+                pending.append(executor.submit(synthesize, chunks[next_index], voice_id))
+                next_index += 1
+            try:
+                audio = future.result()
+            except Exception as e:
+                logger.error(f"Error synthesizing TTS chunk: {e}")
+                audio = None
+            if not audio:
+                if not produced:
+                    # فشل الجزء الأول: لا فائدة من متابعة البث
+                    for remaining in pending:
+                        remaining.cancel()
+                    return
+                logger.warning("Skipping a TTS chunk that failed to synthesize")
+                continue
+            produced = True
+            yield audio
+
+def get_available_voices(fallback=True):
+    """الحصول على قائمة الأصوات المتاحة؛ عند الفشل تُعاد القائمة الافتراضية، أو None إذا كان fallback=False"""
+    default = get_default_voices() if fallback else None
     try:
         if not ELEVENLABS_API_KEY:
             logger.warning("ELEVENLABS_API_KEY not found")
-            return get_default_voices()
+            return default
 
         url = f"{ELEVENLABS_BASE_URL}/voices"
         headers = {"xi-api-key": ELEVENLABS_API_KEY}
         
-        response = requests.get(url, headers=headers)
+        response = http_client.get(url, headers=headers)
         
         if response.status_code == 200:
             voices_data = response.json()
-            return voices_data.get("voices", get_default_voices())
+            return voices_data.get("voices", default)
         else:
             logger.error(f"Failed to fetch voices: {response.status_code}")
-            return get_default_voices()
+            return default
             
     except Exception as e:
         logger.error(f"Error fetching voices: {e}")
-        return get_default_voices()
+        return default
 
 def get_default_voices():
     """قائمة الأصوات الافتراضية"""
@@ -1,8 +1,13 @@
 import os
+import time
 import logging
+import threading
+from collections import OrderedDict, deque
 import google.generativeai as genai
 import base64
 
+from services.context_manager import count_tokens
+
 logger = logging.getLogger(__name__)
 
 # Initialize the Gemini API
@@ -12,6 +17,120 @@ if GOOGLE_API_KEY:
 else:
     logger.warning("Google API key not found. Gemini services will not be available.")
 
+SAFETY_SETTINGS = [
+    {
+        "category": "HARM_CATEGORY_HARASSMENT",
+        "threshold": "BLOCK_MEDIUM_AND_ABOVE"
+    },
+    {
+        "category": "HARM_CATEGORY_HATE_SPEECH",
+        "threshold": "BLOCK_MEDIUM_AND_ABOVE"
+    },
+    {
+        "category": "HARM_CATEGORY_SEXUALLY_EXPLICIT",
+        "threshold": "BLOCK_MEDIUM_AND_ABOVE"
+    },
+    {
+        "category": "HARM_CATEGORY_DANGEROUS_CONTENT",
+        "threshold": "BLOCK_MEDIUM_AND_ABOVE"
+    }
+]
+
+# Configured GenerativeModel instances keyed on (model, generation config).
+# Building a model object is pure client-side setup, so it is reused across calls.
+MODEL_POOL_SIZE = int(os.environ.get("GEMINI_MODEL_POOL_SIZE", 32))
+_model_pool = OrderedDict()
+_model_pool_lock = threading.Lock()
+
+# Cumulative token usage reported by the API, plus the last calls one by one.
+# "prompt_tokens_before" is what the prompt cost when the last turn was sent
+# twice (in the history and again with send_message): the reported prompt plus
+# a local estimate of the last turn, which is also the "tokens_saved".
+USAGE_RECENT_CALLS = int(os.environ.get("GEMINI_USAGE_RECENT_CALLS", 50))
+_usage_totals = {"calls": 0, "prompt_tokens": 0, "output_tokens": 0, "total_tokens": 0,
+                 "prompt_tokens_before": 0, "tokens_saved": 0}
+_recent_calls = deque(maxlen=USAGE_RECENT_CALLS)
+_usage_lock = threading.Lock()
+
+def get_model(model, temperature, max_tokens):
+    """Return a cached GenerativeModel for this model and generation config"""
+    key = (model, round(float(temperature), 3), int(max_tokens))
+    with _model_pool_lock:
+        instance = _model_pool.get(key)
+        if instance is not None:
+            _model_pool.move_to_end(key)
+            return instance
+
+    instance = genai.GenerativeModel(
+        model_name=model,
+        generation_config={
+            "temperature": temperature,
+            "max_output_tokens": max_tokens,
+            "top_p": 0.95,
+            "top_k": 40,
+        },
+        safety_settings=SAFETY_SETTINGS
+    )
+    with _model_pool_lock:
+        _model_pool[key] = instance
+        while len(_model_pool) > MODEL_POOL_SIZE:
+            _model_pool.popitem(last=False)
+    return instance
+
+def _start_chat(messages, model, temperature, max_tokens):
+    """
+    Build a Gemini chat session for the given OpenAI-style messages.
+    The history holds every turn except the last one, which is returned
+    separately to be sent with send_message (so it is uploaded only once).
+    """
+    # Convert messages from OpenAI format to Gemini format
+    gemini_messages = []
+    for msg in messages:
+        role = "user" if msg["role"] == "user" else "model"
+        gemini_messages.append({"role": role, "parts": [msg["content"]]})
+
+    chat = get_model(model, temperature, max_tokens).start_chat(history=gemini_messages[:-1])
+    return chat, gemini_messages[-1]["parts"][0]
+
+def _record_usage(model, response, history_turns, last_message):
+    """Log the token usage of one call and add it to the running totals and recent calls"""
+    usage = getattr(response, "usage_metadata", None)
+    if usage is None:
+        return
+    prompt_tokens = getattr(usage, "prompt_token_count", 0) or 0
+    output_tokens = getattr(usage, "candidates_token_count", 0) or 0
+    total_tokens = getattr(usage, "total_token_count", 0) or prompt_tokens + output_tokens
+    tokens_saved = count_tokens(last_message, model)
+    call = {
+        "time": time.time(),
+        "model": model,
+        "history_turns": history_turns,
+        "prompt_tokens_before": prompt_tokens + tokens_saved,
+        "prompt_tokens": prompt_tokens,
+        "tokens_saved": tokens_saved,
+        "output_tokens": output_tokens,
+        "total_tokens": total_tokens,
+    }
+    with _usage_lock:
+        _usage_totals["calls"] += 1
+        for key in ("prompt_tokens", "output_tokens", "total_tokens", "prompt_tokens_before", "tokens_saved"):
+            _usage_totals[key] += call[key]
+        _recent_calls.append(call)
+    logger.info(
+        f"Gemini usage: model={model} history_turns={history_turns} "
+        f"prompt_tokens_before={call['prompt_tokens_before']} prompt_tokens={prompt_tokens} "
+        f"tokens_saved={tokens_saved} output_tokens={output_tokens} total_tokens={total_tokens}"
+    )
+
+def get_usage_report():
+    """Cumulative Gemini token usage since process start and the most recent calls"""
+    with _usage_lock:
+        report = dict(_usage_totals)
+        report["recent_calls"] = list(_recent_calls)
+    report["avg_prompt_tokens"] = round(report["prompt_tokens"] / report["calls"], 1) if report["calls"] else 0
+    report["pooled_models"] = len(_model_pool)
+    return report
+
 def generate_gemini_response(messages, model="gemini-1.5-pro", temperature=0.7, max_tokens=2000):
     """
     Generate a chat response using Google's Gemini API
@@ -21,55 +140,34 @@ def generate_gemini_response(messages, model="gemini-1.5-pro", temperature=0.7,
             logger.warning("Google API key not found, returning None")
             return None
         
-        # Configure the model
-        generation_config = {
-            "temperature": temperature,
-            "max_output_tokens": max_tokens,
-            "top_p": 0.95,
-            "top_k": 40,
-        }
-        
-        safety_settings = [
-            {
-                "category": "HARM_CATEGORY_HARASSMENT",
-                "threshold": "BLOCK_MEDIUM_AND_ABOVE"
-            },
-            {
-                "category": "HARM_CATEGORY_HATE_SPEECH",
-                "threshold": "BLOCK_MEDIUM_AND_ABOVE"
-            },
-            {
-                "category": "HARM_CATEGORY_SEXUALLY_EXPLICIT",
-                "threshold": "BLOCK_MEDIUM_AND_ABOVE"
-            },
-            {
-                "category": "HARM_CATEGORY_DANGEROUS_CONTENT",
-                "threshold": "BLOCK_MEDIUM_AND_ABOVE"
-            }
-        ]
-        
-        # Convert messages from OpenAI format to Gemini format
-        gemini_messages = []
-        for msg in messages:
-            role = "user" if msg["role"] == "user" else "model"
-            gemini_messages.append({"role": role, "parts": [msg["content"]]})
-        
-        # Initialize the model
-        model = genai.GenerativeModel(
-            model_name=model,
-            generation_config=generation_config,
-            safety_settings=safety_settings
-        )
-        
         # Generate response
-        chat = model.start_chat(history=gemini_messages)
-        response = chat.send_message(gemini_messages[-1]["parts"][0])
+        chat, last_message = _start_chat(messages, model, temperature, max_tokens)
+        response = chat.send_message(last_message)
+        _record_usage(model, response, len(messages) - 1, last_message)
         
         return response.text
     except Exception as e:
         logger.error(f"Error generating Gemini response: {e}")
         return None
 
+def stream_gemini_response(messages, model="gemini-1.5-pro", temperature=0.7, max_tokens=2000):
+    """
+    Stream a chat response from Google's Gemini API as text deltas
+    """
+    try:
+        if not GOOGLE_API_KEY:
+            logger.warning("Google API key not found, nothing to stream")
+            return
+        
+        chat, last_message = _start_chat(messages, model, temperature, max_tokens)
+        response = chat.send_message(last_message, stream=True)
+        for chunk in response:
+            if chunk.text:
+                yield chunk.text
+        _record_usage(model, response, len(messages) - 1, last_message)
+    except Exception as e:
+        logger.error(f"Error streaming Gemini response: {e}")
+
 def analyze_image_with_gemini(image_path, prompt="قم بوصف هذه الصورة بالتفصيل باللغة العربية."):
     """
     Analyze an image using Gemini's vision capabilities
@@ -0,0 +1,99 @@
+"""
+Shared HTTP transport for the requests-based service modules.
+
+Every upstream host (openrouter.ai, api.elevenlabs.io, ...) gets its own
+``requests.Session`` with a keep-alive connection pool, so repeated calls
+reuse the same TCP/TLS connection instead of paying a new handshake.
+"""
+import os
+import logging
+import threading
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger(__name__)
+
+# Timeouts in seconds, (connect, read) as accepted by requests
+CONNECT_TIMEOUT = float(os.environ.get("HTTP_CONNECT_TIMEOUT", 5))
+READ_TIMEOUT = float(os.environ.get("HTTP_READ_TIMEOUT", 60))
+
+# Connections kept alive per host. The eventlet worker runs many greenlets
+# per process, so this should roughly match the expected number of
+# concurrent upstream calls per host rather than the CPU count.
+POOL_MAXSIZE = int(os.environ.get("HTTP_POOL_MAXSIZE", 50))
+# When true, greenlets wait for a free connection instead of opening
+# extra short-lived ones beyond POOL_MAXSIZE.
+POOL_BLOCK = os.environ.get("HTTP_POOL_BLOCK", "false").lower() in ("1", "true", "yes")
+
+_sessions = {}
+_lock = threading.Lock()
+
+
+def _host_key(url):
+    parts = urlsplit(url)
+    return f"{parts.scheme}://{parts.netloc}"
+
+
+def get_session(url):
+    """Return the pooled session for the host of ``url``"""
+    key = _host_key(url)
+    session = _sessions.get(key)
+    if session is None:
+        with _lock:
+            session = _sessions.get(key)
+            if session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=POOL_MAXSIZE, pool_block=POOL_BLOCK)
+                session.mount(key, adapter)
+                _sessions[key] = session
+    return session
+
+
+def request(method, url, timeout=None, **kwargs):
+    """Send a request through the pooled session with default timeouts"""
+    if timeout is None:
+        timeout = (CONNECT_TIMEOUT, READ_TIMEOUT)
+    return get_session(url).request(method, url, timeout=timeout, **kwargs)
+
+
+def get(url, **kwargs):
+    return request("GET", url, **kwargs)
+
+
+def post(url, **kwargs):
+    return request("POST", url, **kwargs)
+
+
+def get_pool_stats():
+    """
+    Per-host connection statistics.
+    ``reuse_rate`` is the share of requests that did not need a new connection.
+    """
+    stats = {}
+    for key, session in list(_sessions.items()):
+        adapter = session.get_adapter(key)
+        connections = 0
+        requests_sent = 0
+        for pool_key in list(adapter.poolmanager.pools.keys()):
+            pool = adapter.poolmanager.pools.get(pool_key)
+            if pool is None:
+                continue
+            connections += pool.num_connections
+            requests_sent += pool.num_requests
+        stats[key] = {
+            "connections_opened": connections,
+            "requests": requests_sent,
+            "reuse_rate": round(1 - connections / requests_sent, 4) if requests_sent else 0.0,
+            "pool_maxsize": POOL_MAXSIZE,
+        }
+    return stats
+
+
+def close_all():
+    """Close every pooled session (used on shutdown)"""
+    with _lock:
+        for session in _sessions.values():
+            session.close()
+        _sessions.clear()
@@ -0,0 +1,118 @@
+"""
+Background dispatcher for @ياسمين mentions in the chat room.
+
+Mentions are queued and answered by a fixed pool of Socket.IO background
+tasks, so the Socket.IO handler that received the message returns at once.
+Each room may only have a limited number of mentions pending or running,
+so one busy room cannot occupy the whole pool.
+
+Configuration (environment):
+    MENTION_WORKERS      size of the worker pool (default 4)
+    MENTION_QUEUE_SIZE   mentions waiting across all rooms (default 100)
+    MENTION_ROOM_LIMIT   mentions pending or running per room (default 2)
+"""
+import os
+import uuid
+import queue
+import logging
+import threading
+from datetime import datetime, timezone
+
+logger = logging.getLogger(__name__)
+
+MENTION_WORKERS = int(os.environ.get("MENTION_WORKERS", 4))
+MENTION_QUEUE_SIZE = int(os.environ.get("MENTION_QUEUE_SIZE", 100))
+MENTION_ROOM_LIMIT = int(os.environ.get("MENTION_ROOM_LIMIT", 2))
+
+AI_USERNAME = "ياسمين"
+
+
+class MentionDispatcher:
+    def __init__(self, socketio, chatbot, history=None, broadcaster=None, workers=MENTION_WORKERS,
+                 queue_size=MENTION_QUEUE_SIZE, room_limit=MENTION_ROOM_LIMIT):
+        self.socketio = socketio
+        self.chatbot = chatbot
+        self.history = history
+        self.broadcaster = broadcaster
+        self.workers = workers
+        self.room_limit = room_limit
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._room_load = {}
+        self._lock = threading.Lock()
+        self._started = False
+
+    def _ensure_workers(self):
+        if self._started:
+            return
+        with self._lock:
+            if self._started:
+                return
+            for _ in range(self.workers):
+                self.socketio.start_background_task(self._worker_loop)
+            self._started = True
+
+    def submit(self, room, prompt):
+        """Queue a mention for ``room``. Returns False if the room or the pool is saturated."""
+        self._ensure_workers()
+        with self._lock:
+            load = self._room_load.get(room, 0)
+            if load >= self.room_limit:
+                return False
+            try:
+                self._queue.put_nowait((room, prompt))
+            except queue.Full:
+                return False
+            self._room_load[room] = load + 1
+
+        self.socketio.emit('typing', {'username': AI_USERNAME}, to=room)
+        return True
+
+    def _release(self, room):
+        with self._lock:
+            load = self._room_load.get(room, 1) - 1
+            if load <= 0:
+                self._room_load.pop(room, None)
+            else:
+                self._room_load[room] = load
+
+    def _worker_loop(self):
+        while True:
+            room, prompt = self._queue.get()
+            try:
+                self._answer(room, prompt)
+            except Exception as e:
+                logger.error(f"Error answering mention in room {room}: {e}")
+            finally:
+                self._release(room)
+                self._queue.task_done()
+
+    def _answer(self, room, prompt):
+        stream_id = uuid.uuid4().hex
+        self.socketio.emit('ai_stream_start', {
+            'stream_id': stream_id,
+            'username': AI_USERNAME
+        }, to=room)
+
+        parts = []
+        for delta in self.chatbot.stream_response(prompt):
+            parts.append(delta)
+            self.socketio.emit('ai_stream_delta', {
+                'stream_id': stream_id,
+                'delta': delta
+            }, to=room)
+
+        # The final reply is a regular room message, so clients that ignore
+        # the stream events still receive it; stream_id lets others dedupe
+        payload = {
+            'stream_id': stream_id,
+            'username': AI_USERNAME,
+            'message': "".join(parts),
+            'timestamp': datetime.now(timezone.utc).isoformat()
+        }
+        if self.broadcaster is not None:
+            # Same path as the room's other messages, so it is not overtaken by a batch
+            self.broadcaster.emit(room, payload)
+        else:
+            self.socketio.emit('message', payload, to=room)
+        if self.history is not None:
+            self.history.record(room, payload)
@@ -0,0 +1,255 @@
+"""
+Process metrics for Prometheus, built on prometheus_client.
+
+The metrics below live in prometheus_client's default registry and are
+rendered by the /metrics route together with its process and platform
+collectors.
+
+With several worker processes every worker reports its own values; add a
+``pod``/``instance`` label in the scrape config and sum across it.
+
+The ``stats()`` snapshots of the caches, the rate limiter, the room
+history and the provider router are exported as gauges as well, read at
+scrape time through ``register_stats``.
+
+Model names reach the provider metrics from client requests, so they are
+mapped onto the models registered with ``register_models`` (plus the ones
+named in ``track_provider``); anything else is reported as "other" to keep
+the number of series bounded.
+
+Configuration (environment):
+    METRICS_TOKEN  bearer token required to read /metrics (default unset: open)
+"""
+import os
+import time
+import logging
+import threading
+from functools import wraps
+
+from prometheus_client import Counter, Gauge, Histogram, REGISTRY, CONTENT_TYPE_LATEST, generate_latest
+from prometheus_client.core import GaugeMetricFamily
+from sqlalchemy import exc as sa_exc
+from sqlalchemy.pool import QueuePool
+
+logger = logging.getLogger(__name__)
+
+METRICS_TOKEN = os.environ.get("METRICS_TOKEN") or None
+
+CONTENT_TYPE = CONTENT_TYPE_LATEST
+
+# Flask handlers and pool checkouts: milliseconds to seconds
+REQUEST_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+# AI providers answer in seconds to a minute
+PROVIDER_BUCKETS = (0.25, 0.5, 1, 2, 4, 8, 15, 30, 60, 120)
+
+# Label value for models outside the allow-list
+OTHER_MODEL = "other"
+
+_known_models = set()
+_known_models_lock = threading.Lock()
+
+
+def register_models(models):
+    """Allow ``models`` as values of the ``model`` label"""
+    with _known_models_lock:
+        _known_models.update(models)
+
+
+def model_label(model):
+    return model if model in _known_models else OTHER_MODEL
+
+
+# --- Metrics of the application ---
+
+HTTP_REQUEST_SECONDS = Histogram(
+    "yasmin_http_request_duration_seconds",
+    "Time from request start to response headers, by Flask endpoint",
+    ("endpoint", "method", "status"), buckets=REQUEST_BUCKETS)
+
+PROVIDER_REQUEST_SECONDS = Histogram(
+    "yasmin_provider_request_duration_seconds",
+    "Latency of AI provider calls",
+    ("provider", "model", "operation"), buckets=PROVIDER_BUCKETS)
+
+PROVIDER_ERRORS = Counter(
+    "yasmin_provider_errors",
+    "AI provider calls that raised or returned no usable result",
+    ("provider", "model", "operation"))
+
+SOCKETIO_CONNECTED = Gauge(
+    "yasmin_socketio_connected_clients",
+    "Socket.IO clients connected to this process")
+
+SOCKETIO_EVENTS = Counter(
+    "yasmin_socketio_events",
+    "Socket.IO events received, by event name",
+    ("event",))
+
+DB_POOL_WAIT_SECONDS = Histogram(
+    "yasmin_db_pool_checkout_wait_seconds",
+    "Time spent waiting for a database connection from the pool",
+    buckets=REQUEST_BUCKETS)
+
+DB_POOL_TIMEOUTS = Counter(
+    "yasmin_db_pool_checkout_timeouts",
+    "Pool checkouts that gave up after pool_timeout")
+
+
+def observe_provider_call(provider, model, operation, seconds, ok):
+    model = model_label(model)
+    PROVIDER_REQUEST_SECONDS.labels(provider, model, operation).observe(seconds)
+    if not ok:
+        PROVIDER_ERRORS.labels(provider, model, operation).inc()
+
+
+def track_provider(provider, model, operation, is_success=bool):
+    """Decorator recording latency and failures of a provider call with fixed labels"""
+    register_models([model])
+
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            ok = False
+            try:
+                result = func(*args, **kwargs)
+                ok = is_success(result)
+                return result
+            finally:
+                observe_provider_call(provider, model, operation, time.perf_counter() - started, ok)
+        return wrapper
+    return decorator
+
+
+def instrument_flask(app):
+    """Record the latency of every Flask request in HTTP_REQUEST_SECONDS"""
+    from flask import request
+
+    @app.before_request
+    def _start_request_timer():
+        request.environ["metrics.started"] = time.perf_counter()
+
+    @app.after_request
+    def _observe_request(response):
+        started = request.environ.get("metrics.started")
+        if started is not None:
+            # Streamed bodies are still being produced here; their total time is in the provider metrics
+            HTTP_REQUEST_SECONDS.labels(
+                request.endpoint or "unmatched", request.method, response.status_code
+            ).observe(time.perf_counter() - started)
+        return response
+
+
+class TimedQueuePool(QueuePool):
+    """QueuePool that records how long each checkout waited for a connection"""
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        except sa_exc.TimeoutError:
+            DB_POOL_TIMEOUTS.inc()
+            raise
+        finally:
+            DB_POOL_WAIT_SECONDS.observe(time.perf_counter() - started)
+
+
+class _PoolCollector:
+    """Size and usage of the pool returned by ``get_pool()``, read at scrape time"""
+
+    def __init__(self, get_pool):
+        self.get_pool = get_pool
+
+    def describe(self):
+        return []
+
+    def collect(self):
+        family = GaugeMetricFamily("yasmin_db_pool_connections", "Database pool connections by state",
+                                   labels=["state"])
+        try:
+            pool = self.get_pool()
+        except Exception as e:
+            logger.error(f"Error collecting pool metrics: {e}")
+            pool = None
+        if isinstance(pool, QueuePool):
+            family.add_metric(["size"], pool.size())
+            family.add_metric(["checked_out"], pool.checkedout())
+            family.add_metric(["checked_in"], pool.checkedin())
+            family.add_metric(["overflow"], max(0, pool.overflow()))
+        yield family
+
+
+def register_pool_gauges(get_pool):
+    """Expose the size and usage of the pool returned by ``get_pool()`` at scrape time"""
+    REGISTRY.register(_PoolCollector(get_pool))
+
+
+def _stats_value(value):
+    if isinstance(value, bool):
+        return float(value)
+    if isinstance(value, (int, float)):
+        return value
+    return None
+
+
+class _StatsCollector:
+    """
+    Gauges read from a ``stats()`` dict at scrape time. Numbers and booleans
+    become ``<prefix>_<key>``; a dict of dicts (one per host, policy, ...)
+    becomes one series per entry labelled ``label``, and a string value is
+    exported as ``<prefix>_<key>{<key>="value"} 1``. Lists are skipped.
+    With ``per_entry`` the whole dict is keyed by entry.
+    """
+
+    def __init__(self, prefix, callback, label, per_entry):
+        self.prefix = prefix
+        self.callback = callback
+        self.label = label
+        self.per_entry = per_entry
+
+    def describe(self):
+        return []
+
+    def collect(self):
+        try:
+            stats = self.callback()
+            if self.per_entry:
+                stats = {"": stats}
+        except Exception as e:
+            logger.error(f"Error collecting {self.prefix} metrics: {e}")
+            return
+        families = {}
+
+        def add(key, labels, value):
+            name = f"{self.prefix}_{key}"
+            if isinstance(value, str):
+                labels, value = dict(labels, **{key: value}), 1
+            value = _stats_value(value)
+            if value is None:
+                return
+            family = families.get(name)
+            if family is None:
+                family = families[name] = GaugeMetricFamily(
+                    name, f"{key} from the {self.prefix} stats", labels=list(labels))
+            family.add_metric(list(labels.values()), value)
+
+        for key, value in stats.items():
+            if isinstance(value, dict):
+                for entry, fields in value.items():
+                    if isinstance(fields, dict):
+                        for field, field_value in fields.items():
+                            add(f"{key}_{field}" if key else field, {self.label: str(entry)}, field_value)
+                    else:
+                        add(key, {self.label: str(entry)}, fields)
+            elif not isinstance(value, (list, tuple)):
+                add(key, {}, value)
+        yield from families.values()
+
+
+def register_stats(prefix, callback, label="name", per_entry=False):
+    """Export the dict returned by ``callback()`` as gauges named ``<prefix>_<key>``"""
+    REGISTRY.register(_StatsCollector(prefix, callback, label, per_entry))
+
+
+def render_latest():
+    return generate_latest(REGISTRY)
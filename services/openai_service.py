@@ -3,6 +3,7 @@ import os
 import logging
 from openai import OpenAI
 import base64
+from services.metrics import track_provider
 
 logger = logging.getLogger(__name__)
 
@@ -10,6 +11,8 @@ logger = logging.getLogger(__name__)
 OPENAI_API_KEY = os.environ.get("OPENAI_API_KEY")
 client = OpenAI(api_key=OPENAI_API_KEY)
 
+ARABIC_SYSTEM_PROMPT = "يجب تقديم الإجابات باللغة العربية الفصحى مع التشكيل للكلمات المهمة."
+
 def generate_chat_response(messages, model="gpt-4", temperature=0.7, max_tokens=1500):
     try:
         if not OPENAI_API_KEY:
@@ -19,7 +22,7 @@ def generate_chat_response(messages, model="gpt-4", temperature=0.7, max_tokens=
         # Add Arabic instruction
         messages.insert(0, {
             "role": "system", 
-            "content": "يجب تقديم الإجابات باللغة العربية الفصحى مع التشكيل للكلمات المهمة."
+            "content": ARABIC_SYSTEM_PROMPT
         })
 
         response = client.chat.completions.create(
@@ -34,6 +37,37 @@ def generate_chat_response(messages, model="gpt-4", temperature=0.7, max_tokens=
         logger.error(f"OpenAI error: {e}")
         return "عذراً، حدث خطأ في معالجة الطلب"
 
+def stream_chat_response(messages, model="gpt-4", temperature=0.7, max_tokens=1500):
+    """Yield the completion incrementally as text deltas"""
+    produced = False
+    try:
+        if not OPENAI_API_KEY:
+            logger.warning("OpenAI API key not found")
+            yield "عذراً، مفتاح API غير متوفر"
+            return
+
+        messages = [{"role": "system", "content": ARABIC_SYSTEM_PROMPT}] + list(messages)
+
+        stream = client.chat.completions.create(
+            model=model,
+            messages=messages,
+            temperature=temperature,
+            max_tokens=max_tokens,
+            stream=True
+        )
+
+        for chunk in stream:
+            if not chunk.choices:
+                continue
+            delta = chunk.choices[0].delta.content
+            if delta:
+                produced = True
+                yield delta
+    except Exception as e:
+        logger.error(f"OpenAI streaming error: {e}")
+        if not produced:
+            yield "عذراً، حدث خطأ في معالجة الطلب"
+
 def analyze_image_with_openai(image_path):
     try:
         with open(image_path, "rb") as image_file:
@@ -56,6 +90,7 @@ def analyze_image_with_openai(image_path):
         logger.error(f"Image analysis error: {e}")
         return "عذراً، حدث خطأ في تحليل الصورة"
 
+@track_provider("openai", "dall-e-3", "image")
 def generate_image_with_openai(prompt, size="1024x1024", style="vivid"):
     try:
         if not OPENAI_API_KEY:
@@ -1,6 +1,6 @@
 import os
 import logging
-import requests
+from services import http_client
 import json
 
 logger = logging.getLogger(__name__)
@@ -9,6 +9,22 @@ logger = logging.getLogger(__name__)
 OPENROUTER_API_KEY = os.environ.get("OPENROUTER_API_KEY")
 OPENROUTER_BASE_URL = "https://openrouter.ai/api/v1"
 
+def _chat_headers():
+    return {
+        "Authorization": f"Bearer {OPENROUTER_API_KEY}",
+        "Content-Type": "application/json",
+        "HTTP-Referer": "https://your-app-url.com",  # Optional but recommended
+        "X-Title": "Yasmin AI Application",  # Optional but recommended
+    }
+
+def _normalize_model(model):
+    # Fix model IDs for Gemini
+    if model in ["google/gemini-1.5-pro", "gemini-1.5-pro"]:
+        return "google/gemini-pro"
+    elif model in ["google/gemini-1.5-flash", "gemini-1.5-flash"]:
+        return "google/gemini-pro"
+    return model
+
 def call_openrouter_api(messages, model="openai/gpt-3.5-turbo", temperature=0.7, max_tokens=1000):
     """
     Call the OpenRouter API to generate a response
@@ -19,29 +35,16 @@ def call_openrouter_api(messages, model="openai/gpt-3.5-turbo", temperature=0.7,
             logger.warning("OpenRouter API key not found, returning None")
             return None
 
-        headers = {
-            "Authorization": f"Bearer {OPENROUTER_API_KEY}",
-            "Content-Type": "application/json",
-            "HTTP-Referer": "https://your-app-url.com",  # Optional but recommended
-            "X-Title": "Yasmin AI Application",  # Optional but recommended
-        }
-
-        # Fix model IDs for Gemini
-        if model in ["google/gemini-1.5-pro", "gemini-1.5-pro"]:
-            model = "google/gemini-pro"
-        elif model in ["google/gemini-1.5-flash", "gemini-1.5-flash"]:
-            model = "google/gemini-pro"
-
         payload = {
-            "model": model,
+            "model": _normalize_model(model),
             "messages": messages,
             "temperature": temperature,
             "max_tokens": max_tokens,
         }
 
-        response = requests.post(
+        response = http_client.post(
             f"{OPENROUTER_BASE_URL}/chat/completions",
-            headers=headers,
+            headers=_chat_headers(),
             data=json.dumps(payload),
         )
 
@@ -57,6 +60,51 @@ def call_openrouter_api(messages, model="openai/gpt-3.5-turbo", temperature=0.7,
         logger.error(f"Error calling OpenRouter API: {e}")
         return None
 
+def stream_openrouter_api(messages, model="openai/gpt-3.5-turbo", temperature=0.7, max_tokens=1000):
+    """
+    Stream a response from the OpenRouter API as text deltas.
+    OpenRouter uses the OpenAI server-sent events format.
+    """
+    try:
+        if not OPENROUTER_API_KEY:
+            logger.warning("OpenRouter API key not found, nothing to stream")
+            return
+
+        payload = {
+            "model": _normalize_model(model),
+            "messages": messages,
+            "temperature": temperature,
+            "max_tokens": max_tokens,
+            "stream": True,
+        }
+
+        with http_client.post(
+            f"{OPENROUTER_BASE_URL}/chat/completions",
+            headers=_chat_headers(),
+            data=json.dumps(payload),
+            stream=True,
+        ) as response:
+            if response.status_code != 200:
+                logger.error(f"OpenRouter API error: {response.status_code} - {response.text}")
+                return
+
+            response.encoding = "utf-8"
+            for line in response.iter_lines(decode_unicode=True):
+                # Skip keep-alive comments and blank separators
+                if not line or not line.startswith("data:"):
+                    continue
+                data = line[len("data:"):].strip()
+                if data == "[DONE]":
+                    break
+                choices = json.loads(data).get("choices") or []
+                if not choices:
+                    continue
+                delta = choices[0].get("delta", {}).get("content")
+                if delta:
+                    yield delta
+    except Exception as e:
+        logger.error(f"Error streaming from OpenRouter API: {e}")
+
 def get_available_models():
     """
     Get a list of available models from OpenRouter
@@ -71,7 +119,7 @@ def get_available_models():
             "Content-Type": "application/json",
         }
 
-        response = requests.get(
+        response = http_client.get(
             f"{OPENROUTER_BASE_URL}/models",
             headers=headers,
         )
@@ -0,0 +1,253 @@
+"""
+Who is in which chat room.
+
+The registry maps each Socket.IO sid to its user and rooms, and each room
+to a reference-counted member table (username -> open connections), so a
+user with several tabs is listed once and only leaves when the last tab
+does. Joins, leaves and member counts are O(1); roster snapshots are
+O(members of that room). Every change is returned as a presence delta for
+the caller to broadcast, and sids whose disconnect was never seen are
+compacted away periodically.
+
+Room tables live in the process by default, split into shards keyed by
+room. With a Redis Socket.IO message queue they live in Redis instead, one
+hash per room (hash-tagged by room, so Redis Cluster shards by room too),
+and every worker process sees the same members. A crashed worker's members
+stay in Redis until the room has been idle for PRESENCE_ROOM_TTL.
+
+Configuration (environment):
+    PRESENCE_SHARDS            in-process room shards (default 16)
+    PRESENCE_COMPACT_INTERVAL  seconds between stale-sid sweeps (default 60)
+    PRESENCE_STALE_AFTER       idle seconds before a disconnected sid is dropped (default 120)
+    PRESENCE_ROOM_TTL          idle seconds before a Redis room table expires (default 3600)
+"""
+import os
+import time
+import logging
+import threading
+import zlib
+
+logger = logging.getLogger(__name__)
+
+PRESENCE_SHARDS = int(os.environ.get("PRESENCE_SHARDS", 16))
+PRESENCE_COMPACT_INTERVAL = float(os.environ.get("PRESENCE_COMPACT_INTERVAL", 60))
+PRESENCE_STALE_AFTER = float(os.environ.get("PRESENCE_STALE_AFTER", 120))
+PRESENCE_ROOM_TTL = int(os.environ.get("PRESENCE_ROOM_TTL", 3600))
+
+
+class MemoryPresenceStore:
+    """Reference-counted room members in this process, sharded by room"""
+
+    def __init__(self, shards=PRESENCE_SHARDS):
+        self._shards = [(threading.Lock(), {}) for _ in range(max(1, shards))]
+
+    def _shard(self, room):
+        return self._shards[zlib.crc32(room.encode("utf-8")) % len(self._shards)]
+
+    def add(self, room, username):
+        """Count one more connection for ``username``; returns its new count"""
+        lock, rooms = self._shard(room)
+        with lock:
+            members = rooms.setdefault(room, {})
+            members[username] = members.get(username, 0) + 1
+            return members[username]
+
+    def remove(self, room, username):
+        """Count one connection less; returns the connections left"""
+        lock, rooms = self._shard(room)
+        with lock:
+            members = rooms.get(room)
+            if not members or username not in members:
+                return 0
+            members[username] -= 1
+            left = members[username]
+            if left <= 0:
+                del members[username]
+                if not members:
+                    del rooms[room]
+            return max(left, 0)
+
+    def count(self, room):
+        lock, rooms = self._shard(room)
+        with lock:
+            return len(rooms.get(room, ()))
+
+    def members(self, room):
+        lock, rooms = self._shard(room)
+        with lock:
+            return dict(rooms.get(room, {}))
+
+    def keep_alive(self, rooms):
+        pass
+
+
+class RedisPresenceStore:
+    """Reference-counted room members shared by all workers through Redis"""
+
+    # Decrement and drop the field at zero in one step, so a concurrent join cannot be lost
+    _REMOVE_SCRIPT = """
+        local left = redis.call('HINCRBY', KEYS[1], ARGV[1], -1)
+        if left <= 0 then
+            redis.call('HDEL', KEYS[1], ARGV[1])
+            return 0
+        end
+        return left
+    """
+
+    def __init__(self, url, ttl=PRESENCE_ROOM_TTL):
+        import redis
+        self.redis = redis.Redis.from_url(url)
+        self.ttl = ttl
+        self._remove = self.redis.register_script(self._REMOVE_SCRIPT)
+
+    @staticmethod
+    def _key(room):
+        return f"presence:{{{room}}}"
+
+    def add(self, room, username):
+        pipe = self.redis.pipeline()
+        pipe.hincrby(self._key(room), username, 1)
+        pipe.expire(self._key(room), self.ttl)
+        return pipe.execute()[0]
+
+    def remove(self, room, username):
+        return int(self._remove(keys=[self._key(room)], args=[username]))
+
+    def count(self, room):
+        return self.redis.hlen(self._key(room))
+
+    def members(self, room):
+        return {name.decode("utf-8"): int(count) for name, count in self.redis.hgetall(self._key(room)).items()}
+
+    def keep_alive(self, rooms):
+        pipe = self.redis.pipeline()
+        for room in rooms:
+            pipe.expire(self._key(room), self.ttl)
+        pipe.execute()
+
+
+def make_presence_store(message_queue=None):
+    """Redis store when the Socket.IO queue is Redis, in-process otherwise"""
+    if message_queue and message_queue.startswith(("redis://", "rediss://")):
+        try:
+            return RedisPresenceStore(message_queue)
+        except ImportError:
+            logger.warning("redis package not installed; room presence is per process")
+    return MemoryPresenceStore()
+
+
+class PresenceRegistry:
+    def __init__(self, socketio, store=None, compact_interval=PRESENCE_COMPACT_INTERVAL,
+                 stale_after=PRESENCE_STALE_AFTER):
+        self.socketio = socketio
+        self.store = store or MemoryPresenceStore()
+        self.compact_interval = compact_interval
+        self.stale_after = stale_after
+        self._sids = {}  # sid -> {'username', 'rooms', 'seen'}
+        self._lock = threading.Lock()
+        self._started = False
+
+    def _ensure_compactor(self):
+        if self._started:
+            return
+        with self._lock:
+            if self._started:
+                return
+            self.socketio.start_background_task(self._compact_loop)
+            self._started = True
+
+    def _delta(self, action, room, username):
+        return {"action": action, "room": room, "username": username, "count": self.store.count(room)}
+
+    def join(self, sid, room, username):
+        """Add ``sid`` to ``room``; returns the presence deltas to broadcast"""
+        self._ensure_compactor()
+        deltas = []
+        with self._lock:
+            entry = self._sids.get(sid)
+            previous = None
+            if entry is not None and entry["username"] != username:
+                # Same connection, new name: leave under the old name first
+                previous, entry = entry, None
+            if entry is None:
+                entry = self._sids[sid] = {"username": username, "rooms": set(), "seen": time.monotonic()}
+            already_in = room in entry["rooms"]
+            entry["rooms"].add(room)
+            entry["seen"] = time.monotonic()
+
+        if previous is not None:
+            deltas.extend(self._release(previous["username"], previous["rooms"]))
+        if not already_in and self.store.add(room, username) == 1:
+            deltas.append(self._delta("join", room, username))
+        return deltas
+
+    def leave(self, sid, room):
+        with self._lock:
+            entry = self._sids.get(sid)
+            if entry is None or room not in entry["rooms"]:
+                return []
+            entry["rooms"].discard(room)
+            username = entry["username"]
+        return self._release(username, [room])
+
+    def disconnect(self, sid):
+        with self._lock:
+            entry = self._sids.pop(sid, None)
+        if entry is None:
+            return []
+        return self._release(entry["username"], entry["rooms"])
+
+    def _release(self, username, rooms):
+        deltas = []
+        for room in rooms:
+            if self.store.remove(room, username) == 0:
+                deltas.append(self._delta("leave", room, username))
+        return deltas
+
+    def touch(self, sid):
+        entry = self._sids.get(sid)
+        if entry is not None:
+            entry["seen"] = time.monotonic()
+
+    def count(self, room):
+        return self.store.count(room)
+
+    def roster(self, room):
+        """Snapshot of ``room``: member count and users sorted by name"""
+        members = self.store.members(room)
+        return {
+            "room": room,
+            "count": len(members),
+            "users": [
+                {"username": username, "status": "online", "connections": connections}
+                for username, connections in sorted(members.items())
+            ],
+        }
+
+    def compact(self, is_connected):
+        """Drop sids idle for ``stale_after`` that the server no longer knows; returns deltas"""
+        cutoff = time.monotonic() - self.stale_after
+        with self._lock:
+            candidates = [sid for sid, entry in self._sids.items() if entry["seen"] < cutoff]
+        deltas = []
+        for sid in candidates:
+            if not is_connected(sid):
+                deltas.extend(self.disconnect(sid))
+        return deltas
+
+    def _compact_loop(self):
+        while True:
+            self.socketio.sleep(self.compact_interval)
+            try:
+                deltas = self.compact(lambda sid: self.socketio.server.manager.is_connected(sid, "/"))
+                for delta in deltas:
+                    self.socketio.emit("presence", delta, to=delta["room"])
+                with self._lock:
+                    rooms = set().union(*(entry["rooms"] for entry in self._sids.values()))
+                self.store.keep_alive(rooms)
+            except Exception as e:
+                logger.error(f"Error compacting room presence: {e}")
+
+    def stats(self):
+        with self._lock:
+            return {"connections": len(self._sids)}
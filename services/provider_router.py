@@ -0,0 +1,225 @@
+"""
+Health-aware routing across AI providers.
+
+Every (provider, model) backend keeps a rolling window of call outcomes and
+latencies. A circuit breaker opens when a backend keeps failing, so requests
+skip it until a cool-down has passed and a single probe call succeeds.
+Latency-sensitive callers can hedge: if the first backend has not answered
+by its p95 latency, a second backend is started and the first good answer wins.
+
+Configuration (environment):
+    ROUTER_WINDOW            outcomes kept per backend (default 50)
+    ROUTER_FAILURE_THRESHOLD consecutive failures that open the circuit (default 3)
+    ROUTER_ERROR_RATE        error rate over the window that opens it (default 0.5)
+    ROUTER_OPEN_SECONDS      cool-down before a probe is allowed (default 30)
+    ROUTER_HEDGE_MIN_DELAY   lower bound for the hedge delay in seconds (default 0.5)
+    ROUTER_HEDGE_MAX_DELAY   upper bound for the hedge delay in seconds (default 8)
+"""
+import os
+import time
+import logging
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from services.metrics import observe_provider_call
+
+logger = logging.getLogger(__name__)
+
+ROUTER_WINDOW = int(os.environ.get("ROUTER_WINDOW", 50))
+ROUTER_FAILURE_THRESHOLD = int(os.environ.get("ROUTER_FAILURE_THRESHOLD", 3))
+ROUTER_ERROR_RATE = float(os.environ.get("ROUTER_ERROR_RATE", 0.5))
+ROUTER_OPEN_SECONDS = float(os.environ.get("ROUTER_OPEN_SECONDS", 30))
+ROUTER_HEDGE_MIN_DELAY = float(os.environ.get("ROUTER_HEDGE_MIN_DELAY", 0.5))
+ROUTER_HEDGE_MAX_DELAY = float(os.environ.get("ROUTER_HEDGE_MAX_DELAY", 8))
+
+# Error rate is only trusted once the window holds this many samples
+MIN_SAMPLES = 10
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class BackendHealth:
+    """Rolling statistics and circuit breaker for one (provider, model)"""
+
+    def __init__(self, window=ROUTER_WINDOW):
+        self.outcomes = deque(maxlen=window)  # (latency seconds, ok)
+        self.consecutive_failures = 0
+        self.state = CLOSED
+        self.opened_at = 0.0
+        self.probe_in_flight = False
+        self.lock = threading.Lock()
+
+    def error_rate(self):
+        if not self.outcomes:
+            return 0.0
+        return sum(1 for _, ok in self.outcomes if not ok) / len(self.outcomes)
+
+    def p95_latency(self):
+        latencies = sorted(latency for latency, ok in self.outcomes if ok)
+        if not latencies:
+            return None
+        return latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+
+    def allow(self):
+        """Whether a call may be sent now; claims the probe slot when half-open"""
+        with self.lock:
+            if self.state == CLOSED:
+                return True
+            if self.state == OPEN and time.time() - self.opened_at >= ROUTER_OPEN_SECONDS:
+                self.state = HALF_OPEN
+            if self.state == HALF_OPEN and not self.probe_in_flight:
+                self.probe_in_flight = True
+                return True
+            return False
+
+    def record(self, latency, ok):
+        with self.lock:
+            self.outcomes.append((latency, ok))
+            self.probe_in_flight = False
+            if ok:
+                self.consecutive_failures = 0
+                if self.state != CLOSED:
+                    self.state = CLOSED
+                    self.outcomes.clear()
+                    self.outcomes.append((latency, ok))
+                return
+
+            self.consecutive_failures += 1
+            too_many_errors = len(self.outcomes) >= MIN_SAMPLES and self.error_rate() >= ROUTER_ERROR_RATE
+            if self.state == HALF_OPEN or self.consecutive_failures >= ROUTER_FAILURE_THRESHOLD or too_many_errors:
+                self.state = OPEN
+                self.opened_at = time.time()
+
+    def score(self):
+        """Lower is healthier: error rate dominates, then p95 latency"""
+        p95 = self.p95_latency()
+        return self.error_rate() * 100 + (p95 if p95 is not None else 0.0)
+
+    def snapshot(self):
+        p95 = self.p95_latency()
+        return {
+            "state": self.state,
+            "samples": len(self.outcomes),
+            "error_rate": round(self.error_rate(), 4),
+            "p95_latency": round(p95, 3) if p95 is not None else None,
+            "consecutive_failures": self.consecutive_failures,
+        }
+
+
+class ProviderRouter:
+    def __init__(self, max_workers=32):
+        self._health = {}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="provider-hedge")
+
+    def health(self, backend):
+        """Health of ``backend``; entries are never dropped, so callers only pass known models"""
+        health = self._health.get(backend)
+        if health is None:
+            with self._lock:
+                health = self._health.setdefault(backend, BackendHealth())
+        return health
+
+    def plan(self, primary, fallbacks):
+        """
+        Order backends for a request: the requested one first, then the
+        fallbacks by health score. Duplicates are dropped.
+        """
+        ordered = [primary]
+        rest = [backend for backend in fallbacks if backend != primary]
+        rest.sort(key=lambda backend: self.health(backend).score())
+        for backend in rest:
+            if backend not in ordered:
+                ordered.append(backend)
+        return ordered
+
+    def _attempt(self, backend, call, is_success):
+        health = self.health(backend)
+        started = time.monotonic()
+        try:
+            result = call(*backend)
+            ok = is_success(result)
+        except Exception as e:
+            logger.error(f"Provider {backend[0]}/{backend[1]} raised: {e}")
+            result, ok = None, False
+        latency = time.monotonic() - started
+        health.record(latency, ok)
+        observe_provider_call(backend[0], backend[1], "chat", latency, ok)
+        if not ok:
+            logger.warning(f"Provider {backend[0]}/{backend[1]} failed; trying next backend")
+        return result if ok else None
+
+    def _hedge_delay(self, backend):
+        p95 = self.health(backend).p95_latency()
+        if p95 is None:
+            return ROUTER_HEDGE_MAX_DELAY
+        return min(ROUTER_HEDGE_MAX_DELAY, max(ROUTER_HEDGE_MIN_DELAY, p95))
+
+    def _next_allowed(self, remaining):
+        """Pop backends off ``remaining`` until one whose circuit admits a call"""
+        while remaining:
+            backend = remaining.pop(0)
+            if self.health(backend).allow():
+                return backend
+        return None
+
+    def call(self, backends, call, is_success=bool, hedge=False):
+        """
+        Call ``call(provider, model)`` on the first healthy backend, falling
+        back along ``backends``. Returns None when every backend failed.
+        """
+        remaining = list(backends)
+        attempted = False
+
+        if hedge:
+            primary = self._next_allowed(remaining)
+            if primary is not None:
+                attempted = True
+                result = self._call_hedged(primary, remaining, call, is_success)
+                if result is not None:
+                    return result
+
+        while True:
+            backend = self._next_allowed(remaining)
+            if backend is None:
+                break
+            attempted = True
+            result = self._attempt(backend, call, is_success)
+            if result is not None:
+                return result
+
+        if not attempted and backends:
+            # Every circuit is open: better to try the requested backend than fail outright
+            return self._attempt(backends[0], call, is_success)
+        return None
+
+    def _call_hedged(self, primary, remaining, call, is_success):
+        first = self._executor.submit(self._attempt, primary, call, is_success)
+        done, _ = wait([first], timeout=self._hedge_delay(primary))
+        if done and first.result() is not None:
+            return first.result()
+
+        # The primary is slow (or already failed): race a second backend against it
+        secondary = self._next_allowed(remaining)
+        pending = set() if done else {first}
+        if secondary is not None:
+            pending.add(self._executor.submit(self._attempt, secondary, call, is_success))
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.result() is not None:
+                    return future.result()
+        return None
+
+    def snapshot(self):
+        return {
+            f"{provider}/{model}": health.snapshot()
+            for (provider, model), health in list(self._health.items())
+        }
+
+
+# Process-wide router
+provider_router = ProviderRouter()
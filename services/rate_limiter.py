@@ -0,0 +1,183 @@
+"""
+Token-bucket rate limiting for AI endpoints and Socket.IO events.
+
+Each policy is a bucket of ``capacity`` tokens refilled at ``capacity``
+per ``period`` seconds; a request takes as many tokens as it costs (a
+chat by its max_tokens, speech by its character count). Buckets are keyed
+per client (user ID or IP) and, for Socket.IO events, per sid as well.
+A bucket is two numbers refilled lazily on access, so a check is O(1)
+and idle buckets are evicted least recently used first. A request checked
+against several buckets is only charged when every one of them admits it.
+
+The in-process store limits each worker separately; set RATE_LIMIT_REDIS_URL
+to share the buckets between all workers and hosts.
+
+Configuration (environment):
+    RATE_LIMIT_ENABLED      set to 0 to disable limiting (default 1)
+    RATE_LIMIT_<POLICY>     "capacity/period" for a policy, e.g. RATE_LIMIT_CHAT=30/60
+    RATE_LIMIT_MAX_KEYS     buckets kept in process (default 100000)
+    RATE_LIMIT_REDIS_URL    Redis URL for a shared store (default unset)
+"""
+import os
+import math
+import time
+import logging
+import threading
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+RATE_LIMIT_ENABLED = os.environ.get("RATE_LIMIT_ENABLED", "1").lower() in ("1", "true", "yes")
+RATE_LIMIT_MAX_KEYS = int(os.environ.get("RATE_LIMIT_MAX_KEYS", 100000))
+RATE_LIMIT_REDIS_URL = os.environ.get("RATE_LIMIT_REDIS_URL") or None
+
+# policy -> (capacity, period seconds)
+DEFAULT_POLICIES = {
+    "chat": (30, 60),            # cost 1 + max_tokens // 1000 per chat or code request
+    "tts": (40, 60),             # cost 1 per started 500 characters
+    "image": (5, 60),            # cost 1 per image
+    "import": (5, 3600),         # cost 1 per conversation import
+    "export": (10, 3600),        # cost 1 per export download
+    "socket_message": (10, 2),   # chat-room messages per sid and per client
+}
+
+
+def _load_policies():
+    policies = dict(DEFAULT_POLICIES)
+    for name in policies:
+        value = os.environ.get(f"RATE_LIMIT_{name.upper()}")
+        if not value:
+            continue
+        try:
+            capacity, period = value.split("/")
+            policies[name] = (float(capacity), float(period))
+        except ValueError:
+            logger.warning(f"Ignoring invalid RATE_LIMIT_{name.upper()}={value!r}; expected capacity/period")
+    return policies
+
+
+def chat_cost(max_tokens):
+    return 1 + max(0, int(max_tokens or 0)) // 1000
+
+
+def tts_cost(text):
+    return max(1, math.ceil(len(text or "") / 500))
+
+
+class MemoryBucketStore:
+    def __init__(self, max_keys=RATE_LIMIT_MAX_KEYS):
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()  # key -> [tokens, updated_at], least recently used first
+        self._lock = threading.Lock()
+
+    def take(self, keys, capacity, rate, cost):
+        """
+        Take ``cost`` tokens from the bucket of every key in ``keys``, or from
+        none of them; returns 0 when allowed, else seconds until it would be.
+        """
+        now = time.monotonic()
+        with self._lock:
+            buckets = []
+            for key in keys:
+                bucket = self._buckets.get(key)
+                if bucket is None:
+                    bucket = self._buckets[key] = [capacity, now]
+                else:
+                    self._buckets.move_to_end(key)
+                    bucket[0] = min(capacity, bucket[0] + (now - bucket[1]) * rate)
+                    bucket[1] = now
+                buckets.append(bucket)
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+
+            wait = max((cost - bucket[0]) / rate for bucket in buckets) if buckets else 0.0
+            if wait > 0:
+                return wait
+            for bucket in buckets:
+                bucket[0] -= cost
+            return 0.0
+
+
+class RedisBucketStore:
+    # Refill every bucket, then take from all of them or none, atomically;
+    # a key expires once its bucket would be full again
+    _TAKE_SCRIPT = """
+        local capacity = tonumber(ARGV[1])
+        local rate = tonumber(ARGV[2])
+        local cost = tonumber(ARGV[3])
+        local now = redis.call('TIME')
+        now = tonumber(now[1]) + tonumber(now[2]) / 1000000
+        local tokens = {}
+        local wait = 0
+        for i, key in ipairs(KEYS) do
+            local state = redis.call('HMGET', key, 'tokens', 'updated_at')
+            local level = tonumber(state[1]) or capacity
+            local updated_at = tonumber(state[2]) or now
+            level = math.min(capacity, level + (now - updated_at) * rate)
+            tokens[i] = level
+            if level < cost then
+                wait = math.max(wait, (cost - level) / rate)
+            end
+        end
+        for i, key in ipairs(KEYS) do
+            if wait == 0 then
+                tokens[i] = tokens[i] - cost
+            end
+            redis.call('HSET', key, 'tokens', tokens[i], 'updated_at', now)
+            redis.call('PEXPIRE', key, math.ceil((capacity - tokens[i]) / rate * 1000) + 1000)
+        end
+        return tostring(wait)
+    """
+
+    def __init__(self, url):
+        import redis
+        self.redis = redis.Redis.from_url(url)
+        self._take = self.redis.register_script(self._TAKE_SCRIPT)
+
+    def take(self, keys, capacity, rate, cost):
+        return float(self._take(keys=[f"ratelimit:{key}" for key in keys], args=[capacity, rate, cost]))
+
+
+def make_bucket_store(url=RATE_LIMIT_REDIS_URL):
+    if url:
+        try:
+            return RedisBucketStore(url)
+        except ImportError:
+            logger.warning("redis package not installed; rate limits are per process")
+    return MemoryBucketStore()
+
+
+class RateLimiter:
+    def __init__(self, store=None, policies=None, enabled=RATE_LIMIT_ENABLED):
+        self.store = store or MemoryBucketStore()
+        self.policies = policies or _load_policies()
+        self.enabled = enabled
+        self.limited = 0
+
+    def take(self, policy, keys, cost=1):
+        """
+        Take ``cost`` tokens from the ``policy`` bucket of every key in ``keys``.
+        Returns 0 when allowed, else the seconds to wait before retrying.
+        """
+        if not self.enabled:
+            return 0.0
+        capacity, period = self.policies[policy]
+        rate = capacity / period
+        cost = min(cost, capacity)  # an oversized request must still be able to pass eventually
+        try:
+            retry_after = self.store.take([f"{policy}:{key}" for key in keys], capacity, rate, cost)
+        except Exception as e:
+            # A broken shared store must not take the whole app down with it
+            logger.error(f"Rate limit store error: {e}")
+            retry_after = 0.0
+        if retry_after:
+            self.limited += 1
+        return retry_after
+
+    def stats(self):
+        return {
+            "enabled": self.enabled,
+            "limited": self.limited,
+            "policies": {name: {"capacity": capacity, "period": period}
+                         for name, (capacity, period) in self.policies.items()},
+        }
@@ -0,0 +1,210 @@
+"""
+Deterministic cache for AI completions.
+
+Entries are keyed on (provider, model, normalized messages, temperature,
+max_tokens). A bounded in-memory LRU sits in front of an optional SQLite
+file so cached answers survive restarts and are shared between workers.
+
+Configuration (environment):
+    RESPONSE_CACHE_ENABLED   "true" to turn the cache on (off by default)
+    RESPONSE_CACHE_TTL       seconds an entry stays valid (default 86400)
+    RESPONSE_CACHE_SIZE      max entries in the memory tier (default 1000)
+    RESPONSE_CACHE_PATH      SQLite file for the disk tier (unset = memory only)
+    RESPONSE_CACHE_DISK_SIZE max entries kept on disk (default 100000)
+"""
+import os
+import json
+import time
+import hashlib
+import logging
+import sqlite3
+import threading
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_messages(messages):
+    """Keep only role/content and collapse insignificant whitespace"""
+    return [
+        {"role": msg.get("role"), "content": " ".join(str(msg.get("content", "")).split())}
+        for msg in messages
+    ]
+
+
+def make_key(provider, model, messages, temperature, max_tokens):
+    payload = json.dumps(
+        [provider, model, normalize_messages(messages), round(float(temperature), 3), int(max_tokens)],
+        ensure_ascii=False,
+        separators=(",", ":"),
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    def __init__(self, max_entries=1000, ttl=86400, path=None, max_disk_entries=100000):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.path = path
+        self.max_disk_entries = max_disk_entries
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        if path:
+            self._init_disk()
+
+    # --- disk tier -------------------------------------------------------
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=5)
+
+    def _init_disk(self):
+        try:
+            with self._connect() as conn:
+                conn.execute(
+                    "CREATE TABLE IF NOT EXISTS response_cache ("
+                    "key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL)"
+                )
+                conn.execute("CREATE INDEX IF NOT EXISTS ix_response_cache_expires ON response_cache (expires_at)")
+        except sqlite3.Error as e:
+            logger.error(f"Response cache disk tier disabled: {e}")
+            self.path = None
+
+    def _disk_get(self, key, now):
+        try:
+            with self._connect() as conn:
+                row = conn.execute(
+                    "SELECT value, expires_at FROM response_cache WHERE key = ?", (key,)
+                ).fetchone()
+        except sqlite3.Error as e:
+            logger.error(f"Response cache read error: {e}")
+            return None
+        if row and row[1] > now:
+            return row
+        return None
+
+    def _disk_set(self, key, value, expires_at):
+        try:
+            with self._connect() as conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO response_cache (key, value, expires_at) VALUES (?, ?, ?)",
+                    (key, value, expires_at),
+                )
+                # Drop expired rows, then trim the oldest ones beyond the size bound
+                conn.execute("DELETE FROM response_cache WHERE expires_at <= ?", (time.time(),))
+                conn.execute(
+                    "DELETE FROM response_cache WHERE key IN ("
+                    "SELECT key FROM response_cache ORDER BY expires_at DESC LIMIT -1 OFFSET ?)",
+                    (self.max_disk_entries,),
+                )
+        except sqlite3.Error as e:
+            logger.error(f"Response cache write error: {e}")
+
+    # --- public API ------------------------------------------------------
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                value, expires_at = entry
+                if expires_at > now:
+                    self._memory.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._memory[key]
+
+        if self.path:
+            row = self._disk_get(key, now)
+            if row is not None:
+                with self._lock:
+                    self._store_memory(key, row[0], row[1])
+                    self.hits += 1
+                    self.disk_hits += 1
+                return row[0]
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def set(self, key, value):
+        expires_at = time.time() + self.ttl
+        with self._lock:
+            self._store_memory(key, value, expires_at)
+        if self.path:
+            self._disk_set(key, value, expires_at)
+
+    def _store_memory(self, key, value, expires_at):
+        self._memory[key] = (value, expires_at)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+            self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+        if self.path:
+            try:
+                with self._connect() as conn:
+                    conn.execute("DELETE FROM response_cache")
+            except sqlite3.Error as e:
+                logger.error(f"Response cache clear error: {e}")
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "enabled": True,
+                "entries": len(self._memory),
+                "max_entries": self.max_entries,
+                "ttl": self.ttl,
+                "disk": bool(self.path),
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            }
+
+
+def _build_cache():
+    if os.environ.get("RESPONSE_CACHE_ENABLED", "false").lower() not in ("1", "true", "yes"):
+        return None
+    return ResponseCache(
+        max_entries=int(os.environ.get("RESPONSE_CACHE_SIZE", 1000)),
+        ttl=int(os.environ.get("RESPONSE_CACHE_TTL", 86400)),
+        path=os.environ.get("RESPONSE_CACHE_PATH") or None,
+        max_disk_entries=int(os.environ.get("RESPONSE_CACHE_DISK_SIZE", 100000)),
+    )
+
+
+# Process-wide cache, None when disabled
+response_cache = _build_cache()
+
+
+def cached_call(provider, model, messages, temperature, max_tokens, compute, bypass=False, should_cache=bool):
+    """
+    Return the cached completion for these arguments, or call ``compute()``
+    and store its result when ``should_cache(result)`` is true. The default
+    predicate skips falsy results, which is how most providers report errors.
+    """
+    if response_cache is None or bypass:
+        return compute()
+
+    key = make_key(provider, model, messages, temperature, max_tokens)
+    value = response_cache.get(key)
+    if value is not None:
+        return value
+
+    value = compute()
+    if should_cache(value):
+        response_cache.set(key, value)
+    return value
+
+
+def get_cache_stats():
+    if response_cache is None:
+        return {"enabled": False}
+    return response_cache.stats()
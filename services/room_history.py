@@ -0,0 +1,233 @@
+"""
+Persistent chat-room history with write-behind batching.
+
+Room messages are appended to an in-memory ring buffer per room and to a
+pending batch; a single background task writes the batch with one bulk
+INSERT when it reaches ROOM_HISTORY_BATCH_SIZE messages or every
+ROOM_HISTORY_FLUSH_INTERVAL seconds, so broadcasting a message never waits
+on the database. Joining clients are replayed the last messages from the
+ring buffer, which is loaded from the database the first time a room is
+replayed by this process; recording into a room that is not in memory only
+queues the row. When several processes share the rooms through a
+Socket.IO message queue (``shared=True``), each process only sees its own
+writes, so a join reloads the room from the database instead; messages
+other processes have not flushed yet (at most one flush interval) are missed.
+
+A batch the database rejects (e.g. a value longer than its column) is
+written again row by row and only the rows that still fail are dropped;
+when the database is unreachable the whole batch is kept for the next flush.
+
+Configuration (environment):
+    ROOM_HISTORY_SIZE            messages replayed on join / kept per room (default 50)
+    ROOM_HISTORY_MAX_ROOMS       rooms kept in memory, least recently used evicted (default 1000)
+    ROOM_HISTORY_BATCH_SIZE      pending messages that trigger a flush (default 200)
+    ROOM_HISTORY_FLUSH_INTERVAL  seconds between time-based flushes (default 1.0)
+    ROOM_HISTORY_MAX_PENDING     pending messages kept while the database is down (default 10000)
+"""
+import os
+import atexit
+import logging
+import threading
+from collections import OrderedDict, deque
+from datetime import datetime, timezone
+
+from sqlalchemy import exc as sa_exc
+
+logger = logging.getLogger(__name__)
+
+ROOM_HISTORY_SIZE = int(os.environ.get("ROOM_HISTORY_SIZE", 50))
+ROOM_HISTORY_MAX_ROOMS = int(os.environ.get("ROOM_HISTORY_MAX_ROOMS", 1000))
+ROOM_HISTORY_BATCH_SIZE = int(os.environ.get("ROOM_HISTORY_BATCH_SIZE", 200))
+ROOM_HISTORY_FLUSH_INTERVAL = float(os.environ.get("ROOM_HISTORY_FLUSH_INTERVAL", 1.0))
+ROOM_HISTORY_MAX_PENDING = int(os.environ.get("ROOM_HISTORY_MAX_PENDING", 10000))
+
+
+class RoomHistory:
+    def __init__(self, socketio, app, db, model, size=ROOM_HISTORY_SIZE,
+                 max_rooms=ROOM_HISTORY_MAX_ROOMS, batch_size=ROOM_HISTORY_BATCH_SIZE,
+                 flush_interval=ROOM_HISTORY_FLUSH_INTERVAL, max_pending=ROOM_HISTORY_MAX_PENDING,
+                 shared=False):
+        self.socketio = socketio
+        self.app = app
+        self.db = db
+        self.model = model
+        self.size = size
+        self.max_rooms = max_rooms
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.shared = shared
+        self._rooms = OrderedDict()  # room -> deque of message payloads, least recently used first
+        self._pending = []
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._started = False
+        self.flushed = 0
+        self.dropped = 0
+        atexit.register(self.flush)
+
+    def _ensure_flusher(self):
+        if self._started:
+            return
+        with self._lock:
+            if self._started:
+                return
+            self.socketio.start_background_task(self._flush_loop)
+            self._started = True
+
+    def _load_room(self, room):
+        """Ring buffer for ``room``, read from the database on first use"""
+        with self._lock:
+            ring = self._rooms.get(room)
+            if ring is not None:
+                self._rooms.move_to_end(room)
+                return ring
+
+        # Holding the flush lock keeps a batch from moving out of the pending
+        # list between the database read and the merge below
+        with self._flush_lock:
+            try:
+                with self.app.app_context():
+                    rows = [row.to_dict() for row in self.model.get_recent(room, self.size)]
+                    self.db.session.remove()
+            except Exception as e:
+                logger.error(f"Error loading history for room {room}: {e}")
+                rows = []
+
+            with self._lock:
+                ring = self._rooms.get(room)
+                if ring is None:
+                    ring = deque(rows, maxlen=self.size)
+                    # Messages of this room still waiting to be written are not in the database yet
+                    ring.extend(entry["payload"] for entry in self._pending if entry["room"] == room)
+                    self._rooms[room] = ring
+                    while len(self._rooms) > self.max_rooms:
+                        self._rooms.popitem(last=False)
+                self._rooms.move_to_end(room)
+                return ring
+
+    def record(self, room, payload):
+        """
+        Remember a broadcast ``payload`` (username, message, timestamp) for
+        ``room``. Returns immediately; the row is written by the flusher.
+        A room that is not in memory is loaded by the next ``recent()``,
+        which also picks up this row from the pending batch.
+        """
+        self._ensure_flusher()
+        created_at = payload.get("timestamp")
+        created_at = datetime.fromisoformat(created_at) if created_at else datetime.now(timezone.utc)
+
+        with self._lock:
+            ring = self._rooms.get(room)
+            if ring is not None:
+                self._rooms.move_to_end(room)
+                ring.append(payload)
+            self._pending.append({
+                "room": room,
+                "payload": payload,
+                "row": {
+                    "room": room,
+                    "username": payload["username"],
+                    "message": payload["message"],
+                    "created_at": created_at,
+                },
+            })
+            if len(self._pending) > self.max_pending:
+                # The database has been unreachable for a while: drop the oldest rows
+                overflow = len(self._pending) - self.max_pending
+                del self._pending[:overflow]
+                self.dropped += overflow
+            if len(self._pending) >= self.batch_size:
+                self._wake.set()
+
+    def recent(self, room, limit=None):
+        """Last ``limit`` messages of ``room``, oldest first"""
+        if self.shared:
+            with self._lock:
+                self._rooms.pop(room, None)
+        ring = self._load_room(room)
+        with self._lock:
+            messages = list(ring)
+        if limit is not None:
+            messages = messages[-limit:]
+        return messages
+
+    def _flush_loop(self):
+        while True:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"Error flushing room history: {e}")
+
+    def _insert(self, batch):
+        """INSERT the rows of ``batch`` in one transaction; rolls back and re-raises on error"""
+        with self.app.app_context():
+            try:
+                self.db.session.execute(self.model.__table__.insert(), [entry["row"] for entry in batch])
+                self.db.session.commit()
+            except Exception:
+                self.db.session.rollback()
+                raise
+            finally:
+                self.db.session.remove()
+
+    def _requeue(self, batch):
+        with self._lock:
+            self._pending[:0] = batch
+            overflow = len(self._pending) - self.max_pending
+            if overflow > 0:
+                del self._pending[:overflow]
+                self.dropped += overflow
+
+    def flush(self):
+        """Write all pending messages with one bulk INSERT; returns the number written"""
+        with self._flush_lock:
+            with self._lock:
+                batch, self._pending = self._pending, []
+            if not batch:
+                return 0
+
+            try:
+                self._insert(batch)
+            except sa_exc.OperationalError as e:
+                # The database is unreachable, not the rows: keep them all for the next flush
+                logger.error(f"Error writing {len(batch)} room messages; will retry: {e}")
+                self._requeue(batch)
+                return 0
+            except Exception as e:
+                logger.warning(f"Bulk write of {len(batch)} room messages failed, writing them one by one: {e}")
+                return self._flush_rows(batch)
+
+            self.flushed += len(batch)
+            return len(batch)
+
+    def _flush_rows(self, batch):
+        """Write ``batch`` row by row so a bad row cannot block the ones after it"""
+        written = 0
+        for index, entry in enumerate(batch):
+            try:
+                self._insert([entry])
+            except sa_exc.OperationalError as e:
+                logger.error(f"Error writing {len(batch) - index} room messages; will retry: {e}")
+                self._requeue(batch[index:])
+                break
+            except Exception as e:
+                logger.error(f"Dropping room message of {entry['row']['username']!r} in {entry['room']!r}: {e}")
+                with self._lock:
+                    self.dropped += 1
+            else:
+                written += 1
+        self.flushed += written
+        return written
+
+    def stats(self):
+        with self._lock:
+            return {
+                "rooms": len(self._rooms),
+                "pending": len(self._pending),
+                "flushed": self.flushed,
+                "dropped": self.dropped,
+            }
@@ -0,0 +1,70 @@
+"""
+Message-queue backend for the Socket.IO server.
+
+With several worker processes or hosts, each Socket.IO server only knows
+its own clients. A message queue lets every server relay room broadcasts
+to the others, so an emit from any process reaches every client in the room.
+
+Configuration (environment):
+    SOCKETIO_MESSAGE_QUEUE  queue URL; unset for a single process.
+                            redis://host:6379/0  Redis pub/sub (needs the redis package)
+                            amqp://...           any Kombu transport
+                            local://             in-process stand-in for tests and
+                                                 for several servers in one process
+    SOCKETIO_CHANNEL        channel name shared by all servers (default flask-socketio)
+"""
+import os
+import queue
+import threading
+
+SOCKETIO_MESSAGE_QUEUE = os.environ.get("SOCKETIO_MESSAGE_QUEUE") or None
+SOCKETIO_CHANNEL = os.environ.get("SOCKETIO_CHANNEL", "flask-socketio")
+
+LOCAL_QUEUE_URL = "local://"
+
+_local_manager = None
+
+
+def _local_manager_class():
+    """The local manager class, defined once so all servers share its subscriber table"""
+    global _local_manager
+    if _local_manager is not None:
+        return _local_manager
+
+    import socketio
+
+    class LocalPubSubManager(socketio.PubSubManager):
+        """Pub/sub over in-process queues: every manager on a channel receives every message"""
+
+        name = "local"
+        _subscribers = {}  # channel -> inbox queues of the managers listening on it
+        _subscribers_lock = threading.Lock()
+
+        def __init__(self, channel="socketio", write_only=False, logger=None):
+            super().__init__(channel=channel, write_only=write_only, logger=logger)
+            self._inbox = queue.Queue()
+            if not write_only:
+                with self._subscribers_lock:
+                    self._subscribers.setdefault(channel, []).append(self._inbox)
+
+        def _publish(self, data):
+            with self._subscribers_lock:
+                inboxes = list(self._subscribers.get(self.channel, ()))
+            for inbox in inboxes:
+                inbox.put(data)
+
+        def _listen(self):
+            while True:
+                yield self._inbox.get()
+
+    _local_manager = LocalPubSubManager
+    return _local_manager
+
+
+def socketio_queue_options(message_queue=SOCKETIO_MESSAGE_QUEUE, channel=SOCKETIO_CHANNEL):
+    """Keyword arguments for SocketIO(...) that attach the configured message queue"""
+    if not message_queue:
+        return {}
+    if message_queue == LOCAL_QUEUE_URL:
+        return {"client_manager": _local_manager_class()(channel=channel)}
+    return {"message_queue": message_queue, "channel": channel}
@@ -0,0 +1,132 @@
+"""
+Content-addressed disk cache for synthesized speech.
+
+Audio is stored under the SHA-256 of (text, voice_id, model_id,
+voice_settings), so a replayed reply is served from disk instead of being
+synthesized again. The cache is bounded in bytes and evicts the least
+recently used files first.
+
+Configuration (environment):
+    TTS_CACHE_DIR        directory for cached audio (default instance/tts_cache)
+    TTS_CACHE_MAX_BYTES  total size bound (default 500 MB)
+"""
+import os
+import re
+import json
+import time
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+TTS_CACHE_DIR = os.environ.get(
+    "TTS_CACHE_DIR",
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "instance", "tts_cache")
+)
+TTS_CACHE_MAX_BYTES = int(os.environ.get("TTS_CACHE_MAX_BYTES", 500 * 1024 * 1024))
+
+_KEY_PATTERN = re.compile(r"^[0-9a-f]{64}$")
+
+
+def make_key(text, voice_id, model_id, voice_settings):
+    payload = json.dumps([text, voice_id, model_id, voice_settings], ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def is_valid_key(key):
+    return bool(_KEY_PATTERN.match(key or ""))
+
+
+class TTSCache:
+    def __init__(self, directory=TTS_CACHE_DIR, max_bytes=TTS_CACHE_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()  # key -> size, least recently used first
+        self._total = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(directory, exist_ok=True)
+        self._scan()
+
+    def _scan(self):
+        """Rebuild the LRU order from file access times left by earlier runs"""
+        found = []
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                key, ext = os.path.splitext(name)
+                if ext != ".mp3" or not is_valid_key(key):
+                    continue
+                stat = os.stat(os.path.join(root, name))
+                found.append((stat.st_atime, key, stat.st_size))
+        for _, key, size in sorted(found):
+            self._entries[key] = size
+            self._total += size
+
+    def path_for(self, key):
+        return os.path.join(self.directory, key[:2], key + ".mp3")
+
+    def get_path(self, key):
+        """Path of the cached audio for ``key``, or None on a miss"""
+        path = self.path_for(key)
+        with self._lock:
+            if key not in self._entries:
+                # Another worker process may have written it
+                if not os.path.exists(path):
+                    self.misses += 1
+                    return None
+                size = os.path.getsize(path)
+                self._entries[key] = size
+                self._total += size
+            self._entries.move_to_end(key)
+            self.hits += 1
+        try:
+            now = time.time()
+            os.utime(path, (now, now))
+        except OSError:
+            # Removed behind our back; forget it
+            with self._lock:
+                self._total -= self._entries.pop(key, 0)
+            return None
+        return path
+
+    def put(self, key, audio):
+        path = self.path_for(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write to a temporary name first so readers never see partial files
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(audio)
+        os.replace(tmp_path, path)
+
+        with self._lock:
+            self._total -= self._entries.pop(key, 0)
+            self._entries[key] = len(audio)
+            self._total += len(audio)
+            evicted = []
+            while self._total > self.max_bytes and len(self._entries) > 1:
+                old_key, size = self._entries.popitem(last=False)
+                self._total -= size
+                evicted.append(old_key)
+
+        for old_key in evicted:
+            try:
+                os.remove(self.path_for(old_key))
+            except OSError as e:
+                logger.warning(f"Could not evict cached audio {old_key}: {e}")
+        return path
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self._total,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+
+tts_cache = TTSCache()
@@ -0,0 +1,200 @@
+"""
+Process-wide cache for the Flask-Login user loader.
+
+Flask-Login calls the user loader on every authenticated request and
+Socket.IO event. Instead of reading the same users row each time, the
+loader serves an immutable snapshot of the user for up to USER_CACHE_TTL
+seconds. Snapshots are dropped as soon as the user row is updated or
+deleted through the ORM (profile or password changes), see models.py.
+
+With several instances (SOCKETIO_MESSAGE_QUEUE set) each has its own cache:
+- Redis queue: invalidations are published on USER_CACHE_CHANNEL and every
+  instance drops the user at once. After a lost subscription the whole
+  cache is cleared, since invalidations may have been missed.
+- Any other shared queue: there is no channel to publish on, so snapshots
+  are served for at most USER_CACHE_SHARED_TTL seconds. That is how long
+  another instance may still serve a user changed or deleted elsewhere.
+
+Configuration (environment):
+    USER_CACHE_TTL         seconds a snapshot is served (default 300, 0 disables the cache)
+    USER_CACHE_SIZE        users kept, least recently used evicted (default 1000)
+    USER_CACHE_CHANNEL     Redis channel for invalidations (default user-cache-invalidate)
+    USER_CACHE_SHARED_TTL  TTL cap with a non-Redis message queue (default 10)
+"""
+import os
+import time
+import logging
+import threading
+from collections import OrderedDict
+
+from flask_login import UserMixin
+
+logger = logging.getLogger(__name__)
+
+USER_CACHE_TTL = float(os.environ.get("USER_CACHE_TTL", 300))
+USER_CACHE_SIZE = int(os.environ.get("USER_CACHE_SIZE", 1000))
+USER_CACHE_CHANNEL = os.environ.get("USER_CACHE_CHANNEL", "user-cache-invalidate")
+USER_CACHE_SHARED_TTL = float(os.environ.get("USER_CACHE_SHARED_TTL", 10))
+
+# Message that drops every snapshot instead of one user
+CLEAR_ALL = "*"
+
+# Columns copied into the snapshot; password_hash deliberately stays in the database
+SNAPSHOT_FIELDS = ("id", "username", "email", "name", "created_at")
+
+
+class UserSnapshot(UserMixin):
+    """Read-only copy of a User row with the same Flask-Login interface"""
+
+    __slots__ = SNAPSHOT_FIELDS
+
+    def __init__(self, **values):
+        for field in SNAPSHOT_FIELDS:
+            object.__setattr__(self, field, values.get(field))
+
+    @classmethod
+    def from_user(cls, user):
+        return cls(**{field: getattr(user, field) for field in SNAPSHOT_FIELDS})
+
+    def __setattr__(self, name, value):
+        raise AttributeError("UserSnapshot is read-only; load the User model to change it")
+
+    def __repr__(self):
+        return f"<UserSnapshot {self.username}>"
+
+
+class RedisInvalidationBus:
+    """Publishes user-cache invalidations to, and receives them from, the other instances"""
+
+    def __init__(self, url, channel=USER_CACHE_CHANNEL):
+        import redis
+        self.redis = redis.Redis.from_url(url)
+        self.channel = channel
+
+    def publish(self, message):
+        self.redis.publish(self.channel, message)
+
+    def listen(self, on_message, on_resubscribe, sleep=time.sleep):
+        while True:
+            try:
+                pubsub = self.redis.pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(self.channel)
+                # Anything published while we were not subscribed is lost
+                on_resubscribe()
+                for message in pubsub.listen():
+                    data = message.get("data")
+                    on_message(data.decode("utf-8") if isinstance(data, bytes) else str(data))
+            except Exception as e:
+                logger.error(f"User cache invalidation channel error: {e}")
+            sleep(1)
+
+
+class UserCache:
+    def __init__(self, loader, ttl=USER_CACHE_TTL, max_size=USER_CACHE_SIZE, bus=None):
+        self.loader = loader
+        self.ttl = ttl
+        self.max_size = max_size
+        self.bus = bus
+        self._entries = OrderedDict()  # user_id -> (expires_at, snapshot), least recently used first
+        self._lock = threading.Lock()
+        self._generation = 0  # bumped by every invalidation
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, user_id):
+        """Snapshot of the user, or None if no such user exists"""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is not None and entry[0] > now:
+                self._entries.move_to_end(user_id)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+            generation = self._generation
+
+        user = self.loader(user_id)
+        if user is None:
+            with self._lock:
+                self._entries.pop(user_id, None)
+            return None
+        snapshot = UserSnapshot.from_user(user)
+        if self.ttl > 0:
+            with self._lock:
+                if generation != self._generation:
+                    # Invalidated while loading: the row read may already be outdated
+                    return snapshot
+                self._entries[user_id] = (now + self.ttl, snapshot)
+                self._entries.move_to_end(user_id)
+                while len(self._entries) > self.max_size:
+                    self._entries.popitem(last=False)
+        return snapshot
+
+    def invalidate(self, user_id, publish=True):
+        """Drop ``user_id`` here and, with ``publish``, on every other instance"""
+        self._invalidate_local(user_id)
+        if publish:
+            self._publish(str(user_id))
+
+    def clear(self, publish=True):
+        self._clear_local()
+        if publish:
+            self._publish(CLEAR_ALL)
+
+    def _invalidate_local(self, user_id):
+        with self._lock:
+            self._generation += 1
+            self._entries.pop(user_id, None)
+
+    def _clear_local(self):
+        with self._lock:
+            self._generation += 1
+            self._entries.clear()
+
+    def _publish(self, message):
+        if self.bus is None:
+            return
+        try:
+            self.bus.publish(message)
+        except Exception as e:
+            logger.error(f"Could not publish user cache invalidation: {e}")
+
+    def _on_remote(self, message):
+        if message == CLEAR_ALL:
+            self._clear_local()
+            return
+        try:
+            self._invalidate_local(int(message))
+        except ValueError:
+            logger.warning(f"Ignoring invalid user cache invalidation {message!r}")
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "max_size": self.max_size,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "shared": self.bus is not None,
+            }
+
+
+def make_user_cache(loader, message_queue=None, start_background_task=None):
+    """
+    User cache for this deployment: invalidations shared over Redis when the
+    Socket.IO message queue is Redis, a short TTL with any other shared queue.
+    """
+    if message_queue and message_queue.startswith(("redis://", "rediss://")):
+        try:
+            bus = RedisInvalidationBus(message_queue)
+        except ImportError:
+            logger.warning("redis package not installed; user cache TTL capped instead")
+        else:
+            cache = UserCache(loader, bus=bus)
+            start_background_task(bus.listen, cache._on_remote, cache._clear_local)
+            return cache
+    if message_queue and not message_queue.startswith("local://"):
+        # local:// servers share this process, and so this cache
+        return UserCache(loader, ttl=min(USER_CACHE_TTL, USER_CACHE_SHARED_TTL))
+    return UserCache(loader)
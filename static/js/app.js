@@ -604,7 +604,11 @@ function speakText(text) {
         return response.json();
     })
     .then(data => {
-        if (data.audio) {
+        if (data.audio_url) {
+            // Cached audio file served with long-lived caching headers
+            const audio = new Audio(data.audio_url);
+            audio.play();
+        } else if (data.audio) {
             // Convert base64 to URL
             const audioData = 'data:audio/mpeg;base64,' + data.audio;
             const audio = new Audio(audioData);
@@ -51,8 +51,8 @@ document.addEventListener('DOMContentLoaded', function() {
                 return;
             }
 
-            // Create and play audio from base64
-            const audioSrc = 'data:audio/mpeg;base64,' + data.audio;
+            // Play the cached audio file (fall back to inline base64 if present)
+            const audioSrc = data.audio_url || ('data:audio/mpeg;base64,' + data.audio);
 
             const audio = document.createElement('audio');
             audio.controls = true;
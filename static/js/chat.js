@@ -13,6 +13,14 @@ let maxTokens = 2000;
 let recognition;
 let conversationId = null;
 
+// مؤشرات ترقيم الصفحات (keyset) للقائمة الجانبية ولرسائل المحادثة الحالية
+const CONVERSATIONS_PAGE_SIZE = 30;
+const MESSAGES_PAGE_SIZE = 50;
+let conversationsCursor = null;
+let conversationsLoading = false;
+let messagesCursor = null;
+let messagesLoading = false;
+
 // تهيئة المحادثة
 document.addEventListener('DOMContentLoaded', function() {
     // تهيئة القائمة الجانبية
@@ -39,6 +47,18 @@ document.addEventListener('DOMContentLoaded', function() {
     // تحميل المحادثات السابقة
     loadConversations();
 
+    // الترقيم الكسول: المزيد من المحادثات عند نهاية القائمة، ورسائل أقدم عند أعلى المحادثة
+    document.getElementById('conversations-list').addEventListener('scroll', function() {
+        if (this.scrollTop + this.clientHeight >= this.scrollHeight - 50) {
+            loadMoreConversations();
+        }
+    });
+    document.querySelector('.messages-container').addEventListener('scroll', function() {
+        if (this.scrollTop < 50) {
+            loadOlderMessages();
+        }
+    });
+
     // إعداد مربع النص للتمدد تلقائياً
     const messageInput = document.getElementById('message-input');
     messageInput.addEventListener('input', function() {
@@ -352,7 +372,7 @@ function initSpeechRecognition() {
     }
 }
 
-function addMessageToUI(role, content) {
+function addMessageToUI(role, content, prepend = false) {
     const messagesContainer = document.getElementById('messages');
     const messageDiv = document.createElement('div');
     messageDiv.className = `message-bubble ${role}`;
@@ -378,11 +398,20 @@ function addMessageToUI(role, content) {
     contentDiv.innerHTML = `<p>${contentFormatted}</p>`;
 
     messageDiv.appendChild(contentDiv);
+
+    // الرسائل الأقدم المحملة أثناء التمرير تُضاف في الأعلى دون تحريك الشاشة
+    if (prepend) {
+        const firstMessage = messagesContainer.querySelector('.message-bubble');
+        messagesContainer.insertBefore(messageDiv, firstMessage);
+        return contentDiv;
+    }
     messagesContainer.appendChild(messageDiv);
 
     // تمرير الشاشة إلى أسفل
     const scrollContainer = document.querySelector('.messages-container');
     scrollContainer.scrollTop = scrollContainer.scrollHeight;
+
+    return contentDiv;
 }
 
 function formatMessageContent(content) {
@@ -424,7 +453,10 @@ function sendMessage() {
         { role: 'user', content: userMessage }
     ];
 
-    // إرسال الرسالة إلى الخادم
+    // إرسال الرسالة إلى الخادم مع بث الرد تدريجياً
+    let assistantContent = null;
+    let assistantText = '';
+
     fetch('/api/chat', {
         method: 'POST',
         headers: {
@@ -435,42 +467,97 @@ function sendMessage() {
             conversation_id: conversationId,
             model: currentModel,
             temperature: temperature,
-            max_tokens: maxTokens
+            max_tokens: maxTokens,
+            stream: true
         }),
     })
-    .then(response => response.json())
-    .then(data => {
-        // إزالة مؤشر الكتابة
-        removeTypingIndicator();
+    .then(response => {
+        if (response.status === 429) {
+            // تجاوز حد الطلبات: إبلاغ المستخدم بموعد المحاولة التالية بدلاً من رسالة خطأ عامة
+            const retryAfter = response.headers.get('Retry-After') || 1;
+            removeTypingIndicator();
+            showToast(`طلبات كثيرة، يرجى المحاولة بعد ${retryAfter} ثانية`, 'error');
+            return;
+        }
+        if (!response.ok || !response.body) {
+            throw new Error('Network response was not ok');
+        }
+        return readEventStream(response, event => {
+            if (event.delta) {
+                // إنشاء فقاعة الرد عند وصول أول جزء
+                if (!assistantContent) {
+                    removeTypingIndicator();
+                    assistantContent = addMessageToUI('assistant', '');
+                }
+                assistantText += event.delta;
+                assistantContent.innerHTML = `<p>${formatMessageContent(assistantText)}</p>`;
 
-        // إضافة رد المساعد
-        addMessageToUI('assistant', data.message);
+                const scrollContainer = document.querySelector('.messages-container');
+                scrollContainer.scrollTop = scrollContainer.scrollHeight;
+            }
 
-        // تحديث معرف المحادثة إذا كان جديدًا
-        if (data.conversation_id && !conversationId) {
-            conversationId = data.conversation_id;
-            loadConversations(); // تحديث قائمة المحادثات
-        }
+            // تحديث معرف المحادثة إذا كان جديدًا
+            if (event.done && event.conversation_id && !conversationId) {
+                conversationId = event.conversation_id;
+                loadConversations(); // تحديث قائمة المحادثات
+            }
+        });
+    })
+    .then(() => {
+        removeTypingIndicator();
+        if (!assistantText) return;
 
         // قراءة الرد صوتيًا إذا كانت هذه الميزة مفعلة
         const textToSpeechEnabled = localStorage.getItem('textToSpeechEnabled') !== 'false';
         if (textToSpeechEnabled) {
             const useBrowserTTS = localStorage.getItem('useBrowserTTS') === 'true';
             if (useBrowserTTS) {
-                speakTextWithBrowser(data.message);
+                speakTextWithBrowser(assistantText);
             } else {
-                speakText(data.message);
+                speakText(assistantText);
             }
         }
     })
     .catch(error => {
         console.error('Error:', error);
         removeTypingIndicator();
-        addMessageToUI('assistant', 'عذراً، حدث خطأ في معالجة طلبك. يرجى المحاولة مرة أخرى.');
+        if (!assistantContent) {
+            addMessageToUI('assistant', 'عذراً، حدث خطأ في معالجة طلبك. يرجى المحاولة مرة أخرى.');
+        }
         showToast('فشل في الاتصال بالخادم', 'error');
     });
 }
 
+// قراءة استجابة بصيغة server-sent events واستدعاء onEvent لكل حدث
+function readEventStream(response, onEvent) {
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder('utf-8');
+    let buffer = '';
+
+    function pump() {
+        return reader.read().then(({ done, value }) => {
+            if (done) return;
+
+            buffer += decoder.decode(value, { stream: true });
+            const events = buffer.split('\n\n');
+            buffer = events.pop();
+
+            events.forEach(rawEvent => {
+                const dataLines = rawEvent.split('\n')
+                    .filter(line => line.startsWith('data:'))
+                    .map(line => line.slice(5).trim());
+                if (dataLines.length) {
+                    onEvent(JSON.parse(dataLines.join('\n')));
+                }
+            });
+
+            return pump();
+        });
+    }
+
+    return pump();
+}
+
 function showTypingIndicator() {
     const typingIndicator = document.createElement('div');
     typingIndicator.className = 'message-bubble assistant loading';
@@ -505,7 +592,16 @@ function removeTypingIndicator() {
     }
 }
 
+// النصوص الأطول من هذا الحد تُبث صوتياً جملةً بجملة
+const STREAMED_TTS_MIN_CHARS = 200;
+
 function speakText(text) {
+    const canStream = window.MediaSource && MediaSource.isTypeSupported('audio/mpeg');
+    if (canStream && text.length > STREAMED_TTS_MIN_CHARS) {
+        speakTextStreamed(text);
+        return;
+    }
+
     fetch('/api/text-to-speech', {
         method: 'POST',
         headers: {
@@ -540,6 +636,66 @@ function speakText(text) {
     });
 }
 
+// تشغيل الصوت أثناء وصوله: يبدأ التشغيل بعد توليد الجملة الأولى
+function speakTextStreamed(text) {
+    fetch('/api/text-to-speech/stream', {
+        method: 'POST',
+        headers: {
+            'Content-Type': 'application/json',
+        },
+        body: JSON.stringify({ 
+            text: text,
+            voice_id: localStorage.getItem('selectedVoice') || 'EXAVITQu4vr4xnSDxMaL'
+        }),
+    })
+    .then(response => {
+        if (!response.ok || !response.body) {
+            throw new Error('Network response was not ok');
+        }
+
+        const mediaSource = new MediaSource();
+        const audio = new Audio(URL.createObjectURL(mediaSource));
+        const reader = response.body.getReader();
+
+        mediaSource.addEventListener('sourceopen', () => {
+            const sourceBuffer = mediaSource.addSourceBuffer('audio/mpeg');
+            const queue = [];
+            let finished = false;
+
+            function appendNext() {
+                if (sourceBuffer.updating) return;
+                if (queue.length) {
+                    sourceBuffer.appendBuffer(queue.shift());
+                } else if (finished && mediaSource.readyState === 'open') {
+                    mediaSource.endOfStream();
+                }
+            }
+            sourceBuffer.addEventListener('updateend', appendNext);
+
+            function pump() {
+                return reader.read().then(({ done, value }) => {
+                    if (done) {
+                        finished = true;
+                        appendNext();
+                        return;
+                    }
+                    queue.push(value);
+                    appendNext();
+                    return pump();
+                });
+            }
+
+            pump().catch(error => console.error('Error reading TTS stream:', error));
+        }, { once: true });
+
+        audio.play();
+    })
+    .catch(error => {
+        console.error('Error with streamed TTS:', error);
+        speakTextWithBrowser(text);
+    });
+}
+
 function speakTextWithBrowser(text) {
     if ('speechSynthesis' in window) {
         // إيقاف أي نطق جاري
@@ -573,7 +729,8 @@ function speakTextWithBrowser(text) {
 }
 
 function loadConversations() {
-    fetch('/api/conversations')
+    conversationsCursor = null;
+    fetch(`/api/conversations?limit=${CONVERSATIONS_PAGE_SIZE}`)
     .then(response => response.json())
     .then(data => {
         const conversationsList = document.getElementById('conversations-list');
@@ -585,6 +742,7 @@ function loadConversations() {
             data.conversations.forEach(conversation => {
                 addConversationToList(conversation);
             });
+            conversationsCursor = data.has_more ? data.next_cursor : null;
         } else {
             conversationsList.innerHTML = '<div class="empty-conversations">لا توجد محادثات سابقة</div>';
         }
@@ -596,6 +754,23 @@ function loadConversations() {
     });
 }
 
+// تحميل الصفحة التالية من المحادثات عند الاقتراب من نهاية القائمة
+function loadMoreConversations() {
+    if (!conversationsCursor || conversationsLoading) return;
+
+    conversationsLoading = true;
+    fetch(`/api/conversations?limit=${CONVERSATIONS_PAGE_SIZE}&before=${encodeURIComponent(conversationsCursor)}`)
+    .then(response => response.json())
+    .then(data => {
+        (data.conversations || []).forEach(conversation => addConversationToList(conversation));
+        conversationsCursor = data.has_more ? data.next_cursor : null;
+    })
+    .catch(error => console.error('Error loading more conversations:', error))
+    .finally(() => {
+        conversationsLoading = false;
+    });
+}
+
 function addConversationToList(conversation) {
     const conversationsList = document.getElementById('conversations-list');
 
@@ -606,7 +781,7 @@ function addConversationToList(conversation) {
     }
 
     // تنسيق التاريخ
-    const date = new Date(conversation.last_updated);
+    const date = new Date(conversation.updated_at);
     const formattedDate = date.toLocaleDateString('ar-SA');
 
     conversationItem.innerHTML = `
@@ -641,7 +816,8 @@ function addConversationToList(conversation) {
 }
 
 function loadConversation(convId) {
-    fetch(`/get_conversation/${convId}`)
+    messagesCursor = null;
+    fetch(`/api/conversations/${convId}?limit=${MESSAGES_PAGE_SIZE}`)
     .then(response => response.json())
     .then(data => {
         if (data.conversation) {
@@ -652,12 +828,13 @@ function loadConversation(convId) {
             // إضافة تاريخ المحادثة
             addDateToChat();
 
-            // إضافة جميع الرسائل
-            if (data.conversation.messages && data.conversation.messages.length > 0) {
-                data.conversation.messages.forEach(message => {
+            // إضافة أحدث الرسائل؛ الأقدم تُحمّل عند التمرير للأعلى
+            if (data.messages && data.messages.length > 0) {
+                data.messages.forEach(message => {
                     addMessageToUI(message.role, message.content);
                 });
             }
+            messagesCursor = data.has_more ? data.next_cursor : null;
 
             // تحديث معرف المحادثة الحالية
             conversationId = convId;
@@ -685,6 +862,35 @@ function loadConversation(convId) {
     });
 }
 
+// تحميل الرسائل الأقدم عند التمرير إلى أعلى المحادثة
+function loadOlderMessages() {
+    if (!conversationId || !messagesCursor || messagesLoading) return;
+
+    messagesLoading = true;
+    const requestedConversation = conversationId;
+    const scrollContainer = document.querySelector('.messages-container');
+
+    fetch(`/api/conversations/${requestedConversation}?limit=${MESSAGES_PAGE_SIZE}&before=${encodeURIComponent(messagesCursor)}`)
+    .then(response => response.json())
+    .then(data => {
+        // تجاهل الاستجابة إذا انتقل المستخدم إلى محادثة أخرى
+        if (requestedConversation !== conversationId) return;
+
+        const previousHeight = scrollContainer.scrollHeight;
+        (data.messages || []).slice().reverse().forEach(message => {
+            addMessageToUI(message.role, message.content, true);
+        });
+        // الحفاظ على موضع القراءة بعد إضافة الرسائل في الأعلى
+        scrollContainer.scrollTop += scrollContainer.scrollHeight - previousHeight;
+
+        messagesCursor = data.has_more ? data.next_cursor : null;
+    })
+    .catch(error => console.error('Error loading older messages:', error))
+    .finally(() => {
+        messagesLoading = false;
+    });
+}
+
 function startNewConversation() {
     // مسح محتوى المحادثة الحالية
     const messagesContainer = document.getElementById('messages');
@@ -692,6 +898,7 @@ function startNewConversation() {
 
     // إعادة تعيين معرف المحادثة
     conversationId = null;
+    messagesCursor = null;
 
     // إضافة تاريخ اليوم
     addDateToChat();
@@ -779,10 +986,16 @@ function exportChat() {
         return;
     }
 
-    fetch(`/get_conversation/${conversationId}`)
-    .then(response => response.json())
-    .then(data => {
+    fetch(`/api/export?conversation_id=${conversationId}`)
+    .then(response => response.text())
+    .then(body => {
+        // ملف NDJSON: سطر للمحادثة ثم سطر لكل رسالة
+        const records = body.split('\n').filter(line => line.trim()).map(line => JSON.parse(line));
+        const data = {
+            conversation: records.find(record => record.type === 'conversation')
+        };
         if (data.conversation) {
+            data.conversation.messages = records.filter(record => record.type === 'message');
             // تجهيز محتوى التصدير
             let exportContent = `# ${data.conversation.title}\n`;
             exportContent += `تاريخ: ${new Date(data.conversation.created_at).toLocaleDateString('ar-SA')}\n\n`;
@@ -20,12 +20,17 @@ document.addEventListener('DOMContentLoaded', function() {
         messageInput: document.getElementById('message-input'),
         sendButton: document.getElementById('send-button'),
         statusMessage: document.getElementById('status-message'),
-        usersList: document.getElementById('users-list')
+        usersList: document.getElementById('users-list'),
+        usersCount: document.getElementById('users-count')
     };
 
     let currentUsername = '';
     let typingTimeout;
+    // فقاعات ردود ياسمين التي يجري بثها حالياً، حسب stream_id
+    const activeStreams = {};
     let reconnectionAttempts = 0;
+    // أعضاء الغرفة: اسم المستخدم -> عدد الاتصالات (التبويبات) المفتوحة
+    let roster = new Map();
 
     // مستمعو الأحداث
     setupEventListeners();
@@ -61,9 +66,17 @@ document.addEventListener('DOMContentLoaded', function() {
         socket.on('server_status', handleServerStatus);
         socket.on('join_response', handleJoinResponse);
         socket.on('message', handleIncomingMessage);
+        socket.on('message_batch', handleMessageBatch);
         socket.on('status', handleStatusMessage);
         socket.on('user_list_update', updateUsersList);
         socket.on('typing', handleUserTyping);
+        socket.on('ai_stream_start', handleAiStreamStart);
+        socket.on('ai_stream_delta', handleAiStreamDelta);
+        socket.on('room_history', handleRoomHistory);
+        socket.on('message_packed', handleMessagePacked);
+        socket.on('room_history_packed', handleRoomHistoryPacked);
+        socket.on('presence', handlePresence);
+        socket.on('rate_limited', handleRateLimited);
     }
 
     function handleConnect() {
@@ -114,6 +127,12 @@ document.addEventListener('DOMContentLoaded', function() {
 
             displaySystemMessage(`مرحباً بك في الغرفة يا ${escapeHTML(currentUsername)}!`);
             elements.statusMessage.textContent = `في الغرفة: ${escapeHTML(data.room)}`;
+
+            // لقطة الأعضاء عند الانضمام، ثم تحديثات presence التدريجية
+            if (data.roster) {
+                roster = new Map(data.roster.users.map(user => [user.username, user.connections]));
+                renderRoster(data.roster.count);
+            }
         } else {
             showToast(data.msg, 'error');
             elements.joinButton.disabled = false;
@@ -121,11 +140,77 @@ document.addEventListener('DOMContentLoaded', function() {
     }
 
     function handleIncomingMessage(data) {
+        // الرسالة النهائية لرد تم بثه: استبدال النص المبثوث بالنص الكامل
+        if (data.stream_id && activeStreams[data.stream_id]) {
+            activeStreams[data.stream_id].textContent = data.message;
+            delete activeStreams[data.stream_id];
+            elements.messagesBox.scrollTop = elements.messagesBox.scrollHeight;
+            return;
+        }
+
         const messageType = data.username === currentUsername ? 'self' : 'user';
         displayMessage(data.message, messageType, data.username);
         elements.messagesBox.scrollTop = elements.messagesBox.scrollHeight;
     }
 
+    // آخر رسائل الغرفة تصل مرة واحدة عند الانضمام
+    function handleRoomHistory(data) {
+        if (!data.messages || data.messages.length === 0) return;
+
+        data.messages.forEach(message => {
+            const messageType = message.username === currentUsername ? 'self' : 'user';
+            displayMessage(message.message, messageType, message.username, message.timestamp);
+        });
+        displaySystemMessage('— الرسائل السابقة —');
+        elements.messagesBox.scrollTop = elements.messagesBox.scrollHeight;
+    }
+
+    // الغرف المزدحمة ترسل رسائلها مجمعة في إطار واحد كل بضع أجزاء من الثانية
+    function handleMessageBatch(data) {
+        (data.messages || []).forEach(handleIncomingMessage);
+    }
+
+    // الصيغة المضغوطة: قائمة رسائل MessagePack بمفاتيح قصيرة ووقت بالمللي ثانية منذ 1970
+    function unpackMessages(data) {
+        return window.msgpackDecode(data).map(message => ({
+            username: message.u,
+            message: message.m,
+            timestamp: message.t,
+            stream_id: message.s
+        }));
+    }
+
+    function handleMessagePacked(data) {
+        unpackMessages(data).forEach(handleIncomingMessage);
+    }
+
+    function handleRoomHistoryPacked(data) {
+        handleRoomHistory({ messages: unpackMessages(data) });
+    }
+
+    // تجاوز حد الرسائل: تعطيل زر الإرسال حتى يسمح الخادم بالمحاولة مجدداً
+    function handleRateLimited(data) {
+        const seconds = Math.max(1, Math.ceil(data.retry_after || 1));
+        showToast(`أرسلت رسائل كثيرة بسرعة، حاول بعد ${seconds} ثانية`, 'error');
+        elements.sendButton.disabled = true;
+        setTimeout(() => {
+            elements.sendButton.disabled = false;
+        }, seconds * 1000);
+    }
+
+    function handleAiStreamStart(data) {
+        const messageElement = displayMessage('', 'user', data.username);
+        activeStreams[data.stream_id] = messageElement.querySelector('.message-text');
+    }
+
+    function handleAiStreamDelta(data) {
+        const textElement = activeStreams[data.stream_id];
+        if (!textElement) return;
+
+        textElement.textContent += data.delta;
+        elements.messagesBox.scrollTop = elements.messagesBox.scrollHeight;
+    }
+
     function handleStatusMessage(data) {
         displaySystemMessage(data.msg);
     }
@@ -142,7 +227,25 @@ document.addEventListener('DOMContentLoaded', function() {
         }
     }
 
+    function handlePresence(delta) {
+        if (delta.action === 'join') {
+            roster.set(delta.username, 1);
+        } else if (delta.action === 'leave') {
+            roster.delete(delta.username);
+        }
+        renderRoster(delta.count);
+    }
+
+    function renderRoster(count) {
+        const users = Array.from(roster.keys()).sort().map(username => ({ username, status: 'online' }));
+        updateUsersList(users);
+        if (elements.usersCount) {
+            elements.usersCount.textContent = `المتصلون: ${count !== undefined ? count : users.length}`;
+        }
+    }
+
     function updateUsersList(users) {
+        if (!elements.usersList) return;
         elements.usersList.innerHTML = '';
         users.forEach(user => {
             const userElement = document.createElement('div');
@@ -167,7 +270,9 @@ document.addEventListener('DOMContentLoaded', function() {
 
         socket.emit('join', {
             username: username,
-            room: 'default_room'
+            room: 'default_room',
+            // الصيغة المضغوطة لرسائل الغرفة متاحة فقط إذا حُمِّل msgpack.js
+            formats: window.msgpackDecode ? ['msgpack'] : []
         });
 
         setTimeout(() => {
@@ -199,11 +304,11 @@ document.addEventListener('DOMContentLoaded', function() {
         }, 1000);
     }
 
-    function displayMessage(content, type, username) {
+    function displayMessage(content, type, username, sentAt) {
         const messageElement = document.createElement('div');
         messageElement.className = `chat-message ${type}`;
 
-        const timestamp = new Date().toLocaleTimeString('ar-SA', {
+        const timestamp = (sentAt ? new Date(sentAt) : new Date()).toLocaleTimeString('ar-SA', {
             hour: '2-digit',
             minute: '2-digit'
         });
@@ -225,6 +330,8 @@ document.addEventListener('DOMContentLoaded', function() {
 
         elements.messagesBox.appendChild(messageElement);
         elements.messagesBox.scrollTop = elements.messagesBox.scrollHeight;
+
+        return messageElement;
     }
 
     function displaySystemMessage(message) {
@@ -21,8 +21,9 @@ document.addEventListener('DOMContentLoaded', function() {
         })
         .then(response => response.json())
         .then(data => {
-            if (data.audio) {
-                const audio = new Audio('data:audio/mpeg;base64,' + data.audio);
+            // الصوت يُقدم من ذاكرة الخادم المؤقتة عبر audio_url
+            if (data.audio_url) {
+                const audio = new Audio(data.audio_url);
                 audio.play();
             }
         })
@@ -0,0 +1,29 @@
+"""The hot queries of the app must search their indexes on the migrated schema."""
+import pytest
+from sqlalchemy import create_engine, text
+
+from app import app, db
+from migrations import HOT_QUERIES, run_migrations, check_query_plans, compile_query, explain
+
+
+@pytest.fixture
+def migrated_engine(tmp_path):
+    # A separate SQLite file, whatever DATABASE_URL the app was started with
+    engine = create_engine(f"sqlite:///{tmp_path / 'plans.db'}")
+    with app.app_context():
+        db.metadata.create_all(engine)
+        run_migrations(engine)
+        yield engine
+    engine.dispose()
+
+
+def test_hot_queries_use_their_indexes(migrated_engine):
+    assert check_query_plans(migrated_engine, verbose=False) == []
+
+
+@pytest.mark.parametrize("description, build_query, index_name", HOT_QUERIES, ids=[q[0] for q in HOT_QUERIES])
+def test_hot_query_plan_has_no_scan(migrated_engine, description, build_query, index_name):
+    with migrated_engine.connect() as conn:
+        plan = explain(conn, migrated_engine, compile_query(build_query(), migrated_engine))
+    assert "SCAN" not in plan.upper(), plan
+    assert index_name in plan
@@ -0,0 +1,260 @@
+# transfer.py
+
+# تصدير المحادثات واستيرادها بصيغة NDJSON (سطر JSON لكل سجل)، مع ضغط gzip اختياري.
+# التصدير يمر على الجداول بمؤشرات من جهة الخادم (yield_per) فيبقى استهلاك الذاكرة ثابتاً
+# مهما كان عدد الرسائل، والاستيراد يدرج السجلات على دفعات (executemany).
+#
+# صيغة الملف: سطر ترويسة {"type": "export", ...} ثم كل المحادثات {"type": "conversation", ...}
+# ثم كل الرسائل {"type": "message", "conversation_id": ...} حيث conversation_id هو معرف المحادثة في الملف.
+#
+# الاستخدام:
+#   python transfer.py export [--gzip] [--conversation ID ...] [-o FILE]
+#   python transfer.py import FILE            (يتعرف على ملفات gzip تلقائياً)
+#
+# حدود الاستيراد عبر الواجهة (/api/import)؛ أداة سطر الأوامر بلا حدود:
+#   IMPORT_MAX_BYTES          أقصى حجم لجسم الطلب (افتراضياً 10 ميغابايت)
+#   IMPORT_MAX_DECODED_BYTES  أقصى حجم بعد فك ضغط gzip (افتراضياً 100 ميغابايت)
+#   IMPORT_MAX_CONVERSATIONS  أقصى عدد محادثات في الملف (افتراضياً 1000)
+#   IMPORT_MAX_MESSAGES       أقصى عدد رسائل في الملف (افتراضياً 50000)
+
+import io
+import os
+import sys
+import gzip
+import json
+import zlib
+import logging
+import argparse
+from datetime import datetime, timezone
+
+from sqlalchemy import select
+
+from app import app, db
+from models import Conversation, Message
+from services.arabic_text import normalize_arabic
+
+logger = logging.getLogger(__name__)
+
+EXPORT_FORMAT_VERSION = 1
+
+# عدد الصفوف المقروءة من قاعدة البيانات أو المدرجة فيها في كل دفعة
+DEFAULT_BATCH_SIZE = 1000
+
+IMPORT_MAX_BYTES = int(os.environ.get('IMPORT_MAX_BYTES', 10 * 1024 * 1024))
+IMPORT_MAX_DECODED_BYTES = int(os.environ.get('IMPORT_MAX_DECODED_BYTES', 100 * 1024 * 1024))
+IMPORT_MAX_CONVERSATIONS = int(os.environ.get('IMPORT_MAX_CONVERSATIONS', 1000))
+IMPORT_MAX_MESSAGES = int(os.environ.get('IMPORT_MAX_MESSAGES', 50000))
+
+CONVERSATION_FIELDS = ('id', 'title', 'created_at', 'updated_at')
+MESSAGE_FIELDS = ('id', 'conversation_id', 'role', 'content', 'created_at', 'feedback', 'message_metadata')
+
+
+class ImportLimitError(ValueError):
+    """ملف الاستيراد يتجاوز أحد حدود الاستيراد"""
+
+
+def _to_json_value(value):
+    return value.isoformat() if isinstance(value, datetime) else value
+
+
+def _parse_datetime(value):
+    return datetime.fromisoformat(value) if value else datetime.now(timezone.utc)
+
+
+def iter_export_records(conversation_ids=None, batch_size=DEFAULT_BATCH_SIZE):
+    """سجلات التصدير واحداً تلو الآخر، مقروءة من قاعدة البيانات على دفعات"""
+    yield {
+        'type': 'export',
+        'version': EXPORT_FORMAT_VERSION,
+        'exported_at': datetime.now(timezone.utc).isoformat(),
+    }
+
+    conversation = Conversation.__table__
+    message = Message.__table__
+    # المحادثات المحذوفة التي ما زالت رسائلها تُحذف في الخلفية لا تُصدر
+    live = select(conversation.c.id).where(conversation.c.deleted_at.is_(None))
+    if conversation_ids:
+        live = live.where(conversation.c.id.in_(conversation_ids))
+    tables = (
+        ('conversation', conversation, CONVERSATION_FIELDS, conversation.c.id),
+        ('message', message, MESSAGE_FIELDS, message.c.conversation_id),
+    )
+    for record_type, table, fields, conversation_column in tables:
+        stmt = (select(*(table.c[field] for field in fields))
+                .where(conversation_column.in_(live))
+                .order_by(table.c.id))
+        result = db.session.execute(stmt.execution_options(yield_per=batch_size))
+        for row in result:
+            record = {'type': record_type}
+            record.update((field, _to_json_value(value)) for field, value in zip(fields, row))
+            yield record
+
+
+def export_ndjson(conversation_ids=None, compress=False, batch_size=DEFAULT_BATCH_SIZE):
+    """أجزاء bytes من ملف التصدير، دفعة من الأسطر في كل جزء"""
+    # wbits=31: ترويسة gzip كاملة حتى يفتح الملف بأي أداة gunzip
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31) if compress else None
+    lines = []
+    for record in iter_export_records(conversation_ids, batch_size):
+        lines.append(json.dumps(record, ensure_ascii=False))
+        if len(lines) >= batch_size:
+            chunk = ('\n'.join(lines) + '\n').encode('utf-8')
+            lines = []
+            chunk = compressor.compress(chunk) if compressor else chunk
+            if chunk:
+                yield chunk
+
+    chunk = ('\n'.join(lines) + '\n').encode('utf-8') if lines else b''
+    if compressor:
+        chunk = compressor.compress(chunk) + compressor.flush()
+    if chunk:
+        yield chunk
+
+
+def open_import_stream(fileobj):
+    """تغليف ملف الاستيراد بفك ضغط gzip إذا بدأ بتوقيعه"""
+    if not hasattr(fileobj, 'peek'):
+        fileobj = io.BufferedReader(fileobj)
+    if fileobj.peek(2)[:2] == b'\x1f\x8b':
+        return gzip.GzipFile(fileobj=fileobj)
+    return fileobj
+
+
+def read_lines(stream, max_bytes):
+    """أسطر stream حتى max_bytes بايت إجمالاً؛ لا يُقرأ سطر أطول من المتبقي إلى الذاكرة"""
+    remaining = max_bytes
+    while True:
+        line = stream.readline(remaining + 1)
+        if not line:
+            return
+        remaining -= len(line)
+        if remaining < 0:
+            raise ImportLimitError(f'Import is larger than {max_bytes} bytes')
+        yield line
+
+
+def import_ndjson(lines, batch_size=DEFAULT_BATCH_SIZE, max_conversations=None, max_messages=None, atomic=False):
+    """
+    استيراد أسطر NDJSON (bytes أو str) كمحادثات جديدة. تحصل المحادثات على معرفات
+    جديدة وتُربط رسائلها بها. تُثبت كل دفعة رسائل على حدة، فالاستيراد الذي يفشل في
+    منتصفه يترك الدفعات السابقة في قاعدة البيانات؛ مع atomic=True يُثبت كل شيء مرة
+    واحدة في النهاية أو لا شيء. يرفع ImportLimitError إذا تجاوز الملف max_conversations
+    أو max_messages. يعيد إحصاءات الاستيراد.
+    """
+    conversation = Conversation.__table__
+    message = Message.__table__
+    id_map = {}  # معرف المحادثة في الملف -> المعرف الجديد
+    pending_conversations = []
+    pending_messages = []
+    stats = {'conversations': 0, 'messages': 0, 'skipped': 0}
+
+    def flush_conversations():
+        if not pending_conversations:
+            return
+        stmt = conversation.insert().returning(conversation.c.id, sort_by_parameter_order=True)
+        rows = [values for _, values in pending_conversations]
+        new_ids = db.session.execute(stmt, rows).scalars().all()
+        for (old_id, _), new_id in zip(pending_conversations, new_ids):
+            id_map[old_id] = new_id
+        stats['conversations'] += len(new_ids)
+        pending_conversations.clear()
+
+    def flush_messages():
+        if not pending_messages:
+            return
+        db.session.execute(message.insert(), pending_messages)
+        # الإدراج بالجملة لا يمر عبر أحداث ORM، لذا نعيد حساب عدادات المحادثات المتأثرة
+        Conversation.refresh_stats(list({row['conversation_id'] for row in pending_messages}))
+        stats['messages'] += len(pending_messages)
+        pending_messages.clear()
+        if not atomic:
+            db.session.commit()
+
+    try:
+        for line_number, line in enumerate(lines, 1):
+            if isinstance(line, bytes):
+                line = line.decode('utf-8')
+            line = line.strip()
+            if not line:
+                continue
+            record = json.loads(line)
+            record_type = record.get('type')
+
+            if record_type == 'export':
+                if record.get('version') != EXPORT_FORMAT_VERSION:
+                    raise ValueError(f"Unsupported export version: {record.get('version')}")
+            elif record_type == 'conversation':
+                if max_conversations is not None and len(id_map) + len(pending_conversations) >= max_conversations:
+                    raise ImportLimitError(f'Import has more than {max_conversations} conversations')
+                pending_conversations.append((record['id'], {
+                    'title': record.get('title') or 'محادثة جديدة',
+                    'created_at': _parse_datetime(record.get('created_at')),
+                    'updated_at': _parse_datetime(record.get('updated_at')),
+                    'message_count': 0,
+                }))
+                if len(pending_conversations) >= batch_size:
+                    flush_conversations()
+            elif record_type == 'message':
+                flush_conversations()
+                conversation_id = id_map.get(record.get('conversation_id'))
+                if conversation_id is None:
+                    stats['skipped'] += 1
+                    continue
+                if max_messages is not None and stats['messages'] + len(pending_messages) >= max_messages:
+                    raise ImportLimitError(f'Import has more than {max_messages} messages')
+                content = record.get('content') or ''
+                pending_messages.append({
+                    'conversation_id': conversation_id,
+                    'role': record.get('role') or 'user',
+                    'content': content,
+                    'search_text': normalize_arabic(content),
+                    'created_at': _parse_datetime(record.get('created_at')),
+                    'feedback': record.get('feedback'),
+                    'message_metadata': record.get('message_metadata'),
+                })
+                if len(pending_messages) >= batch_size:
+                    flush_messages()
+            else:
+                logger.warning(f"Skipping line {line_number}: unknown record type {record_type!r}")
+                stats['skipped'] += 1
+
+        flush_conversations()
+        flush_messages()
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    return stats
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description='Export or import conversations as NDJSON')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    export_parser = commands.add_parser('export')
+    export_parser.add_argument('-o', '--output', help='output file (default stdout)')
+    export_parser.add_argument('--gzip', action='store_true', help='gzip the output')
+    export_parser.add_argument('--conversation', type=int, action='append', help='export only this conversation')
+    export_parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE)
+
+    import_parser = commands.add_parser('import')
+    import_parser.add_argument('input', help='NDJSON or gzipped NDJSON file ("-" for stdin)')
+    import_parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE)
+
+    args = parser.parse_args()
+    with app.app_context():
+        if args.command == 'export':
+            out = open(args.output, 'wb') if args.output else sys.stdout.buffer
+            try:
+                for chunk in export_ndjson(args.conversation, compress=args.gzip, batch_size=args.batch_size):
+                    out.write(chunk)
+            finally:
+                if args.output:
+                    out.close()
+        else:
+            source = sys.stdin.buffer if args.input == '-' else open(args.input, 'rb')
+            with source:
+                stats = import_ndjson(open_import_stream(source), batch_size=args.batch_size)
+            print(f"Imported {stats['conversations']} conversations and {stats['messages']} messages"
+                  f" ({stats['skipped']} records skipped)", file=sys.stderr)